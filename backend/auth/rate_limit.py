@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+# 登录限流配置：窗口内失败次数超过上限后拒绝登录，直到最早的失败记录移出窗口
+LOGIN_RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("LOGIN_RATE_LIMIT_WINDOW_SECONDS", "300"))
+# 同一IP对同一用户名的失败次数上限
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "5"))
+# 同一IP对所有用户名的失败次数上限，防止换用户名撞库
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "50"))
+
+class LoginRateLimiter:
+    """
+    按 IP+用户名 和 IP 统计登录失败次数的滑动窗口限流器
+
+    被限流的请求在校验密码之前就被拒绝，不占用密码哈希线程池；登录成功后清除该用户名的失败记录。
+    计数保存在进程内，多进程部署时每个进程单独计数
+    """
+    def __init__(
+        self,
+        window_seconds: float = LOGIN_RATE_LIMIT_WINDOW_SECONDS,
+        max_failures_per_user: int = LOGIN_MAX_FAILURES_PER_USER,
+        max_failures_per_ip: int = LOGIN_MAX_FAILURES_PER_IP
+    ):
+        self.window_seconds = window_seconds
+        self.limits = {"user": max_failures_per_user, "ip": max_failures_per_ip}
+        self._failures: Dict[Tuple, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(ip: str, username: str):
+        return ("user", ip, username.lower()), ("ip", ip)
+
+    def _prune(self, key: Tuple, now: float) -> Deque[float]:
+        failures = self._failures.get(key)
+        if failures is None:
+            return deque()
+        while failures and failures[0] <= now - self.window_seconds:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+        return failures
+
+    def retry_after(self, ip: str, username: str) -> float:
+        """被限流时返回需要等待的秒数，否则返回0"""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key in self._keys(ip, username):
+                limit = self.limits[key[0]]
+                failures = self._prune(key, now)
+                if limit > 0 and len(failures) >= limit:
+                    wait = max(wait, failures[-limit] + self.window_seconds - now)
+        return wait
+
+    def record_failure(self, ip: str, username: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(ip, username):
+                self._prune(key, now)
+                self._failures.setdefault(key, deque()).append(now)
+            # 定期清理过期的键，避免随不同IP和用户名无限增长
+            if len(self._failures) > 10000:
+                for key in list(self._failures):
+                    self._prune(key, now)
+
+    def reset(self, ip: str, username: str) -> None:
+        """登录成功后清除该IP对该用户名的失败记录"""
+        with self._lock:
+            self._failures.pop(self._keys(ip, username)[0], None)
+
+login_rate_limiter = LoginRateLimiter()
@@ -8,18 +8,17 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from common import crud # 导入 crud 模块
 from models.role import Role # 导入 Role 模型
 from models.permission import Permission # 导入 Permission 模型
 from schemas import Token, User # 导入 Token 和 User Schema
 from config.database import get_db
-from auth.security import create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES # 导入安全相关的函数和常量
+from auth.security import create_access_token, get_current_user, authenticate_user, ACCESS_TOKEN_EXPIRE_MINUTES # 导入安全相关的函数和常量
 
 router = APIRouter()
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
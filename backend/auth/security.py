@@ -2,21 +2,39 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, FrozenSet, NamedTuple, Callable, Tuple
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from backend.config.database import get_db
 from backend.models.user import User
+from backend.models.role import Role
 
 # 密码哈希配置
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt 成本参数；修改后，旧参数生成的哈希会在用户下次登录时自动按新参数重新哈希
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+# 密码哈希线程池大小：bcrypt 计算时释放GIL，线程池即可并行，同时限制同一时间占用的CPU核数
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
 
 # JWT 配置
 SECRET_KEY = "your-secret-key-here"  # ⚠️ 替换为安全密钥！建议从环境变量加载
@@ -26,11 +44,68 @@ REMEMBER_ME_TOKEN_EXPIRE_DAYS = 7 # 记住我令牌过期时间（7天）
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# 认证用户缓存：令牌对应的用户（含角色和权限）缓存一段时间，避免每个请求都查询数据库
+# 缓存在进程内，多进程部署时其他进程最多在TTL内看到旧的角色和权限
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# 超级管理员角色，拥有所有权限
+ADMIN_ROLE = "admin"
+
+_password_executor: Optional[ThreadPoolExecutor] = None
+_password_executor_lock = threading.Lock()
+
+def _get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        with _password_executor_lock:
+            if _password_executor is None:
+                _password_executor = ThreadPoolExecutor(
+                    max_workers=max(1, PASSWORD_HASH_WORKERS), thread_name_prefix="password-hash"
+                )
+    return _password_executor
+
+async def _run_in_password_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_password_executor(), func, *args)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    在密码哈希线程池中校验密码，不阻塞事件循环
+
+    Returns:
+        (是否正确, 新哈希)；哈希的成本参数或算法已过时时返回按当前配置生成的新哈希，否则为None
+    """
+    return await _run_in_password_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """在密码哈希线程池中生成密码哈希"""
+    return await _run_in_password_pool(pwd_context.hash, password)
+
+async def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    """
+    校验用户名和密码，成功时返回用户（已加载角色）
+
+    用户不存在时也做一次同等耗时的哈希校验，避免通过响应时间判断用户名是否存在；
+    密码正确但哈希参数已过时时，顺便保存按当前参数生成的新哈希
+    """
+    user = db.query(User).options(joinedload(User.roles)).filter(User.username == username).first()
+    if user is None:
+        await _run_in_password_pool(pwd_context.dummy_verify)
+        return None
+    valid, new_hash = await verify_password_async(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+    return user
+
+def shutdown_password_executor() -> None:
+    """关闭密码哈希线程池"""
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False)
+        _password_executor = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, remember_me: bool = False):
     to_encode = data.copy()
@@ -40,11 +115,108 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, r
         expire = datetime.utcnow() + timedelta(days=REMEMBER_ME_TOKEN_EXPIRE_DAYS)
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti 作为令牌ID，用作认证用户缓存的键
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class Principal(NamedTuple):
+    """已认证用户及其角色名和有效权限名集合，权限检查只需查集合，不再访问数据库"""
+    user: User
+    roles: FrozenSet[str]
+    permissions: FrozenSet[str]
+
+    def has_role(self, role: str) -> bool:
+        return role in self.roles
+
+    def has_permission(self, permission: str) -> bool:
+        return permission in self.permissions or ADMIN_ROLE in self.roles
+
+class PrincipalCache:
+    """
+    令牌ID -> Principal 的TTL缓存
+
+    缓存的用户对象已从会话中分离，角色和权限已预先加载，只可读取，不能在会话中修改
+    """
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            return principal
+
+    def set(self, key: str, principal: Principal, token_exp: Optional[float] = None) -> None:
+        if self.ttl <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        if token_exp is not None:
+            # 不超过令牌本身的过期时间
+            expires_at = min(expires_at, time.monotonic() + token_exp - time.time())
+        with self._lock:
+            self._entries[key] = (principal, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """移除某个用户的所有令牌缓存"""
+        with self._lock:
+            for key in [key for key, (principal, _) in self._entries.items() if principal.user.id == user_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+principal_cache = PrincipalCache()
+
+def invalidate_user_principal(user_id: int) -> None:
+    """用户信息、角色或密码修改后调用"""
+    principal_cache.invalidate_user(user_id)
+
+def clear_principal_cache() -> None:
+    """角色或权限修改后调用，影响的用户不确定，全部清除"""
+    principal_cache.clear()
+
+def _token_id(token: str, payload: dict) -> str:
+    # 旧令牌没有jti，使用令牌内容的哈希
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+def load_principal(db: Session, username: str) -> Optional[Principal]:
+    """
+    用一条关联查询加载用户、角色和权限，编译为角色名和权限名集合
+
+    加载的对象从会话中分离，供缓存在请求之间共享
+    """
+    user = (
+        db.query(User)
+        .options(joinedload(User.roles).joinedload(Role.permissions))
+        .filter(User.username == username)
+        .first()
+    )
+    if user is None:
+        return None
+    permissions = {perm for role in user.roles for perm in role.permissions}
+    for obj in [user, *user.roles, *permissions]:
+        if obj in db:
+            db.expunge(obj)
+    return Principal(
+        user=user,
+        roles=frozenset(role.name for role in user.roles),
+        permissions=frozenset(perm.name for perm in permissions)
+    )
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -57,7 +229,35 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
+    key = _token_id(token, payload)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        return principal
+    principal = load_principal(db, username)
+    if principal is None:
         raise credentials_exception
-    return user 
\ No newline at end of file
+    principal_cache.set(key, principal, payload.get("exp"))
+    return principal
+
+def get_current_user(principal: Principal = Depends(get_current_principal)) -> User:
+    return principal.user
+
+def require_permission(*permissions: str) -> Callable[..., User]:
+    """
+    权限检查依赖：当前用户须拥有全部指定权限，admin角色拥有所有权限
+
+    用法: current_user: User = Depends(require_permission("kb:write"))
+    """
+    def dependency(principal: Principal = Depends(get_current_principal)) -> User:
+        if not all(principal.has_permission(permission) for permission in permissions):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="您没有执行此操作的权限")
+        return principal.user
+    return dependency
+
+def require_role(role: str, detail: Optional[str] = None) -> Callable[..., User]:
+    """角色检查依赖：当前用户须拥有指定角色"""
+    def dependency(principal: Principal = Depends(get_current_principal)) -> User:
+        if not principal.has_role(role):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail or f"您没有{role}角色")
+        return principal.user
+    return dependency
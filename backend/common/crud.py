@@ -3,14 +3,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
+from sqlalchemy import func, select
 from typing import Optional, List
 
 from models.user import User
 from models.role import Role
 from models.permission import Permission
+from models.associations import user_roles, role_permissions
 from schemas import UserCreate, RoleCreate, PermissionCreate, UserUpdate # 导入相关Schema
-from auth.security import get_password_hash, verify_password # 导入密码哈希和验证函数
+from .pagination import apply_page, page_items, cached_count
 
 def get_user_by_username(db: Session, username: str):
     return db.query(User).options(joinedload(User.roles)).filter(User.username == username).first()
@@ -20,27 +21,21 @@ def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
 # 新增：获取用户列表 (带分页和搜索)
-def get_users(db: Session, skip: int = 0, limit: int = 10, search: Optional[str] = None):
-    query = db.query(User).options(joinedload(User.roles))
+# 用户表没有created_at，按id做keyset分页；传入cursor时从上一页末尾继续，不再使用OFFSET
+def get_users(db: Session, skip: int = 0, limit: int = 10, search: Optional[str] = None, cursor: Optional[str] = None):
+    query = db.query(User)
     if search:
         query = query.filter(User.username.ilike(f"%{search}%") | User.email.ilike(f"%{search}%"))
-    users = query.offset(skip).limit(limit).all()
-    total = query.count()
-    return users, total
+    total = cached_count(("users", search), query.count) # 总数短时间缓存，是近似值
+    rows = apply_page(query.options(joinedload(User.roles)), [User.id], limit, cursor, skip).all()
+    users, next_cursor = page_items(rows, [User.id], limit)
+    return users, total, next_cursor
 
 def get_user_by_id(db: Session, user_id: int):
     return db.query(User).filter(User.id == user_id).first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
-        return None
-    return user
-
-def create_user(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password) # 对密码进行哈希
+# 密码哈希很慢，由调用方用 get_password_hash_async 在线程池中计算后传入，不在事件循环中执行
+def create_user(db: Session, user: UserCreate, hashed_password: str):
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password, full_name=user.full_name)
     db.add(db_user)
     db.commit()
@@ -78,18 +73,30 @@ def create_role(db: Session, role: RoleCreate):
     return db_role
 
 # 获取角色列表 (带分页和搜索)
-def get_roles(db: Session, skip: int = 0, limit: int = 10, search: Optional[str] = None):
-    query = db.query(Role).options(joinedload(Role.permissions)).options(joinedload(Role.users))
+# 列表只返回用户数和权限数，由关联子查询在同一条SQL中统计，不加载用户和权限；权限明细通过 get_role_by_id 按需获取
+def get_roles(db: Session, skip: int = 0, limit: int = 10, search: Optional[str] = None, cursor: Optional[str] = None):
+    query = db.query(Role)
     if search:
         query = query.filter(Role.name.ilike(f"%{search}%") | Role.description.ilike(f"%{search}%"))
-    roles = query.offset(skip).limit(limit).all()
-    total = query.count()
-    
-    # 手动计算userCount
-    for role in roles:
-        role.userCount = len(role.users)
+    total = cached_count(("roles", search), query.count) # 总数短时间缓存，是近似值
+
+    user_count = (
+        select(func.count()).select_from(user_roles).where(user_roles.c.role_id == Role.id)
+        .correlate(Role).scalar_subquery()
+    )
+    permission_count = (
+        select(func.count()).select_from(role_permissions).where(role_permissions.c.role_id == Role.id)
+        .correlate(Role).scalar_subquery()
+    )
+    rows = apply_page(query.add_columns(user_count, permission_count), [Role.id], limit, cursor, skip).all()
 
-    return roles, total
+    roles = []
+    for role, role_user_count, role_permission_count in rows:
+        role.userCount = role_user_count
+        role.permissionCount = role_permission_count
+        roles.append(role)
+    roles, next_cursor = page_items(roles, [Role.id], limit)
+    return roles, total, next_cursor
 
 # 根据ID获取角色
 def get_role_by_id(db: Session, role_id: int):
@@ -163,11 +170,11 @@ def update_user_roles(db: Session, user_id: int, role_names: List[str]):
     return db_user
 
 # 新增：重置用户密码
-def reset_user_password(db: Session, user_id: int, new_password: str):
+def reset_user_password(db: Session, user_id: int, hashed_password: str):
     db_user = db.query(User).filter(User.id == user_id).first()
     if not db_user: return None
     
-    db_user.hashed_password = get_password_hash(new_password) # 对新密码进行哈希
+    db_user.hashed_password = hashed_password # 调用方已在线程池中计算好哈希
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
@@ -0,0 +1,198 @@
+"""
+Keyset (cursor) pagination and cached approximate totals for list endpoints
+
+OFFSET pagination makes the database walk and discard every skipped row, so deep pages get
+linearly slower. A keyset page instead continues after the sort key of the last row it returned,
+(created_at, id) for most tables, which an index seek answers in constant time at any depth.
+The cursor handed to clients is that sort key, encoded as an opaque string.
+
+Exact totals need a full COUNT over the filtered rows on every request. List endpoints report a
+total cached for a short time instead, which is accurate enough for page counts and scrollbars.
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, DateTime
+
+# Seconds a computed total is reused
+PAGINATION_COUNT_CACHE_TTL_SECONDS = float(os.getenv("PAGINATION_COUNT_CACHE_TTL_SECONDS", "30"))
+PAGINATION_COUNT_CACHE_MAX_ENTRIES = int(os.getenv("PAGINATION_COUNT_CACHE_MAX_ENTRIES", "10000"))
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(row: Any, columns: Sequence) -> str:
+    """
+    Encode the sort key of a row as an opaque cursor
+
+    Args:
+        row: ORM object the next page starts after
+        columns: Sort key columns
+
+    Returns:
+        URL-safe cursor string
+    """
+    values = []
+    for column in columns:
+        value = getattr(row, column.key)
+        values.append(value.isoformat() if isinstance(value, datetime) else value)
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    """
+    Decode a cursor produced by encode_cursor for the same columns
+
+    Args:
+        cursor: Cursor string
+        columns: Sort key columns
+
+    Returns:
+        Sort key values
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns) or None in values:
+            raise ValueError("cursor does not match the sort key")
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {e}")
+
+
+def keyset_condition(columns: Sequence, values: Sequence, descending: bool = False):
+    """
+    Rows strictly after the given sort key, expanded as
+    (a > x) OR (a = x AND b > y) so that every database can use the (a, b) index
+
+    Args:
+        columns: Sort key columns
+        values: Sort key of the last row already returned
+        descending: Whether the key is sorted in descending order
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        after = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], after))
+    return or_(*clauses)
+
+
+def apply_page(query, columns: Sequence, limit: int, cursor: Optional[str] = None, skip: int = 0, descending: bool = False):
+    """
+    Order a Query or select() by the sort key and restrict it to one page
+
+    With a cursor the page starts after the cursor position and skip is ignored, otherwise it
+    falls back to OFFSET. One extra row is fetched so page_items can tell whether more follow.
+
+    Args:
+        query: ORM Query or select() statement
+        columns: Sort key columns, the last one must be unique (usually the primary key)
+        limit: Page size
+        cursor: Cursor returned with the previous page
+        skip: Rows to skip when no cursor is given
+        descending: Whether to sort newest first
+
+    Returns:
+        The paged query
+    """
+    if cursor:
+        query = query.filter(keyset_condition(columns, decode_cursor(cursor, columns), descending))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    if skip and not cursor:
+        query = query.offset(skip)
+    return query.limit(limit + 1)
+
+
+def page_items(rows: Sequence, columns: Sequence, limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Split the rows of a query built by apply_page into the page and the next cursor
+
+    Returns:
+        (items, cursor of the next page or None on the last page)
+    """
+    items = list(rows[:limit])
+    next_cursor = encode_cursor(items[-1], columns) if len(rows) > limit and items else None
+    return items, next_cursor
+
+
+# Response headers carrying the total and next cursor of endpoints that return a bare list
+TOTAL_COUNT_HEADER = "X-Total-Count"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PAGINATION_HEADERS = [TOTAL_COUNT_HEADER, NEXT_CURSOR_HEADER]
+
+
+def set_page_headers(response, total: int, next_cursor: Optional[str]) -> None:
+    """Report the approximate total and the next cursor of a list response in its headers"""
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+
+class CountCache:
+    """
+    Short-lived cache of COUNT results keyed by the list and its filters
+    """
+
+    def __init__(self, ttl: float = PAGINATION_COUNT_CACHE_TTL_SECONDS, max_entries: int = PAGINATION_COUNT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key: Hashable, total: int) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (total, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache()
+
+
+def cached_count(key: Hashable, count: Callable[[], int]) -> int:
+    """
+    Approximate total: the cached value for key, or count() when missing or expired
+
+    Args:
+        key: List name and filters, e.g. ("documents", user_id, kb_id)
+        count: Callable running the COUNT query
+    """
+    total = count_cache.get(key)
+    if total is None:
+        total = count()
+        count_cache.set(key, total)
+    return total
+
+
+async def cached_count_async(key: Hashable, count: Callable[[], Awaitable[int]]) -> int:
+    """Async variant of cached_count for AsyncSession queries"""
+    total = count_cache.get(key)
+    if total is None:
+        total = await count()
+        count_cache.set(key, total)
+    return total
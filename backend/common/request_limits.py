@@ -0,0 +1,63 @@
+"""
+Request body size limit for multipart uploads
+
+Starlette parses a multipart body completely, spooling each file to a temporary file, before the
+endpoint runs, so an upload endpoint cannot refuse an oversized file before it has been received.
+This middleware bounds multipart bodies at the ASGI layer instead: a declared Content-Length above
+the limit is rejected before any of the body is read, and a body without one (chunked transfer
+encoding) is counted while it is read and aborted once it passes the limit.
+
+The limit applies to the whole request, so it has to leave room for batch uploads of several
+files; single files are additionally capped by MAX_UPLOAD_SIZE when they are stored. Resumable
+upload parts are raw request bodies, not multipart, and are bounded by their session size.
+"""
+
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Largest multipart request body accepted, 0 disables the limit
+MAX_MULTIPART_BODY_SIZE = int(os.getenv("MAX_MULTIPART_BODY_SIZE", str(1024 * 1024 * 1024)))
+
+
+class MultipartBodyLimitMiddleware:
+    """
+    ASGI middleware rejecting multipart request bodies larger than max_size with 413
+    """
+
+    def __init__(self, app, max_size: int = MAX_MULTIPART_BODY_SIZE):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_size:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body exceeds the upload limit of {self.max_size} bytes"
+        try:
+            content_length = int(headers.get(b"content-length", b"-1"))
+        except ValueError:
+            content_length = -1
+        if content_length > self.max_size:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # Raised inside body parsing, FastAPI passes HTTPException through as the response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
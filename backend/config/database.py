@@ -1,6 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import AsyncIterator, Dict, Any
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url, URL
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 
 # 导入统一的 Base
@@ -8,16 +13,138 @@ from ..models.base import Base
 
 load_dotenv()
 
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{os.getenv('DB_USER', 'root')}:{os.getenv('DB_PASSWORD', 'Admin.123')}@{os.getenv('DB_HOST', '124.223.204.200')}/{os.getenv('DB_NAME', 'rag')}"
+# 设置 DATABASE_URL 可以直接指定连接串（例如测试时使用 sqlite:///./test.db）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or f"mysql+pymysql://{os.getenv('DB_USER', 'root')}:{os.getenv('DB_PASSWORD', 'Admin.123')}@{os.getenv('DB_HOST', '124.223.204.200')}/{os.getenv('DB_NAME', 'rag')}"
+
+# 同步驱动对应的异步驱动
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str) -> URL:
+    """把同步连接串换成对应的异步驱动，例如 mysql+pymysql -> mysql+aiomysql"""
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+
+# 设置 ASYNC_DATABASE_URL 可以单独指定异步连接串，例如改用 mysql+asyncmy
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    make_url(os.environ["ASYNC_DATABASE_URL"]) if os.getenv("ASYNC_DATABASE_URL")
+    else async_database_url(SQLALCHEMY_DATABASE_URL)
+)
 
 # 根据环境变量决定是否打印SQL
 # 设置 SQLALCHEMY_ECHO=True 在 .env 文件中可以开启SQL打印
 echo_sql = os.getenv('SQLALCHEMY_ECHO', 'False').lower() == 'true'
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=echo_sql  # 根据 echo_sql 变量设置是否打印SQL
-)
+# 应用启动时是否自动创建不存在的表；多实例部署时可关闭，改为部署时运行 init_database.py
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "True").lower() == "true"
+
+# 连接池配置，可通过环境变量调整
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 连接使用超过该秒数后重建，需小于MySQL的wait_timeout，避免使用已被服务端关闭的连接
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 取出连接前先检测是否可用，数据库重启或网络中断后自动重连
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+
+class PoolStats:
+    """连接池等待统计：获取连接的次数、总等待时间、最长等待时间和超时次数"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def record(self, wait: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "timeouts": self.timeouts
+            }
+
+class _WaitTimingMixin:
+    """记录从连接池获取连接所等待的时间"""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self._stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self._stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._stats = self._stats
+        return pool
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats = PoolStats()
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats = PoolStats()
+
+def engine_options(url, pool_class=InstrumentedQueuePool) -> Dict[str, Any]:
+    """引擎参数：SQLite使用SQLAlchemy默认的连接池，其他数据库使用可配置的计时连接池"""
+    options: Dict[str, Any] = {"echo": echo_sql, "pool_pre_ping": DB_POOL_PRE_PING}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=pool_class,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    return options
+
+def pool_metrics(target=None) -> Dict[str, Any]:
+    """
+    连接池状态：配置、已借出/空闲/溢出连接数和获取连接的等待时间
+    
+    Args:
+        target: 引擎或连接池，默认为同步引擎
+    """
+    pool = getattr(target if target is not None else engine, "pool", target)
+    metrics: Dict[str, Any] = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        metrics.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            timeout=pool.timeout(),
+            recycle=pool._recycle,
+            pre_ping=pool._pre_ping
+        )
+    stats = getattr(pool, "_stats", None)
+    if stats is not None:
+        metrics["wait"] = stats.snapshot()
+    return metrics
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -27,12 +154,57 @@ def get_db():
     finally:
         db.close()
 
-# 自动创建表，如果不存在
-# 注意：只有在所有模型都被导入后才能创建表
-try:
-    # 确保所有模型都被导入
-    from ..models import *  # 这会导入 __init__.py 中的所有模型
-    Base.metadata.create_all(bind=engine)
-    print("Successfully created/verified all database tables using MySQL")
-except Exception as e:
-    print(f"Warning: Could not create tables: {e}") 
+# 异步引擎按需创建：只有用到异步会话的服务才需要安装异步驱动（aiomysql / aiosqlite）
+_async_engine = None
+_async_session_factory = None
+_async_engine_lock = threading.Lock()
+
+def get_async_engine():
+    """获取异步引擎（首次调用时创建）"""
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+                _async_engine = create_async_engine(
+                    ASYNC_SQLALCHEMY_DATABASE_URL,
+                    **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL, InstrumentedAsyncQueuePool)
+                )
+                # 提交后不过期对象，避免在异步代码中隐式触发懒加载查询
+                _async_session_factory = async_sessionmaker(
+                    _async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+                )
+    return _async_engine
+
+def AsyncSessionLocal():
+    """创建异步会话，用法与 SessionLocal 相同：async with AsyncSessionLocal() as db"""
+    get_async_engine()
+    return _async_session_factory()
+
+async def get_async_db() -> AsyncIterator:
+    """异步数据库会话依赖，查询不会阻塞事件循环"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engine() -> None:
+    """关闭异步引擎的连接池"""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_session_factory = None
+
+def async_pool_metrics() -> Dict[str, Any]:
+    """异步引擎的连接池状态，引擎尚未创建时返回None"""
+    return pool_metrics(_async_engine) if _async_engine is not None else None
+
+def init_db() -> None:
+    """
+    创建不存在的表
+    
+    不在导入时执行，由应用启动时（DB_CREATE_TABLES=True）或 init_database.py 脚本调用，
+    这样导入本模块不需要连接数据库，worker进程可以快速启动
+    """
+    # 注意：只有在所有模型都被导入后才能创建表
+    from .. import models  # noqa: F401 这会导入 __init__.py 中的所有模型
+    Base.metadata.create_all(bind=engine) 
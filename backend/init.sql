@@ -8,6 +8,9 @@ DROP TABLE IF EXISTS roles;
 -- 知识库相关表
 DROP TABLE IF EXISTS chat_messages;
 DROP TABLE IF EXISTS chat_sessions;
+DROP TABLE IF EXISTS import_job_files;
+DROP TABLE IF EXISTS import_jobs;
+DROP TABLE IF EXISTS ingestion_jobs;
 DROP TABLE IF EXISTS document_chunks;
 DROP TABLE IF EXISTS documents;
 DROP TABLE IF EXISTS knowledge_bases;
@@ -80,9 +83,11 @@ CREATE TABLE IF NOT EXISTS files (
     file_path VARCHAR(500) NOT NULL,
     file_size BIGINT,
     file_type VARCHAR(50),
+    content_hash CHAR(64), -- 文件内容的SHA-256
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     created_by INTEGER,
-    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX ix_files_content_hash (content_hash)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- 文档表
@@ -98,12 +103,17 @@ CREATE TABLE IF NOT EXISTS documents (
     page_count INT,
     chunk_count INT DEFAULT 0,
     doc_metadata JSON, -- Renamed from metadata
+    content_hash CHAR(64), -- 文件内容的SHA-256，未变化的文件重新导入时跳过
+    source_path VARCHAR(500), -- 导入来源（源路径或上传的文件名）
+    source_mtime DOUBLE, -- 源文件的修改时间
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     created_by INT,
     FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE CASCADE,
     FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE SET NULL,
-    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX idx_document_source (knowledge_base_id, source_path),
+    INDEX idx_document_kb_created (knowledge_base_id, created_at) -- 按 (created_at, id) 游标分页，InnoDB二级索引自带主键
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- 文档块表
@@ -115,11 +125,74 @@ CREATE TABLE IF NOT EXISTS document_chunks (
     chunk_text TEXT NOT NULL,
     page_number INT,
     vector_id VARCHAR(255),
+    content_hash CHAR(64), -- 块文本的SHA-256
     metadata JSON,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE,
     FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE CASCADE,
-    INDEX idx_document_chunk (document_id, chunk_index)
+    INDEX idx_document_chunk (document_id, chunk_index),
+    INDEX idx_document_chunk_kb (knowledge_base_id),
+    INDEX idx_document_chunk_vector (vector_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 文档入库任务表
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    document_id INT NOT NULL,
+    knowledge_base_id INT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, running, completed, failed
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    next_run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 重试退避后的下次执行时间
+    heartbeat_at TIMESTAMP NULL, -- 执行中任务的租约心跳，超时未更新的任务视为被遗弃
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE,
+    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE CASCADE,
+    INDEX idx_ingestion_job_document (document_id),
+    INDEX idx_ingestion_job_status (status, next_run_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 目录导入任务表
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    knowledge_base_id INT NOT NULL,
+    directory_path VARCHAR(500) NOT NULL,
+    recursive BOOLEAN DEFAULT FALSE,
+    file_metadata JSON, -- 导入时附加到每个文档的元数据
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, running, completed, failed
+    discovered_files INT NOT NULL DEFAULT 0,
+    discovery_done BOOLEAN DEFAULT FALSE, -- 目录遍历是否已结束
+    processed_files INT NOT NULL DEFAULT 0,
+    created_files INT NOT NULL DEFAULT 0,
+    updated_files INT NOT NULL DEFAULT 0,
+    unchanged_files INT NOT NULL DEFAULT 0,
+    failed_files INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    heartbeat_at TIMESTAMP NULL, -- 执行中任务的租约心跳，超时未更新的任务视为被遗弃
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    created_by INT,
+    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE CASCADE,
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX idx_import_job_kb (knowledge_base_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 目录导入任务的逐文件结果表
+CREATE TABLE IF NOT EXISTS import_job_files (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_id INT NOT NULL,
+    path VARCHAR(1000) NOT NULL,
+    action VARCHAR(20) NOT NULL, -- created, updated, unchanged, failed
+    document_id INT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE,
+    FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE SET NULL,
+    INDEX idx_import_job_file_action (job_id, action)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- 聊天会话表
@@ -131,8 +204,10 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     model_config JSON, -- Added
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    last_active_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, -- 最近活动时间，新增消息时也会更新
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL, -- Added ondelete
-    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE SET NULL -- Added ondelete
+    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_bases(id) ON DELETE SET NULL, -- Added ondelete
+    INDEX idx_chat_session_user_active (user_id, last_active_at, id) -- 会话列表按最近活动时间游标分页
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- 聊天消息表
@@ -144,7 +219,8 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     sources JSON, -- Added
     message_metadata JSON, -- Renamed from metadata
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE -- Added ondelete
+    FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE, -- Added ondelete
+    INDEX idx_chat_message_session_created (session_id, created_at) -- 消息历史游标分页
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- 模型配置表
@@ -0,0 +1,18 @@
+"""
+Create missing database tables
+
+Run once per deployment (start.sh does) instead of on every worker start, then set
+DB_CREATE_TABLES=False for the application.
+"""
+import os
+import sys
+
+# Add parent directory to Python path so the backend package can be imported
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_dir))
+
+from backend.database import init_db
+
+if __name__ == "__main__":
+    init_db()
+    print("Successfully created/verified all database tables")
@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import logging
 import os
 import sys
@@ -27,6 +28,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],  # Let browsers read list totals and next-page cursors (common/pagination.py)
 )
 
 # Import routers
@@ -39,6 +41,13 @@ try:
     from backend.routers.knowledge import router as knowledge_router
     from backend.routers.chat import router as chat_router
     from backend.routers.documents import router as documents_router
+    from backend.services.ingestion_service import get_ingestion_queue
+    from backend.services.llm_service import get_llm_client_registry
+    from backend.services.blob_store import collect_garbage
+    from backend.services.import_service import get_directory_importer
+    from backend.database import dispose_async_engine, init_db, DB_CREATE_TABLES
+    from backend.auth.security import shutdown_password_executor
+    from backend.common.request_limits import MultipartBodyLimitMiddleware
     
     logger.info("Successfully imported routers with backend prefix")
 except ImportError as e:
@@ -52,12 +61,22 @@ except ImportError as e:
         from routers.knowledge import router as knowledge_router
         from routers.chat import router as chat_router
         from routers.documents import router as documents_router
+        from services.ingestion_service import get_ingestion_queue
+        from services.llm_service import get_llm_client_registry
+        from services.blob_store import collect_garbage
+        from services.import_service import get_directory_importer
+        from database import dispose_async_engine, init_db, DB_CREATE_TABLES
+        from auth.security import shutdown_password_executor
+        from common.request_limits import MultipartBodyLimitMiddleware
         
         logger.info("Successfully imported routers directly")
     except ImportError as e2:
         logger.error(f"Failed to import routers directly: {str(e2)}")
         sys.exit(1)  # Exit program if import fails
 
+# Reject oversized multipart uploads before their body is received (common/request_limits.py)
+app.add_middleware(MultipartBodyLimitMiddleware)
+
 # Register routers
 try:
     # Add global API prefix
@@ -73,6 +92,29 @@ except NameError as e:
     logger.error(f"Error registering routers: {str(e)}")
     sys.exit(1)  # Exit on error
 
+# Background workers
+@app.on_event("startup")
+async def start_background_workers():
+    """Create missing tables, start the document ingestion queue, resume directory imports and collect unreferenced file blobs in the background"""
+    if DB_CREATE_TABLES:
+        try:
+            await asyncio.to_thread(init_db)
+            logger.info("Database tables created/verified")
+        except Exception as e:
+            logger.warning(f"Could not create tables: {str(e)}")
+    await get_ingestion_queue().start()
+    await get_directory_importer().recover()
+    asyncio.get_running_loop().run_in_executor(None, collect_garbage)
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    """Stop directory imports and the document ingestion queue, close pooled LLM and database connections and the password hash pool"""
+    await get_directory_importer().stop()
+    await get_ingestion_queue().stop()
+    await get_llm_client_registry().close()
+    await dispose_async_engine()
+    shutdown_password_executor()
+
 # Add error handling middleware (using function instead of import)
 @app.middleware("http")
 async def error_handler_middleware(request, call_next):
@@ -4,7 +4,7 @@ from .associations import user_roles, role_permissions
 from .user import User
 from .role import Role  
 from .permission import Permission
-from .knowledge import KnowledgeBase, Document, DocumentChunk, File
+from .knowledge import KnowledgeBase, Document, DocumentChunk, File, IngestionJob, ImportJob, ImportJobFile
 from .chat import ChatSession, ChatMessage
 from .model_config import ModelConfig
 # 暂时注释掉AB测试相关模型以避免循环依赖问题
@@ -22,6 +22,9 @@ __all__ = [
     "Document",
     "DocumentChunk",
     "File",
+    "IngestionJob",
+    "ImportJob",
+    "ImportJobFile",
     "ChatSession",
     "ChatMessage",
     "ModelConfig",
@@ -1,9 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
-from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Index, event, update
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-
-Base = declarative_base()
+from .base import Base
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
@@ -15,9 +15,15 @@ class ChatSession(Base):
     model_config = Column(JSON)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # 最近活动时间：会话创建、修改或新增消息时更新，会话列表按它排序分页
+    last_active_at = Column(DateTime(timezone=True), nullable=False, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index("idx_chat_session_user_active", "user_id", "last_active_at", "id"),
+    )
     
     # Relationships
-    messages = relationship("ChatMessage", back_populates="session")
+    messages = relationship("ChatMessage", back_populates="session", passive_deletes=True)
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -30,5 +36,18 @@ class ChatMessage(Base):
     message_metadata = Column("message_metadata", JSON)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        Index("idx_chat_message_session_created", "session_id", "created_at"),
+    )
+    
     # Relationships
-    session = relationship("ChatSession", back_populates="messages") 
\ No newline at end of file
+    session = relationship("ChatSession", back_populates="messages") 
+
+@event.listens_for(ChatMessage, "after_insert")
+def _touch_session(mapper, connection, message):
+    """新增消息时更新会话的最近活动时间"""
+    connection.execute(
+        update(ChatSession.__table__)
+        .where(ChatSession.__table__.c.id == message.session_id)
+        .values(last_active_at=datetime.now())
+    )
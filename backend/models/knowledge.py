@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, BigInteger
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, BigInteger, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from enum import Enum
@@ -15,6 +15,18 @@ class DocumentStatus(str, Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class IngestionJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class ImportJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
 class KnowledgeBase(Base):
     __tablename__ = "knowledge_bases"
     
@@ -50,13 +62,21 @@ class Document(Base):
     page_count = Column(Integer)
     chunk_count = Column(Integer, default=0)
     doc_metadata = Column("doc_metadata", JSON)  # Map to 'doc_metadata' column in DB
+    content_hash = Column(String(64))  # 文件内容的SHA-256，未变化的文件重新导入时跳过
+    source_path = Column(String(500))  # 导入来源（目录导入的源路径或上传的文件名），用于识别同一文档
+    source_mtime = Column(Float)  # 目录导入时源文件的修改时间，大小和时间都未变时无需重新计算哈希
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     
+    __table_args__ = (
+        Index("idx_document_source", "knowledge_base_id", "source_path"),
+        Index("idx_document_kb_created", "knowledge_base_id", "created_at"),
+    )
+    
     # Relationships
     knowledge_base = relationship("KnowledgeBase", back_populates="documents")
-    chunks = relationship("DocumentChunk", back_populates="document")
+    chunks = relationship("DocumentChunk", back_populates="document", passive_deletes=True)
     file = relationship("File", back_populates="documents")
 
 class DocumentChunk(Base):
@@ -69,9 +89,16 @@ class DocumentChunk(Base):
     chunk_text = Column(Text, nullable=False)
     page_number = Column(Integer)
     vector_id = Column(String(255))  # Changed from 'embedding_id' to 'vector_id' per init.sql
+    content_hash = Column(String(64))  # 块文本的SHA-256，重新入库时只向量化变化的块
     chunk_metadata = Column("metadata", JSON)  # Map to 'metadata' column in DB
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        Index("idx_document_chunk", "document_id", "chunk_index"),
+        Index("idx_document_chunk_kb", "knowledge_base_id"),
+        Index("idx_document_chunk_vector", "vector_id"),
+    )
+    
     # Relationships
     document = relationship("Document", back_populates="chunks")
     knowledge_base = relationship("KnowledgeBase", back_populates="document_chunks") 
@@ -84,8 +111,76 @@ class File(Base):
     file_path = Column(String(500), nullable=False)
     file_size = Column(BigInteger)
     file_type = Column(String(50))
+    content_hash = Column(String(64), index=True)  # 文件内容的SHA-256
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+
+    # Relationships
+    documents = relationship("Document", back_populates="file")
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    knowledge_base_id = Column(Integer, ForeignKey("knowledge_bases.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    next_run_at = Column(DateTime(timezone=True), server_default=func.now())  # 重试退避后的下次执行时间
+    heartbeat_at = Column(DateTime(timezone=True))  # 执行中任务的租约心跳，超时未更新的任务视为被遗弃
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        Index("idx_ingestion_job_status", "status", "next_run_at"),
+    )
+    
+    # Relationships
+    document = relationship("Document")
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    knowledge_base_id = Column(Integer, ForeignKey("knowledge_bases.id", ondelete="CASCADE"), nullable=False, index=True)
+    directory_path = Column(String(500), nullable=False)
+    recursive = Column(Boolean, default=False)
+    file_metadata = Column(JSON)  # 导入时附加到每个文档的元数据
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    discovered_files = Column(Integer, nullable=False, default=0)
+    discovery_done = Column(Boolean, default=False)  # 目录遍历是否已结束，结束后discovered_files即总数
+    processed_files = Column(Integer, nullable=False, default=0)
+    created_files = Column(Integer, nullable=False, default=0)
+    updated_files = Column(Integer, nullable=False, default=0)
+    unchanged_files = Column(Integer, nullable=False, default=0)
+    failed_files = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))  # 执行中任务的租约心跳，超时未更新的任务视为被遗弃
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    
+    # Relationships
+    files = relationship("ImportJobFile", back_populates="job", passive_deletes=True)
 
+class ImportJobFile(Base):
+    __tablename__ = "import_job_files"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("import_jobs.id", ondelete="CASCADE"), nullable=False)
+    path = Column(String(1000), nullable=False)
+    action = Column(String(20), nullable=False)  # created, updated, unchanged, failed
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"))
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("idx_import_job_file_action", "job_id", "action"),
+    )
+    
     # Relationships
-    documents = relationship("Document", back_populates="file") 
+    job = relationship("ImportJob", back_populates="files")
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Form, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Optional
@@ -16,18 +16,20 @@ if backend_dir not in sys.path:
 try:
     from ..config.database import get_db
     from ..schemas import Token, User
-    from ..auth.security import (create_access_token, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES, 
-                                get_current_user, REMEMBER_ME_TOKEN_EXPIRE_DAYS)
+    from ..auth.security import (create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, 
+                                get_current_user, get_current_principal, load_principal, Principal,
+                                ADMIN_ROLE, REMEMBER_ME_TOKEN_EXPIRE_DAYS, authenticate_user)
     from ..models.user import User as DBUser
-    from ..common.crud import authenticate_user # Import authenticate_user
+    from ..auth.rate_limit import login_rate_limiter
 except ImportError:
     # Try using absolute imports
     from config.database import get_db
     from schemas import Token, User
-    from auth.security import (create_access_token, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES, 
-                                get_current_user, REMEMBER_ME_TOKEN_EXPIRE_DAYS)
+    from auth.security import (create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, 
+                                get_current_user, get_current_principal, load_principal, Principal,
+                                ADMIN_ROLE, REMEMBER_ME_TOKEN_EXPIRE_DAYS, authenticate_user)
     from models.user import User as DBUser
-    from common.crud import authenticate_user # Import authenticate_user
+    from auth.rate_limit import login_rate_limiter
 
 import logging
 from datetime import timedelta
@@ -44,14 +46,28 @@ class LoginForm(BaseModel):
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
+    request: Request,
     username: str = Form(...),
     password: str = Form(...),
     remember_me: bool = Form(False),
     db: Session = Depends(get_db)
 ):
     logger.info(f"Attempting to get access token for user '{username}'")
-    user = authenticate_user(db, username, password)
+    client_ip = request.client.host if request.client else "unknown"
+    # Rejected before any password hashing, so a login storm cannot saturate the hash pool
+    retry_after = login_rate_limiter.retry_after(client_ip, username)
+    if retry_after > 0:
+        logger.warning(f"Login rate limited for user '{username}' from {client_ip}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, please try again later",
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
+
+    # Password verification runs in the bounded hash pool, not on the event loop
+    user = await authenticate_user(db, username, password)
     if not user:
+        login_rate_limiter.record_failure(client_ip, username)
         logger.warning(f"Authentication failed for user '{username}'")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -59,6 +75,8 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    login_rate_limiter.reset(client_ip, username)
+
     # Ensure user roles are loaded
     _ = user.roles
 
@@ -92,29 +110,24 @@ async def login_for_access_token(
 
 @router.get("/user-permissions")
 async def get_user_permissions(
-    username: str,
+    username: Optional[str] = None,
+    principal: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
-    """Get user's permission list"""
+    """Get user's permission list, defaults to the current user"""
     logger.info(f"Getting user permissions: username={username}")
-    # Get user permissions from database
-    try:
-        from ..common.crud import get_user_by_username
-    except ImportError:
-        from backend.common.crud import get_user_by_username
-        
-    user = get_user_by_username(db, username)
-    if not user:
+    # The current user's permission set is compiled at authentication, no query needed
+    if username is None or username == principal.user.username:
+        return sorted(principal.permissions)
+
+    # Only admins may look up other users
+    if not principal.has_role(ADMIN_ROLE):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    other = load_principal(db, username)
+    if other is None:
         logger.warning(f"User does not exist: username={username}")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist")
-    
-    # Get permissions list from all user roles
-    permissions = set()
-    for role in user.roles:
-        for perm in role.permissions:
-            permissions.add(perm.name)
-            
-    return list(permissions)
+    return sorted(other.permissions)
 
 @router.get("/me", response_model=User)
 async def read_users_me(current_user: DBUser = Depends(get_current_user)):
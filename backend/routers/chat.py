@@ -1,112 +1,140 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import json
+import logging
 
-from ..database import get_db
+import anyio
+
+from ..database import get_db, get_async_db, SessionLocal
 from ..models.chat import ChatSession, ChatMessage
 from ..models.user import User
 from ..auth.security import get_current_user
 from ..services.llm_service import LLMService, RAGChatService
 from ..services.rag_service import RAGService
+from ..services.answer_cache import get_answer_cache
+from ..services.metadata_filters import MetadataFilter, MetadataFilterError
 from ..schemas import chat as schemas
+from ..common.pagination import apply_page, page_items, cached_count_async, set_page_headers, InvalidCursorError
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # 初始化服务
 llm_service = LLMService()
 rag_service = RAGService()
-rag_chat_service = RAGChatService(llm_service)
+rag_chat_service = RAGChatService(llm_service, rag_service=rag_service)
+
+def _metadata_filter(filters: Optional[schemas.SearchFilters]) -> Optional[MetadataFilter]:
+    """把请求中的检索过滤条件转换为索引内过滤器"""
+    if filters is None:
+        return None
+    try:
+        return MetadataFilter.from_dict(filters.model_dump(exclude_none=True))
+    except MetadataFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _page(db: AsyncSession, stmt, keys, limit: int, cursor: Optional[str], skip: int, descending: bool):
+    """执行keyset分页查询，返回 (当前页, 下一页游标)"""
+    try:
+        paged = apply_page(stmt, keys, limit, cursor, skip, descending)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = (await db.execute(paged)).scalars().all()
+    return page_items(rows, keys, limit)
+
+async def _count(db: AsyncSession, stmt) -> int:
+    return await db.scalar(select(func.count()).select_from(stmt.subquery()))
 
 @router.get("/sessions", response_model=List[schemas.ChatSessionResponse])
 async def get_chat_sessions(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取聊天会话列表"""
-    sessions = db.query(ChatSession).filter(
-        ChatSession.user_id == current_user.id
-    ).order_by(ChatSession.updated_at.desc()).offset(skip).limit(limit).all()
-    
+    """获取聊天会话列表，按最近活动时间倒序；近似总数和下一页游标在响应头 X-Total-Count / X-Next-Cursor 中"""
+    stmt = select(ChatSession).where(ChatSession.user_id == current_user.id)
+    total = await cached_count_async(("chat_sessions", current_user.id), lambda: _count(db, stmt))
+    sessions, next_cursor = await _page(
+        db, stmt, [ChatSession.last_active_at, ChatSession.id], limit, cursor, skip, descending=True
+    )
+    set_page_headers(response, total, next_cursor)
     return sessions
 
 @router.post("/sessions", response_model=schemas.ChatSessionResponse)
 async def create_chat_session(
     session: schemas.ChatSessionCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """创建聊天会话"""
     db_session = ChatSession(
-        **session.dict(),
+        **session.model_dump(by_alias=True),
         user_id=current_user.id
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    await db.refresh(db_session)
     return db_session
 
+async def _get_own_session(db: AsyncSession, session_id: int, user_id: int) -> ChatSession:
+    """获取当前用户的会话，不存在时返回404"""
+    result = await db.execute(
+        select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+    )
+    session = result.scalar_one_or_none()
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return session
+
 @router.get("/sessions/{session_id}", response_model=schemas.ChatSessionResponse)
 async def get_chat_session(
     session_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取聊天会话详情"""
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="会话不存在")
-    
-    return session
+    return await _get_own_session(db, session_id, current_user.id)
 
 @router.delete("/sessions/{session_id}")
 async def delete_chat_session(
     session_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除聊天会话"""
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="会话不存在")
-    
-    db.delete(session)
-    db.commit()
+    session = await _get_own_session(db, session_id, current_user.id)
+    await db.delete(session)
+    await db.commit()
     
     return {"message": "会话删除成功"}
 
 @router.get("/sessions/{session_id}/messages", response_model=List[schemas.ChatMessageResponse])
 async def get_chat_messages(
     session_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取聊天消息历史"""
+    """获取聊天消息历史，按时间正序；传入上一页响应头 X-Next-Cursor 的值作为cursor继续翻页"""
     # 检查会话权限
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="会话不存在")
-    
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at.asc()).offset(skip).limit(limit).all()
+    await _get_own_session(db, session_id, current_user.id)
     
+    stmt = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    total = await cached_count_async(("chat_messages", session_id), lambda: _count(db, stmt))
+    messages, next_cursor = await _page(
+        db, stmt, [ChatMessage.created_at, ChatMessage.id], limit, cursor, skip, descending=False
+    )
+    set_page_headers(response, total, next_cursor)
     return messages
 
 @router.post("/sessions/{session_id}/messages", response_model=schemas.ChatMessageResponse)
@@ -126,6 +154,8 @@ async def send_message(
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
+    metadata_filter = _metadata_filter(message.filters)
+    
     # 保存用户消息
     user_message = ChatMessage(
         session_id=session_id,
@@ -154,13 +184,14 @@ async def send_message(
         # 调用RAG聊天服务
         response = await rag_chat_service.chat(
             query=message.content,
-            kb_id=session.kb_id,
+            kb_id=session.knowledge_base_id,
             chat_history=chat_history,
             provider=message.provider,
             model=message.model,
             temperature=message.temperature,
             max_tokens=message.max_tokens,
-            top_k=message.top_k
+            top_k=message.top_k,
+            filters=metadata_filter
         )
         
         # 保存AI回复
@@ -169,7 +200,7 @@ async def send_message(
             role="assistant",
             content=response["answer"],
             sources=response["sources"],
-            metadata={
+            message_metadata={
                 "usage": response["usage"],
                 "model": response["model"]
             }
@@ -191,7 +222,7 @@ async def send_message(
             session_id=session_id,
             role="assistant",
             content=f"抱歉，处理您的消息时出现错误: {str(e)}",
-            metadata={"error": str(e)}
+            message_metadata={"error": str(e)}
         )
         db.add(error_message)
         db.commit()
@@ -199,13 +230,17 @@ async def send_message(
         
         return error_message
 
+def _sse_event(data: dict) -> str:
+    """编码一条SSE事件"""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @router.post("/stream")
 async def stream_chat(
     request: schemas.StreamChatRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """流式聊天接口"""
+    """流式聊天接口，以Server-Sent Events逐段返回模型输出"""
     # 检查会话权限
     session = db.query(ChatSession).filter(
         ChatSession.id == request.session_id,
@@ -215,6 +250,8 @@ async def stream_chat(
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
+    metadata_filter = _metadata_filter(request.filters)
+    
     # 保存用户消息
     user_message = ChatMessage(
         session_id=request.session_id,
@@ -225,39 +262,137 @@ async def stream_chat(
     db.commit()
     db.refresh(user_message)
     
-    try:
-        # 获取聊天历史
-        chat_history = []
-        if request.include_history:
-            history_messages = db.query(ChatMessage).filter(
-                ChatMessage.session_id == request.session_id
-            ).order_by(ChatMessage.created_at.desc()).limit(10).all()
-            
-            for msg in reversed(history_messages):
-                chat_history.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
+    # 获取聊天历史
+    chat_history = []
+    if request.include_history:
+        history_messages = db.query(ChatMessage).filter(
+            ChatMessage.session_id == request.session_id
+        ).order_by(ChatMessage.created_at.desc()).limit(10).all()
         
-        # 调用流式RAG聊天
-        response = await rag_chat_service.chat(
-            query=request.message,
-            kb_id=session.kb_id,
-            chat_history=chat_history,
-            provider=request.provider,
-            model=request.model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            top_k=request.top_k,
-            stream=True
+        for msg in reversed(history_messages):
+            chat_history.append({
+                "role": msg.role,
+                "content": msg.content
+            })
+    
+    session_id = session.id
+    kb_id = session.knowledge_base_id
+    user_message_id = user_message.id
+    
+    async def event_stream():
+        deltas = None
+        sources = []
+        answer_parts = []
+        error = None
+        completed = False
+        try:
+            # 检索和提示词组装完成后再开始向上游请求
+            prepared = await rag_chat_service.prepare(
+                query=request.message,
+                kb_id=kb_id,
+                chat_history=chat_history,
+                provider=request.provider,
+                model=request.model,
+                max_tokens=request.max_tokens,
+                top_k=request.top_k,
+                filters=metadata_filter
+            )
+            sources = prepared["sources"]
+            deltas = rag_chat_service.stream_chat_with_knowledge(
+                question=request.message,
+                knowledge_base_id=kb_id,
+                prepared=prepared,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )
+            yield _sse_event({"type": "start", "user_message_id": user_message_id, "sources": sources})
+            async for delta in deltas:
+                answer_parts.append(delta)
+                yield _sse_event({"type": "delta", "content": delta})
+            completed = True
+        except Exception as e:
+            logger.error(f"流式聊天失败: session_id={session_id}, error={str(e)}")
+            error = str(e)
+        finally:
+            # 客户端断开时任务会被取消，屏蔽取消以确保上游流被关闭
+            if deltas is not None:
+                with anyio.CancelScope(shield=True):
+                    await deltas.aclose()
+            # 流结束后（包括中断）保存拼接完整的助手消息
+            ai_message = _save_stream_answer(
+                session_id, request.message, "".join(answer_parts), sources, request.model, completed, error
+            )
+        
+        if error is not None:
+            yield _sse_event({"type": "error", "error": error, "message_id": ai_message})
+        else:
+            yield _sse_event({"type": "done", "message_id": ai_message})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 禁止反向代理缓冲，保证每段输出立即送达
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def _save_stream_answer(
+    session_id: int,
+    question: str,
+    answer: str,
+    sources: list,
+    model: Optional[str],
+    completed: bool,
+    error: Optional[str]
+) -> Optional[int]:
+    """保存流式回答，返回消息ID"""
+    if error is not None:
+        content = f"抱歉，处理您的消息时出现错误: {error}"
+        metadata = {"error": error, "stream": True}
+    elif answer:
+        content = answer
+        metadata = {"model": model, "stream": True}
+        if not completed:
+            metadata["interrupted"] = True
+    else:
+        return None
+    
+    db = SessionLocal()
+    try:
+        ai_message = ChatMessage(
+            session_id=session_id,
+            role="assistant",
+            content=content,
+            sources=sources or None,
+            message_metadata=metadata
         )
+        db.add(ai_message)
         
-        # 这里应该返回流式响应
-        # 由于FastAPI的流式响应比较复杂，这里先返回普通响应
-        return {"message": "流式聊天功能开发中"}
+        # 更新会话标题（如果是第一条消息）
+        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+        if session is not None and not session.title:
+            session.title = question[:50] + "..." if len(question) > 50 else question
         
+        db.commit()
+        return ai_message.id
     except Exception as e:
-        return {"error": str(e)}
+        db.rollback()
+        logger.error(f"保存流式回答失败: session_id={session_id}, error={str(e)}")
+        return None
+    finally:
+        db.close()
+
+@router.get("/cache/stats")
+async def get_answer_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取语义答案缓存的命中率和节省的token数"""
+    cache = get_answer_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
 
 @router.get("/providers")
 async def get_available_providers():
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form, Query, Body, Request, Response
 from fastapi import File as FastAPIFile # 避免与模型中的File名称冲突
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import List, Optional, Dict, Any
+import asyncio
 import os
 import shutil
 import sys
@@ -17,24 +18,42 @@ if backend_dir not in sys.path:
 
 try:
     from ..database import get_db
-    from ..models.knowledge import KnowledgeBase, Document, DocumentChunk, DocumentStatus
+    from ..models.knowledge import KnowledgeBase, Document, DocumentChunk, DocumentStatus, ImportJob, ImportJobFile
     from ..models.user import User
     from ..auth.security import get_current_user
-    from ..schemas.knowledge import DocumentResponse, DocumentCreate, DocumentUpdate
-    from ..services.document_service import DocumentService
+    from ..schemas.knowledge import (
+        DocumentResponse, DocumentCreate, DocumentUpdate, UploadSessionCreate, UploadSessionResponse,
+        ImportJobResponse, ImportJobFileResponse
+    )
+    from ..services.document_service import DocumentService, SyncAction, unsupported_file_type
+    from ..services.import_service import create_import_job, get_directory_importer
     from ..logger import get_logger
     from ..models.knowledge import File
     from ..services.file_service import FileService
+    from ..services.blob_store import UploadTooLargeError
+    from ..common.pagination import apply_page, page_items, cached_count, set_page_headers, InvalidCursorError
+    from ..services.upload_service import (
+        get_upload_service, UploadSessionError, UploadNotFoundError, UploadOffsetError
+    )
 except ImportError:
     from backend.database import get_db
-    from backend.models.knowledge import KnowledgeBase, Document, DocumentChunk, DocumentStatus
+    from backend.models.knowledge import KnowledgeBase, Document, DocumentChunk, DocumentStatus, ImportJob, ImportJobFile
     from backend.models.user import User
     from backend.auth.security import get_current_user
-    from backend.schemas.knowledge import DocumentResponse, DocumentCreate, DocumentUpdate
-    from backend.services.document_service import DocumentService
+    from backend.schemas.knowledge import (
+        DocumentResponse, DocumentCreate, DocumentUpdate, UploadSessionCreate, UploadSessionResponse,
+        ImportJobResponse, ImportJobFileResponse
+    )
+    from backend.services.document_service import DocumentService, SyncAction, unsupported_file_type
+    from backend.services.import_service import create_import_job, get_directory_importer
     from backend.logger import get_logger
     from backend.models.knowledge import File
     from backend.services.file_service import FileService
+    from backend.services.blob_store import UploadTooLargeError
+    from backend.common.pagination import apply_page, page_items, cached_count, set_page_headers, InvalidCursorError
+    from backend.services.upload_service import (
+        get_upload_service, UploadSessionError, UploadNotFoundError, UploadOffsetError
+    )
 
 router = APIRouter()
 logger = get_logger(__name__)
@@ -45,17 +64,19 @@ def get_document_service_dep(db: Session = Depends(get_db)) -> DocumentService:
 
 @router.get("/", response_model=List[DocumentResponse])
 async def get_documents(
+    response: Response,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     kb_id: Optional[int] = Query(None),
     file_type: Optional[str] = Query(None),
     status: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值，传入时按游标翻页，忽略page"),
     document_service: DocumentService = Depends(get_document_service_dep),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """获取文档列表，支持分页和筛选"""
+    """获取文档列表，支持分页和筛选，按创建时间倒序；近似总数和下一页游标在响应头 X-Total-Count / X-Next-Cursor 中"""
     logger.info(f"获取文档列表: user_id={current_user.id}, page={page}, page_size={page_size}")
     
     # 构建查询
@@ -80,9 +101,16 @@ async def get_documents(
     if search:
         query = query.filter(Document.title.contains(search))
     
-    # 分页
+    # 分页：按 (created_at, id) 倒序，传入游标时从上一页末尾继续，深翻页不再使用OFFSET
+    total = cached_count(("documents", current_user.id, kb_id, file_type, status, search), query.count)
+    keys = [Document.created_at, Document.id]
     skip = (page - 1) * page_size
-    documents = query.offset(skip).limit(page_size).all()
+    try:
+        rows = apply_page(query, keys, page_size, cursor, skip, descending=True).all()
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    documents, next_cursor = page_items(rows, keys, page_size)
+    set_page_headers(response, total, next_cursor)
     
     logger.info(f"查询到 {len(documents)} 条文档: {[doc.title for doc in documents]}")
     
@@ -110,12 +138,92 @@ async def upload_file(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    unsupported = unsupported_file_type(file.filename)
+    if unsupported:
+        raise HTTPException(status_code=400, detail=unsupported)
     file_service = FileService(db)
-    file_id = await file_service.upload(current_user.id, file)
+    try:
+        file_id = await file_service.upload(current_user.id, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     if not file_id:
         raise HTTPException(status_code=500, detail="文件上传失败")
     return {"id": file_id, "file_id": file_id}  # 返回兼容格式
 
+def _upload_error(e: ValueError) -> HTTPException:
+    """把分片上传错误转换为HTTP错误"""
+    if isinstance(e, UploadNotFoundError):
+        return HTTPException(status_code=404, detail="上传会话不存在")
+    if isinstance(e, UploadOffsetError):
+        return HTTPException(status_code=409, detail={"message": str(e), "received": e.received})
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+@router.post("/files/uploads", response_model=UploadSessionResponse)
+async def start_resumable_upload(
+    upload: UploadSessionCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """创建可续传的分片上传会话，用于大文件"""
+    try:
+        state = FileService(db).start_upload(current_user.id, upload.filename, upload.size)
+    except (UploadSessionError, UploadTooLargeError) as e:
+        raise _upload_error(e)
+    if state is None:
+        raise HTTPException(status_code=400, detail=unsupported_file_type(upload.filename))
+    return state
+
+@router.get("/files/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """查询分片上传进度，received 即续传时下一片的偏移量"""
+    try:
+        return get_upload_service().status(upload_id, current_user.id)
+    except UploadSessionError as e:
+        raise _upload_error(e)
+
+@router.put("/files/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def upload_part(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """上传一个分片：请求体为原始字节，直接流式写入磁盘"""
+    try:
+        return await get_upload_service().append(upload_id, current_user.id, offset, request.stream())
+    except (UploadSessionError, UploadTooLargeError) as e:
+        raise _upload_error(e)
+
+@router.post("/files/uploads/{upload_id}/complete", response_model=Dict[str, int])
+async def complete_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """完成分片上传，返回文件ID，之后与普通上传一样用于创建文档"""
+    try:
+        file_id = await FileService(db).complete_upload(current_user.id, upload_id)
+    except UploadSessionError as e:
+        raise _upload_error(e)
+    return {"id": file_id, "file_id": file_id}
+
+@router.delete("/files/uploads/{upload_id}")
+async def abort_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """取消分片上传并删除已接收的内容"""
+    try:
+        get_upload_service().abort(upload_id, current_user.id)
+    except UploadSessionError as e:
+        raise _upload_error(e)
+    return {"message": "上传已取消"}
+
 @router.post("/", response_model=DocumentResponse)
 async def create_document(
     kb_id: int = Form(...),
@@ -132,7 +240,7 @@ async def create_document(
         raise HTTPException(status_code=404, detail="文件不存在")
     
     # 创建文档，使用 file_record 信息
-    document = await document_service.create_from_file(kb_id, current_user.id, file_record, title, description, tags)
+    document = document_service.create_from_file(kb_id, current_user.id, file_record, title, description, tags)
     return document
 
 @router.put("/{doc_id}", response_model=DocumentResponse)
@@ -182,6 +290,21 @@ async def update_document(
     db.commit()
     db.refresh(document)
     
+    # 标签变化后同步更新索引中用于过滤的文档属性
+    if tags is not None and document.chunk_count:
+        try:
+            try:
+                from ..services.rag_service import RAGService
+                from ..services.metadata_filters import document_attributes
+            except ImportError:
+                from backend.services.rag_service import RAGService
+                from backend.services.metadata_filters import document_attributes
+            RAGService().update_document_attributes(
+                document.knowledge_base_id, document.id, document_attributes(document)
+            )
+        except Exception as e:
+            logger.error(f"更新文档索引属性失败: doc_id={doc_id}, error={str(e)}")
+    
     return DocumentResponse.from_orm(document)
 
 @router.delete("/{doc_id}")
@@ -223,24 +346,29 @@ async def batch_upload_documents(
         logger.warning(f"知识库不存在: kb_id={kb_id}")
         raise HTTPException(status_code=404, detail="知识库不存在")
     
+    # 有不支持的文件类型时整批拒绝，避免部分文件被静默跳过
+    unsupported = [message for message in (unsupported_file_type(file.filename) for file in files) if message]
+    if unsupported:
+        logger.warning(f"批量上传包含不支持的文件类型: {unsupported}")
+        raise HTTPException(status_code=400, detail="；".join(unsupported))
+    
+    # 添加元数据
+    metadata = {}
+    if description:
+        metadata["description"] = description
+    if tags:
+        metadata["tags"] = [tag.strip() for tag in tags.split(",") if tag.strip()]
+    
     uploaded_documents = []
     failed_files = []
+    actions = {SyncAction.CREATED: 0, SyncAction.UPDATED: 0, SyncAction.UNCHANGED: 0}
     
+    # 按文件名匹配已有文档，内容未变化的文件跳过入库
     for file in files:
         try:
-            document = await document_service.upload(kb_id, current_user.id, file)
+            document, action = await document_service.sync_upload(kb_id, current_user.id, file, metadata or None)
             if document:
-                # 添加元数据
-                metadata = {}
-                if description:
-                    metadata["description"] = description
-                if tags:
-                    tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
-                    metadata["tags"] = tag_list
-                
-                if metadata:
-                    document_service.update_metadata(document.id, metadata)
-                
+                actions[action] += 1
                 uploaded_documents.append(document)
             else:
                 failed_files.append(file.filename)
@@ -248,24 +376,27 @@ async def batch_upload_documents(
             logger.error(f"文件上传失败: {file.filename}, error={str(e)}")
             failed_files.append(file.filename)
     
+    logger.info(
+        f"批量上传完成: kb_id={kb_id}, 新增={actions[SyncAction.CREATED]}, "
+        f"更新={actions[SyncAction.UPDATED]}, 未变化={actions[SyncAction.UNCHANGED]}"
+    )
     if failed_files:
         logger.warning(f"部分文件上传失败: {failed_files}")
         # 可以选择抛出异常或返回部分成功的结果
     
     return uploaded_documents
 
-@router.post("/import-from-directory")
+@router.post("/import-from-directory", response_model=ImportJobResponse, status_code=202)
 async def import_from_directory(
     kb_id: int = Form(...),
     directory_path: str = Form(...),
     recursive: bool = Form(False),
     description: Optional[str] = Form(None),
     tags: Optional[str] = Form(None),
-    document_service: DocumentService = Depends(get_document_service_dep),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """从指定目录导入文档"""
+    """从指定目录导入文档：创建后台导入任务并立即返回，通过任务接口查询进度"""
     logger.info(f"从目录导入文档: kb_id={kb_id}, directory={directory_path}, user_id={current_user.id}")
     
     # 验证知识库存在
@@ -279,112 +410,53 @@ async def import_from_directory(
         raise HTTPException(status_code=404, detail="知识库不存在")
     
     # 检查目录是否存在
-    if not os.path.exists(directory_path):
+    if not await asyncio.to_thread(os.path.isdir, directory_path):
         logger.warning(f"目录不存在: {directory_path}")
         raise HTTPException(status_code=404, detail="目录不存在")
     
-    # 支持的文件扩展名
-    allowed_extensions = {'.txt', '.pdf', '.doc', '.docx', '.md', '.ppt', '.pptx', '.xls', '.xlsx'}
-    
-    imported_files = []
-    failed_files = []
-    
-    # 遍历目录
-    if recursive:
-        for root, dirs, files in os.walk(directory_path):
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                ext = os.path.splitext(filename)[1].lower()
-                
-                if ext in allowed_extensions:
-                    try:
-                        success = await import_single_file(
-                            file_path, kb_id, current_user.id, 
-                            document_service, description, tags
-                        )
-                        if success:
-                            imported_files.append(filename)
-                        else:
-                            failed_files.append(filename)
-                    except Exception as e:
-                        logger.error(f"导入文件失败: {filename}, error={str(e)}")
-                        failed_files.append(filename)
-    else:
-        for filename in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, filename)
-            if os.path.isfile(file_path):
-                ext = os.path.splitext(filename)[1].lower()
-                
-                if ext in allowed_extensions:
-                    try:
-                        success = await import_single_file(
-                            file_path, kb_id, current_user.id, 
-                            document_service, description, tags
-                        )
-                        if success:
-                            imported_files.append(filename)
-                        else:
-                            failed_files.append(filename)
-                    except Exception as e:
-                        logger.error(f"导入文件失败: {filename}, error={str(e)}")
-                        failed_files.append(filename)
-    
-    return {
-        "message": f"导入完成，成功: {len(imported_files)}, 失败: {len(failed_files)}",
-        "imported_files": imported_files,
-        "failed_files": failed_files
-    }
+    # 添加元数据
+    metadata = {}
+    if description:
+        metadata["description"] = description
+    if tags:
+        metadata["tags"] = [tag.strip() for tag in tags.split(",") if tag.strip()]
+    
+    # 增量导入：未变化的文件跳过，变化的文件只重新向量化变化的块
+    job = create_import_job(db, kb_id, current_user.id, directory_path, recursive, metadata)
+    get_directory_importer().start(job.id)
+    logger.info(f"目录导入任务已创建: job_id={job.id}")
+    return job
 
-async def import_single_file(
-    file_path: str, 
-    kb_id: int, 
-    user_id: int, 
-    document_service: DocumentService,
-    description: Optional[str] = None,
-    tags: Optional[str] = None
-) -> bool:
-    """导入单个文件"""
-    try:
-        # 读取文件内容
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        
-        filename = os.path.basename(file_path)
-        
-        # 创建临时UploadFile对象
-        class TempUploadFile:
-            def __init__(self, filename: str, content: bytes):
-                self.filename = filename
-                self.content = content
-                self.size = len(content)
-            
-            async def read(self):
-                return self.content
-        
-        temp_file = TempUploadFile(filename, file_content)
-        
-        # 上传文档
-        document = await document_service.upload(kb_id, user_id, temp_file)
-        
-        if document:
-            # 添加元数据
-            metadata = {}
-            if description:
-                metadata["description"] = description
-            if tags:
-                tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
-                metadata["tags"] = tag_list
-            
-            if metadata:
-                document_service.update_metadata(document.id, metadata)
-            
-            return True
-        
-        return False
-        
-    except Exception as e:
-        logger.error(f"导入文件失败: {file_path}, error={str(e)}")
-        return False
+def _get_import_job(db: Session, job_id: int, user_id: int) -> ImportJob:
+    job = db.query(ImportJob).filter(ImportJob.id == job_id, ImportJob.created_by == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job
+
+@router.get("/import-jobs/{job_id}", response_model=ImportJobResponse)
+async def get_import_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """查询目录导入任务的进度"""
+    return _get_import_job(db, job_id, current_user.id)
+
+@router.get("/import-jobs/{job_id}/files", response_model=List[ImportJobFileResponse])
+async def get_import_job_files(
+    job_id: int,
+    action: Optional[str] = Query(None, description="created, updated, unchanged or failed"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """查询目录导入任务中每个文件的处理结果和错误"""
+    _get_import_job(db, job_id, current_user.id)
+    query = db.query(ImportJobFile).filter(ImportJobFile.job_id == job_id)
+    if action:
+        query = query.filter(ImportJobFile.action == action)
+    return query.order_by(ImportJobFile.id).offset(skip).limit(limit).all()
 
 @router.delete("/batch")
 async def batch_delete_documents(
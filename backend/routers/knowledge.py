@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
+import asyncio
 import os
 import shutil
 import sys
@@ -19,7 +20,9 @@ try:
     from ..auth.security import get_current_user
     from ..schemas.knowledge import *  # Import knowledge schemas directly
     from ..services.knowledge_service import KnowledgeService
-    from ..services.document_service import DocumentService
+    from ..services.document_service import DocumentService, unsupported_file_type
+    from ..services.blob_store import UploadTooLargeError
+    from ..common.pagination import set_page_headers, InvalidCursorError
     from ..logger import get_logger
 except ImportError:
     # Try using absolute imports
@@ -29,12 +32,27 @@ except ImportError:
     from ..auth.security import get_current_user
     from ..schemas.knowledge import *  # Import knowledge schemas directly
     from ..services.knowledge_service import KnowledgeService
-    from ..services.document_service import DocumentService
+    from ..services.document_service import DocumentService, unsupported_file_type
+    from ..services.blob_store import UploadTooLargeError
+    from ..common.pagination import set_page_headers, InvalidCursorError
     from ..logger import get_logger
 
 router = APIRouter()
 logger = get_logger(__name__)
 
+_rag_service = None
+
+def _get_rag_service():
+    """跨知识库检索共用的RAGService，首次使用时创建"""
+    global _rag_service
+    if _rag_service is None:
+        try:
+            from ..services.rag_service import RAGService
+        except ImportError:
+            from backend.services.rag_service import RAGService
+        _rag_service = RAGService()
+    return _rag_service
+
 # 依赖函数：获取知识库服务
 def get_knowledge_service_dep(db: Session = Depends(get_db)) -> KnowledgeService:
     return KnowledgeService(db)
@@ -72,6 +90,51 @@ async def create_knowledge_base(
     logger.info(f"创建知识库: user_id={current_user.id}, data={knowledge_base}")
     return knowledge_service.create(current_user.id, knowledge_base.dict())
 
+@router.post("/search", response_model=FederatedSearchResponse)
+async def federated_search(
+    request: FederatedSearchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """在多个知识库中并行检索，合并为一个排序结果"""
+    logger.info(f"跨知识库检索: user_id={current_user.id}, kb_ids={request.kb_ids}, query={request.query}")
+    
+    try:
+        from ..services.rag_service import SEARCH_MODES
+        from ..services.metadata_filters import MetadataFilter, MetadataFilterError
+    except ImportError:
+        from backend.services.rag_service import SEARCH_MODES
+        from backend.services.metadata_filters import MetadataFilter, MetadataFilterError
+    
+    if request.mode is not None and request.mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的检索方式: {request.mode}")
+    try:
+        metadata_filter = MetadataFilter.from_dict(request.filters.model_dump(exclude_none=True)) if request.filters else None
+    except MetadataFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 只检索当前用户的知识库
+    query = db.query(KnowledgeBase.id).filter(KnowledgeBase.created_by == current_user.id)
+    if request.kb_ids is not None:
+        query = query.filter(KnowledgeBase.id.in_(request.kb_ids))
+    kb_ids = [kb_id for (kb_id,) in query.all()]
+    if request.kb_ids is not None and len(kb_ids) != len(set(request.kb_ids)):
+        missing = sorted(set(request.kb_ids) - set(kb_ids))
+        raise HTTPException(status_code=404, detail=f"知识库不存在: {missing}")
+    if not kb_ids:
+        return FederatedSearchResponse()
+    
+    result = await asyncio.to_thread(
+        _get_rag_service().federated_search,
+        kb_ids,
+        request.query,
+        request.limit,
+        request.mode,
+        metadata_filter,
+        request.timeout
+    )
+    return FederatedSearchResponse(**result)
+
 @router.get("/{kb_id}", response_model=KnowledgeBaseResponse)
 async def get_knowledge_base(
     kb_id: int,
@@ -113,6 +176,23 @@ async def delete_knowledge_base(
     if not success:
         logger.warning(f"知识库不存在: kb_id={kb_id}")
         raise HTTPException(status_code=404, detail="知识库不存在")
+    
+    # 删除知识库对应的向量索引、关键词索引和缓存的答案
+    try:
+        try:
+            from ..services.vector_store import get_vector_store
+            from ..services.keyword_index import get_keyword_index
+            from ..services.answer_cache import invalidate_answer_cache
+        except ImportError:
+            from backend.services.vector_store import get_vector_store
+            from backend.services.keyword_index import get_keyword_index
+            from backend.services.answer_cache import invalidate_answer_cache
+        get_vector_store().drop(kb_id)
+        get_keyword_index().drop(kb_id)
+        invalidate_answer_cache(kb_id)
+    except Exception as e:
+        logger.error(f"删除向量索引失败: kb_id={kb_id}, error={str(e)}")
+    
     return {"message": "知识库删除成功"}
 
 @router.post("/{kb_id}/documents", response_model=DocumentResponse)
@@ -124,75 +204,45 @@ async def upload_document(
 ):
     """上传文档到知识库"""
     logger.info(f"上传文档: kb_id={kb_id}, user_id={current_user.id}, file_name={file.filename}")
-    doc = await document_service.upload(kb_id, current_user.id, file)
+    unsupported = unsupported_file_type(file.filename)
+    if unsupported:
+        logger.warning(f"文件类型不支持: kb_id={kb_id}, file_name={file.filename}")
+        raise HTTPException(status_code=400, detail=unsupported)
+    try:
+        doc = await document_service.upload(kb_id, current_user.id, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     if not doc:
-        logger.warning(f"知识库不存在或文件类型不支持: kb_id={kb_id}, file_name={file.filename}")
-        raise HTTPException(status_code=404, detail="知识库不存在或文件类型不支持")
+        logger.warning(f"知识库不存在: kb_id={kb_id}, file_name={file.filename}")
+        raise HTTPException(status_code=404, detail="知识库不存在")
     
-    # 异步处理文档
-    try:
-        # 仅在需要时导入和使用RAGService
-        try:
-            from ..services.rag_service import RAGService
-        except ImportError:
-            from backend.services.rag_service import RAGService
-            
-        rag_service = RAGService()
-        
-        # 处理文档（提取文本、分块、向量化）
-        chunk_data = rag_service.process_document(doc.file_path, doc.id, kb_id)
-        
-        # 保存块到数据库
-        db = next(get_db())  # 获取数据库会话
-        for chunk_info in chunk_data:
-            chunk = DocumentChunk(
-                document_id=doc.id,
-                knowledge_base_id=kb_id,
-                chunk_text=chunk_info["content"],
-                chunk_index=chunk_info["chunk_index"],
-                vector_id=chunk_info["embedding_id"],
-                chunk_metadata=chunk_info["metadata"]
-            )
-            db.add(chunk)
-        
-        # 更新文档状态
-        document_service.update_status(
-            doc.id, 
-            DocumentStatus.COMPLETED,
-            {"chunk_count": len(chunk_data)}
-        )
-        
-    except Exception as e:
-        logger.error(f"文档处理失败: doc_id={doc.id}, error={str(e)}", exc_info=True)
-        # 处理失败
-        document_service.update_status(
-            doc.id,
-            DocumentStatus.FAILED,
-            {"error": str(e)}
-        )
-        raise HTTPException(status_code=500, detail=f"文档处理失败: {str(e)}")
+    # 文档已加入后台入库队列，立即返回；处理进度通过文档的 status 和 chunk_count 查询
+    logger.info(f"文档已加入入库队列: doc_id={doc.id}, kb_id={kb_id}")
     
     return doc
 
 @router.get("/{kb_id}/documents", response_model=List[DocumentResponse])
 async def get_documents(
     kb_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     document_service: DocumentService = Depends(get_document_service_dep),
     current_user: User = Depends(get_current_user)
 ):
-    """获取知识库的文档列表"""
+    """获取知识库的文档列表，按创建时间倒序；传入上一页响应头 X-Next-Cursor 的值作为cursor继续翻页"""
     logger.info(f"获取知识库文档列表: kb_id={kb_id}, user_id={current_user.id}, skip={skip}, limit={limit}")
-    documents = document_service.get_all_by_kb(kb_id, current_user.id, skip, limit)
-    if not documents and skip == 0:
-        # 如果是第一页且没有文档，检查知识库是否存在
-        kb_service = KnowledgeService(next(get_db()))
-        kb = kb_service.get_by_id(kb_id, current_user.id)
-        if not kb:
-            logger.warning(f"知识库不存在: kb_id={kb_id}")
-            raise HTTPException(status_code=404, detail="知识库不存在")
-    
+    try:
+        page = document_service.page_by_kb(kb_id, current_user.id, limit, cursor, skip)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        logger.warning(f"知识库不存在: kb_id={kb_id}")
+        raise HTTPException(status_code=404, detail="知识库不存在")
+
+    documents, total, next_cursor = page
+    set_page_headers(response, total, next_cursor)
     return documents
 
 @router.delete("/documents/{doc_id}")
@@ -204,27 +254,12 @@ async def delete_document(
     """删除文档"""
     logger.info(f"删除文档: doc_id={doc_id}, user_id={current_user.id}")
     
-    # 获取文档信息（用于后续删除向量数据）
     doc = document_service.get_by_id(doc_id, current_user.id)
     if not doc:
         logger.warning(f"文档不存在: doc_id={doc_id}")
         raise HTTPException(status_code=404, detail="文档不存在")
     
-    # 删除向量数据库中的块
-    try:
-        # 仅在需要时导入和使用RAGService
-        try:
-            from ..services.rag_service import RAGService
-        except ImportError:
-            from backend.services.rag_service import RAGService
-            
-        rag_service = RAGService()
-        rag_service.delete_document_chunks(doc_id)
-    except Exception as e:
-        logger.error(f"删除向量数据失败: doc_id={doc_id}, error={str(e)}")
-        # 继续删除文档，即使向量数据删除失败
-    
-    # 删除文档
+    # 删除文档及其向量数据
     success = document_service.delete(doc_id, current_user.id)
     if not success:
         logger.warning(f"文档删除失败: doc_id={doc_id}")
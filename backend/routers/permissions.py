@@ -5,7 +5,7 @@ from typing import List, Optional
 from ..config.database import get_db
 from ..schemas import Permission, PermissionCreate, PaginatedResponse, ApiResponse
 from ..common import crud
-from ..auth.security import get_current_user
+from ..auth.security import get_current_user, clear_principal_cache, require_role, ADMIN_ROLE
 from ..models.user import User as DBUser
 
 import logging
@@ -14,11 +14,8 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 权限检查辅助函数
-def check_admin_permission(current_user: DBUser = Depends(get_current_user)):
-    if "admin" not in [role.name for role in current_user.roles]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="您没有管理员权限")
-    return current_user
+# 权限检查辅助函数：角色集合在认证时已编译好，检查不访问数据库
+check_admin_permission = require_role(ADMIN_ROLE, "您没有管理员权限")
 
 @router.get("/", response_model=ApiResponse[PaginatedResponse[Permission]])
 async def get_all_permissions(
@@ -80,6 +77,7 @@ async def update_permission(
     db_permission = crud.update_permission(db, permission_id, permission_update)
     if db_permission is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="权限不存在")
+    clear_principal_cache()
     return db_permission
 
 @router.delete("/{permission_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -92,4 +90,5 @@ async def delete_permission(
     result = crud.delete_permission(db, permission_id)
     if result is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="权限不存在")
+    clear_principal_cache()
     return
\ No newline at end of file
@@ -3,9 +3,10 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from ..config.database import get_db
-from ..schemas import Role, RoleCreate, RoleUpdate, RolePermissionUpdate, PaginatedResponse, ApiResponse
+from ..schemas import Role, RoleSummary, RoleCreate, RoleUpdate, RolePermissionUpdate, PaginatedResponse, ApiResponse
 from ..common import crud
-from ..auth.security import get_current_user
+from ..common.pagination import InvalidCursorError
+from ..auth.security import get_current_user, clear_principal_cache, require_role, ADMIN_ROLE
 from ..models.user import User as DBUser
 
 import logging
@@ -14,24 +15,25 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 权限检查辅助函数
-def check_admin_permission(current_user: DBUser = Depends(get_current_user)):
-    if "admin" not in [role.name for role in current_user.roles]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="您没有管理员权限")
-    return current_user
+# 权限检查辅助函数：角色集合在认证时已编译好，检查不访问数据库
+check_admin_permission = require_role(ADMIN_ROLE, "您没有管理员权限")
 
-@router.get("/", response_model=ApiResponse[PaginatedResponse[Role]])
+@router.get("/", response_model=ApiResponse[PaginatedResponse[RoleSummary]])
 async def get_all_roles(
     db: Session = Depends(get_db),
     current_user: DBUser = Depends(check_admin_permission),
     page: int = 1,
     page_size: int = 10,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    cursor: Optional[str] = None # 上一页返回的nextCursor，传入时按游标翻页，忽略page
 ):
     """获取角色列表"""
     skip = (page - 1) * page_size
-    roles, total = crud.get_roles(db, skip=skip, limit=page_size, search=search)
-    paginated_response = PaginatedResponse(items=roles, total=total, page=page, pageSize=page_size, totalPages=(total + page_size - 1) // page_size)
+    try:
+        roles, total, next_cursor = crud.get_roles(db, skip=skip, limit=page_size, search=search, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    paginated_response = PaginatedResponse(items=roles, total=total, page=page, pageSize=page_size, totalPages=(total + page_size - 1) // page_size, nextCursor=next_cursor)
     return ApiResponse(success=True, data=paginated_response, message="角色列表获取成功")
 
 @router.get("/{role_id}", response_model=Role)
@@ -85,6 +87,7 @@ async def update_role(
     db_role = crud.update_role(db, role_id, role_update)
     if db_role is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="角色不存在")
+    clear_principal_cache()
     return db_role
 
 @router.delete("/{role_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -102,6 +105,7 @@ async def delete_role(
     result = crud.delete_role(db, role_id)
     if result is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="角色不存在")
+    clear_principal_cache()
     return
 
 @router.put("/{role_id}/permissions", response_model=Role)
@@ -115,6 +119,7 @@ async def update_role_permissions(
     db_role = crud.update_role_permissions(db, role_id, role_permission_update.permissions)
     if db_role is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="角色不存在")
+    clear_principal_cache()
     return db_role
 
 @router.get("/{role_id}/users", response_model=List[str])
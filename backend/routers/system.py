@@ -10,7 +10,7 @@ from datetime import datetime, timedelta
 import zipfile
 import io
 
-from ..database import get_db
+from ..database import get_db, pool_metrics, async_pool_metrics
 from ..auth.security import get_current_user
 from ..models.user import User
 from ..schemas.system import (
@@ -324,6 +324,16 @@ async def update_system_config(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新系统配置失败: {str(e)}")
 
+@router.get("/database/pool")
+async def get_database_pool_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """获取数据库连接池状态：已借出、空闲、溢出连接数和获取连接的等待时间"""
+    return {
+        "sync": pool_metrics(),
+        "async": async_pool_metrics()
+    }
+
 @router.get("/health")
 async def health_check():
     """系统健康检查"""
@@ -5,7 +5,8 @@ from typing import List, Optional
 from ..config.database import get_db
 from ..schemas import User, UserCreate, UserUpdate, UserPasswordReset, PaginatedResponse, ApiResponse, UserRoleUpdate # 导入PaginatedResponse和ApiResponse, UserRoleUpdate
 from ..common import crud
-from ..auth.security import get_current_user # 导入get_current_user
+from ..common.pagination import InvalidCursorError
+from ..auth.security import get_current_user, invalidate_user_principal, require_role, ADMIN_ROLE, get_password_hash_async # 导入get_current_user
 from ..models.user import User as DBUser # 导入数据库User模型
 
 import logging
@@ -14,11 +15,8 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 权限检查辅助函数
-def check_admin_permission(current_user: DBUser = Depends(get_current_user)):
-    if "admin" not in [role.name for role in current_user.roles]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="您没有管理员权限")
-    return current_user
+# 权限检查辅助函数：角色集合在认证时已编译好，检查不访问数据库
+check_admin_permission = require_role(ADMIN_ROLE, "您没有管理员权限")
 
 @router.get("/", response_model=ApiResponse[PaginatedResponse[User]]) # 修改返回模型为ApiResponse封装PaginatedResponse
 async def get_all_users(
@@ -26,12 +24,16 @@ async def get_all_users(
     current_user: DBUser = Depends(check_admin_permission), # 添加管理员权限检查
     page: int = 1,
     page_size: int = 10,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    cursor: Optional[str] = None # 上一页返回的nextCursor，传入时按游标翻页，忽略page
 ):
     """获取用户列表"""
     skip = (page - 1) * page_size
-    users, total = crud.get_users(db, skip=skip, limit=page_size, search=search)
-    paginated_response = PaginatedResponse(items=users, total=total, page=page, pageSize=page_size, totalPages=(total + page_size - 1) // page_size)
+    try:
+        users, total, next_cursor = crud.get_users(db, skip=skip, limit=page_size, search=search, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    paginated_response = PaginatedResponse(items=users, total=total, page=page, pageSize=page_size, totalPages=(total + page_size - 1) // page_size, nextCursor=next_cursor)
     return ApiResponse(success=True, data=paginated_response, message="用户列表获取成功") # 封装在ApiResponse中
 
 @router.get("/{user_id}", response_model=User)
@@ -65,7 +67,8 @@ async def create_user(
             logger.warning(f"创建用户失败: 邮箱 '{user.email}' 已存在")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="邮箱已存在")
         
-        db_user = crud.create_user(db=db, user=user)
+        hashed_password = await get_password_hash_async(user.password) # 在密码哈希线程池中计算，不阻塞事件循环
+        db_user = crud.create_user(db=db, user=user, hashed_password=hashed_password)
         logger.info(f"用户 '{user.username}' 创建成功")
         return db_user
     except HTTPException as e:
@@ -85,6 +88,7 @@ async def update_user(
     db_user = crud.update_user(db, user_id, user_update)
     if db_user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户不存在")
+    invalidate_user_principal(user_id)
     return db_user
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -104,6 +108,7 @@ async def delete_user(
     result = crud.delete_user(db, user_id)
     if result is None: # 如果用户不存在，crud.delete_user会返回None
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户不存在")
+    invalidate_user_principal(user_id)
     return # 204 No Content 不需要返回体
 
 @router.put("/{user_id}/roles", response_model=User)
@@ -117,6 +122,7 @@ async def update_user_roles(
     db_user = crud.update_user_roles(db, user_id, user_role_update.roles) # 传递roles列表
     if db_user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户不存在")
+    invalidate_user_principal(user_id)
     # 检查所有角色名称是否存在
     for role_name in user_role_update.roles: # 遍历user_role_update.roles
         if not crud.get_role_by_name(db, role_name):
@@ -131,7 +137,9 @@ async def reset_user_password(
     current_user: DBUser = Depends(check_admin_permission) # 添加管理员权限检查
 ):
     """重置用户密码"""
-    result = crud.reset_user_password(db, user_id, password_reset.new_password)
+    hashed_password = await get_password_hash_async(password_reset.new_password) # 在密码哈希线程池中计算，不阻塞事件循环
+    result = crud.reset_user_password(db, user_id, hashed_password)
     if result is None: # 如果用户不存在，crud.reset_user_password会返回None
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户不存在")
+    invalidate_user_principal(user_id)
     return # 204 No Content 不需要返回体
\ No newline at end of file
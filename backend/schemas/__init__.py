@@ -54,6 +54,15 @@ class Role(RoleBase):
     class Config:
         from_attributes = True
 
+# 角色列表项：只有用户数和权限数，权限明细通过获取单个角色接口按需加载
+class RoleSummary(RoleBase):
+    id: int
+    userCount: int = 0
+    permissionCount: int = 0
+
+    class Config:
+        from_attributes = True
+
 # 新增角色权限更新Schema
 class RolePermissionUpdate(BaseModel):
     permissions: List[str]  # 权限name列表
@@ -93,6 +102,7 @@ class PaginatedResponse(BaseModel, Generic[T]):
     page: int
     pageSize: int
     totalPages: int
+    nextCursor: Optional[str] = None # 下一页的游标，传回cursor参数继续翻页；最后一页为None
 
 # 新增通用API响应Schema
 class ApiResponse(BaseModel, Generic[T]):
@@ -108,7 +118,7 @@ User.update_forward_refs()
 # Re-export all schemas
 __all__ = [
     'UserBase', 'UserCreate', 'PermissionBase', 'PermissionCreate', 'Permission',
-    'RoleBase', 'RoleCreate', 'RoleUpdate', 'Role', 'RolePermissionUpdate',
+    'RoleBase', 'RoleCreate', 'RoleUpdate', 'Role', 'RoleSummary', 'RolePermissionUpdate',
     'User', 'UserUpdate', 'UserPasswordReset', 'UserRoleUpdate', 'Token',
     'PaginatedResponse', 'ApiResponse',
     # Knowledge schemas
@@ -1,12 +1,15 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 # ChatSession schemas
+# "model_config" is reserved by pydantic v2, the field is exposed under that name through an alias
 class ChatSessionBase(BaseModel):
     title: Optional[str] = None
     knowledge_base_id: Optional[int] = None  # Changed from kb_id
-    model_config: Optional[Dict[str, Any]] = None
+    session_model_config: Optional[Dict[str, Any]] = Field(None, alias="model_config")
+    
+    model_config = ConfigDict(populate_by_name=True)
 
 class ChatSessionCreate(ChatSessionBase):
     pass
@@ -14,7 +17,9 @@ class ChatSessionCreate(ChatSessionBase):
 class ChatSessionUpdate(BaseModel):
     title: Optional[str] = None
     knowledge_base_id: Optional[int] = None  # Changed from kb_id
-    model_config: Optional[Dict[str, Any]] = None
+    session_model_config: Optional[Dict[str, Any]] = Field(None, alias="model_config")
+    
+    model_config = ConfigDict(populate_by_name=True)
 
 class ChatSessionResponse(ChatSessionBase):
     id: int
@@ -22,8 +27,16 @@ class ChatSessionResponse(ChatSessionBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(populate_by_name=True, from_attributes=True)
+
+# Retrieval filter schemas
+class SearchFilters(BaseModel):
+    """Restrict retrieval to documents matching all given conditions"""
+    tags: Optional[List[str]] = Field(None, description="Documents having every one of these tags")
+    file_types: Optional[List[str]] = Field(None, description="Document file types, e.g. pdf, docx")
+    doc_ids: Optional[List[int]] = Field(None, description="Document IDs")
+    created_after: Optional[datetime] = Field(None, description="Documents created at or after this time")
+    created_before: Optional[datetime] = Field(None, description="Documents created at or before this time")
 
 # ChatMessage schemas
 class ChatMessageBase(BaseModel):
@@ -36,6 +49,7 @@ class ChatMessageCreate(ChatMessageBase):
     temperature: float = 0.7
     max_tokens: int = 1000
     top_k: int = 5
+    filters: Optional[SearchFilters] = None
 
 class ChatMessageResponse(ChatMessageBase):
     id: int
@@ -58,6 +72,7 @@ class StreamChatRequest(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 1000
     top_k: int = 5
+    filters: Optional[SearchFilters] = None
 
 # Test connection schemas
 class TestConnectionRequest(BaseModel):
@@ -7,6 +7,8 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+from .chat import SearchFilters
+
 class KnowledgeBaseStatus(str, Enum):
     ACTIVE = "active"
     INACTIVE = "inactive"
@@ -27,7 +29,7 @@ class KnowledgeBaseBase(BaseModel):
     is_public: bool = Field(False, description="Whether it's public")
     embedding_model: Optional[str] = Field(None, description="Embedding model used")
     vector_store: Optional[str] = Field(None, description="Vector store used")
-    kb_metadata: Optional[Dict[str, Any]] = Field(None, description="Knowledge base metadata")
+    kb_metadata: Optional[Dict[str, Any]] = Field(None, description="Knowledge base metadata, the \"chunking\" entry configures document chunking")
     tags: Optional[List[str]] = Field(None, description="Tags")
 
 class KnowledgeBaseCreate(KnowledgeBaseBase):
@@ -106,4 +108,75 @@ class DocumentChunkResponse(DocumentChunkBase):
     created_at: datetime = Field(..., description="Creation time")
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+class FederatedSearchRequest(BaseModel):
+    """Request model for searching several knowledge bases at once"""
+    query: str = Field(..., min_length=1, description="Query text")
+    kb_ids: Optional[List[int]] = Field(None, description="Knowledge base IDs, all knowledge bases of the user when omitted")
+    limit: int = Field(10, ge=1, le=100, description="Maximum number of merged results")
+    mode: Optional[str] = Field(None, description="Search mode: vector, keyword or hybrid")
+    filters: Optional[SearchFilters] = Field(None, description="Metadata filter applied in every knowledge base")
+    timeout: Optional[float] = Field(None, gt=0, le=30, description="Seconds allowed for the whole search")
+
+class FederatedSearchHit(BaseModel):
+    """A hit of a federated search"""
+    kb_id: int = Field(..., description="Knowledge base ID")
+    vector_id: str = Field(..., description="Vector ID")
+    content: str = Field(..., description="Chunk content")
+    score: float = Field(..., description="Score within the knowledge base")
+    merged_score: float = Field(..., description="Score comparable across knowledge bases: cosine similarity in vector mode, otherwise reciprocal rank within the knowledge base")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Chunk metadata")
+
+class FederatedSearchResponse(BaseModel):
+    """Response model of a federated search"""
+    results: List[FederatedSearchHit] = Field(default_factory=list, description="Merged hits, best first")
+    timed_out: List[int] = Field(default_factory=list, description="Knowledge bases that did not answer in time")
+    failed: Dict[int, str] = Field(default_factory=dict, description="Knowledge bases whose search failed")
+
+class UploadSessionCreate(BaseModel):
+    """Request model for opening a resumable upload"""
+    filename: str = Field(..., min_length=1, max_length=255, description="Original file name")
+    size: int = Field(..., ge=0, description="Total file size in bytes")
+
+class UploadSessionResponse(BaseModel):
+    """State of a resumable upload"""
+    upload_id: str = Field(..., description="Upload session ID")
+    filename: str = Field(..., description="Original file name")
+    size: int = Field(..., description="Total file size in bytes")
+    received: int = Field(..., description="Bytes received so far, the offset of the next part")
+    part_size: int = Field(..., description="Suggested part size in bytes")
+
+class ImportJobResponse(BaseModel):
+    """Progress of a directory import job"""
+    id: int
+    knowledge_base_id: int
+    directory_path: str
+    recursive: bool = False
+    status: str = Field(..., description="pending, running, completed or failed")
+    discovered_files: int = Field(0, description="Files found so far, the total once discovery_done is set")
+    discovery_done: bool = Field(False, description="Whether the directory has been fully listed")
+    processed_files: int = 0
+    created_files: int = 0
+    updated_files: int = 0
+    unchanged_files: int = 0
+    failed_files: int = 0
+    last_error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ImportJobFileResponse(BaseModel):
+    """Outcome of one file of a directory import job"""
+    id: int
+    path: str
+    action: str = Field(..., description="created, updated, unchanged or failed")
+    document_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -21,7 +21,7 @@ class ABTestService:
         """初始化AB测试服务"""
         self.rag_service = rag_service
         self.llm_service = llm_service
-        self.rag_chat_service = RAGChatService(rag_service, llm_service)
+        self.rag_chat_service = RAGChatService(llm_service, rag_service=rag_service)
     
     def create_test(self, test_data: Dict[str, Any], user_id: int) -> ABTest:
         """创建AB测试"""
@@ -113,30 +113,30 @@ class ABTestService:
                 retrieval_method = group_config.get("retrieval_method", "vector")
                 top_k = group_config.get("top_k", 5)
                 
-                if retrieval_method == "vector":
-                    search_results = self.rag_service.search(query, kb_id, top_k)
-                elif retrieval_method == "hybrid":
-                    # 混合检索
-                    vector_results = self.rag_service.search(query, kb_id, top_k)
-                    # 这里可以添加关键词检索逻辑
-                    search_results = vector_results
-                else:
-                    search_results = self.rag_service.search(query, kb_id, top_k)
+                # vector: 向量检索；keyword: BM25关键词检索；hybrid: 两者按RRF融合
+                if retrieval_method not in ("vector", "keyword", "hybrid"):
+                    logger.warning(f"未知的检索方法，使用向量检索: {retrieval_method}")
+                    retrieval_method = "vector"
                 
-                # 使用默认配置生成回答
+                # 用该组的检索方法生成回答，不使用答案缓存以免各组共享结果
                 response = await self.rag_chat_service.chat(
                     query=query,
                     kb_id=kb_id,
-                    top_k=top_k
+                    top_k=top_k,
+                    use_cache=False,
+                    search_mode=retrieval_method
                 )
                 
             elif test_session.ab_test.test_type == TestType.CHUNK_SIZE:
                 # 分块大小对比测试
+                # 分块在入库时按知识库的kb_metadata["chunking"]配置完成，每组指向用各自分块配置构建的知识库
                 chunk_size = group_config.get("chunk_size", 512)
-                # 这里需要重新处理文档分块，暂时使用默认配置
+                group_kb_id = group_config.get("kb_id", kb_id)
+                logger.info(f"分块大小测试: group={test_session.group}, kb_id={group_kb_id}, chunk_size={chunk_size}")
                 response = await self.rag_chat_service.chat(
                     query=query,
-                    kb_id=kb_id
+                    kb_id=group_kb_id,
+                    top_k=group_config.get("top_k", 5)
                 )
                 
             else:
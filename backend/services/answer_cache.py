@@ -0,0 +1,444 @@
+"""
+Answer cache, reuses RAG answers for semantically near-identical questions
+
+Entries are grouped per knowledge base and model configuration. A lookup embeds the question
+and returns the cached answer whose question embedding is most similar, provided the cosine
+similarity reaches the threshold and the entry has not expired. Entries of a knowledge base
+are invalidated whenever its documents change.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+try:
+    from .embedding_service import get_embedding_service
+except ImportError:
+    from backend.services.embedding_service import get_embedding_service
+
+logger = get_logger(__name__)
+
+# Cache configuration, overridable through environment variables. Disabled by default: a hit
+# returns another question's answer, which is only safe when the embeddings are semantic
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "none")
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+REDIS_KEY_PREFIX = "rag:answer_cache"
+
+
+class CacheEntry:
+    """A cached answer and the normalized embedding of its question"""
+
+    def __init__(self, embedding: np.ndarray, answer: Dict[str, Any], expires_at: float, entry_id: Optional[str] = None):
+        self.entry_id = entry_id or uuid.uuid4().hex
+        self.embedding = embedding
+        self.answer = answer
+        self.expires_at = expires_at
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "id": self.entry_id,
+            "embedding": self.embedding.tolist(),
+            "answer": self.answer,
+            "expires_at": self.expires_at
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "CacheEntry":
+        item = json.loads(data)
+        return cls(
+            np.asarray(item["embedding"], dtype=np.float32),
+            item["answer"],
+            item["expires_at"],
+            item["id"]
+        )
+
+
+class AnswerCacheBackend(ABC):
+    """
+    Answer cache storage interface
+    """
+
+    @abstractmethod
+    def entries(self, kb_id: int, namespace: str) -> List[CacheEntry]:
+        """
+        Get the live entries of a namespace
+
+        Args:
+            kb_id: Knowledge base ID
+            namespace: Model configuration namespace
+
+        Returns:
+            Entries that have not expired
+        """
+
+    @abstractmethod
+    def put(self, kb_id: int, namespace: str, entry: CacheEntry) -> None:
+        """
+        Store an entry, evicting the least recently used ones beyond the size limit
+
+        Args:
+            kb_id: Knowledge base ID
+            namespace: Model configuration namespace
+            entry: Entry to store
+        """
+
+    @abstractmethod
+    def touch(self, kb_id: int, namespace: str, entry_id: str) -> None:
+        """Mark an entry as recently used"""
+
+    @abstractmethod
+    def invalidate(self, kb_id: int) -> None:
+        """
+        Drop all entries of a knowledge base
+
+        Args:
+            kb_id: Knowledge base ID
+        """
+
+
+class MemoryAnswerCacheBackend(AnswerCacheBackend):
+    """
+    In-process backend, entries grouped per (knowledge base, namespace) under one global LRU order
+
+    max_entries bounds the whole process, not each group, and groups are dropped once empty, so
+    memory stays bounded however many knowledge bases and model configurations are queried.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._entries: Dict[Tuple[int, str], Dict[str, CacheEntry]] = {}
+        self._lru: "OrderedDict[Tuple[int, str, str], None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, kb_id: int, namespace: str, entry_id: str) -> None:
+        self._lru.pop((kb_id, namespace, entry_id), None)
+        bucket = self._entries.get((kb_id, namespace))
+        if bucket is not None:
+            bucket.pop(entry_id, None)
+            if not bucket:
+                del self._entries[(kb_id, namespace)]
+
+    def entries(self, kb_id: int, namespace: str) -> List[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            bucket = self._entries.get((kb_id, namespace))
+            if not bucket:
+                return []
+            for entry_id in [entry_id for entry_id, entry in bucket.items() if entry.expires_at <= now]:
+                self._remove(kb_id, namespace, entry_id)
+            return list(bucket.values())
+
+    def put(self, kb_id: int, namespace: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries.setdefault((kb_id, namespace), {})[entry.entry_id] = entry
+            self._lru[(kb_id, namespace, entry.entry_id)] = None
+            while len(self._lru) > self.max_entries:
+                self._remove(*next(iter(self._lru)))
+
+    def touch(self, kb_id: int, namespace: str, entry_id: str) -> None:
+        with self._lock:
+            key = (kb_id, namespace, entry_id)
+            if key in self._lru:
+                self._lru.move_to_end(key)
+
+    def invalidate(self, kb_id: int) -> None:
+        with self._lock:
+            for key in [key for key in self._lru if key[0] == kb_id]:
+                self._remove(*key)
+
+
+class RedisAnswerCacheBackend(AnswerCacheBackend):
+    """
+    Redis backend shared by all workers
+
+    Each (knowledge base, namespace) is a hash of serialized entries plus a sorted set of last
+    access times used for LRU eviction. Invalidation bumps a per knowledge base generation number
+    that is part of every key, so stale keys are never read again and simply expire.
+    """
+
+    def __init__(self, url: str = REDIS_URL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: int = ANSWER_CACHE_TTL):
+        import redis
+
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def _keys(self, kb_id: int, namespace: str) -> Tuple[str, str]:
+        generation = int(self._redis.get(f"{REDIS_KEY_PREFIX}:gen:{kb_id}") or 0)
+        base = f"{REDIS_KEY_PREFIX}:{kb_id}:{generation}:{namespace}"
+        return f"{base}:entries", f"{base}:lru"
+
+    def entries(self, kb_id: int, namespace: str) -> List[CacheEntry]:
+        entries_key, lru_key = self._keys(kb_id, namespace)
+        now = time.time()
+        entries, expired = [], []
+        for entry_id, data in self._redis.hgetall(entries_key).items():
+            entry = CacheEntry.from_json(data)
+            if entry.expires_at <= now:
+                expired.append(entry_id)
+            else:
+                entries.append(entry)
+        if expired:
+            pipe = self._redis.pipeline()
+            pipe.hdel(entries_key, *expired)
+            pipe.zrem(lru_key, *expired)
+            pipe.execute()
+        return entries
+
+    def put(self, kb_id: int, namespace: str, entry: CacheEntry) -> None:
+        entries_key, lru_key = self._keys(kb_id, namespace)
+        pipe = self._redis.pipeline()
+        pipe.hset(entries_key, entry.entry_id, entry.to_json())
+        pipe.zadd(lru_key, {entry.entry_id: time.time()})
+        pipe.expire(entries_key, self.ttl)
+        pipe.expire(lru_key, self.ttl)
+        pipe.execute()
+
+        overflow = self._redis.zcard(lru_key) - self.max_entries
+        if overflow > 0:
+            oldest = self._redis.zrange(lru_key, 0, overflow - 1)
+            if oldest:
+                pipe = self._redis.pipeline()
+                pipe.hdel(entries_key, *oldest)
+                pipe.zrem(lru_key, *oldest)
+                pipe.execute()
+
+    def touch(self, kb_id: int, namespace: str, entry_id: str) -> None:
+        _, lru_key = self._keys(kb_id, namespace)
+        self._redis.zadd(lru_key, {entry_id: time.time()}, xx=True)
+
+    def invalidate(self, kb_id: int) -> None:
+        self._redis.incr(f"{REDIS_KEY_PREFIX}:gen:{kb_id}")
+
+
+class AnswerCache:
+    """
+    Answer cache class, semantic lookup on top of a storage backend with hit and saved token metrics
+    """
+
+    def __init__(
+        self,
+        backend: AnswerCacheBackend,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: int = ANSWER_CACHE_TTL
+    ):
+        """
+        Initialize answer cache
+
+        Args:
+            backend: Storage backend
+            threshold: Minimum cosine similarity between questions for a hit
+            ttl: Entry lifetime in seconds
+        """
+        self.backend = backend
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.errors = 0
+
+    @staticmethod
+    def namespace(model_config: Dict[str, Any]) -> str:
+        """
+        Namespace of a model configuration, answers are only shared between identical configurations
+
+        Args:
+            model_config: Provider, model and generation parameters
+
+        Returns:
+            Short stable hash
+        """
+        data = json.dumps(model_config, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, kb_id: int, model_config: Dict[str, Any], embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer for a question
+
+        Args:
+            kb_id: Knowledge base ID
+            model_config: Provider, model and generation parameters
+            embedding: Question embedding
+
+        Returns:
+            Cached answer, or None on a miss
+        """
+        namespace = self.namespace(model_config)
+        try:
+            entries = self.backend.entries(kb_id, namespace)
+            best, similarity = None, -1.0
+            if entries:
+                matrix = np.stack([entry.embedding for entry in entries])
+                scores = matrix @ self._normalize(embedding)
+                index = int(np.argmax(scores))
+                best, similarity = entries[index], float(scores[index])
+
+            if best is None or similarity < self.threshold:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            self.backend.touch(kb_id, namespace, best.entry_id)
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: kb_id={kb_id}, error={str(e)}")
+            with self._lock:
+                self.errors += 1
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.saved_tokens += int((best.answer.get("usage") or {}).get("total_tokens") or 0)
+        return dict(best.answer, cached=True, cache_similarity=similarity)
+
+    def store(self, kb_id: int, model_config: Dict[str, Any], embedding: List[float], answer: Dict[str, Any]) -> None:
+        """
+        Cache an answer
+
+        Args:
+            kb_id: Knowledge base ID
+            model_config: Provider, model and generation parameters
+            embedding: Question embedding
+            answer: Answer as returned by RAGChatService.chat
+        """
+        entry = CacheEntry(self._normalize(embedding), answer, time.time() + self.ttl)
+        try:
+            self.backend.put(kb_id, self.namespace(model_config), entry)
+        except Exception as e:
+            logger.warning(f"Answer cache store failed: kb_id={kb_id}, error={str(e)}")
+            with self._lock:
+                self.errors += 1
+
+    def invalidate(self, kb_id: int) -> None:
+        """
+        Drop the cached answers of a knowledge base, called whenever its documents change
+
+        Args:
+            kb_id: Knowledge base ID
+        """
+        try:
+            self.backend.invalidate(kb_id)
+            logger.info(f"Answer cache invalidated: kb_id={kb_id}")
+        except Exception as e:
+            logger.warning(f"Answer cache invalidation failed: kb_id={kb_id}, error={str(e)}")
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache metrics
+
+        Returns:
+            Hit/miss counters, hit rate and tokens saved by hits
+        """
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "errors": self.errors,
+            "threshold": self.threshold,
+            "ttl": self.ttl
+        }
+
+
+def create_answer_cache_backend(name: str) -> Optional[AnswerCacheBackend]:
+    """
+    Create an answer cache backend by name
+
+    Args:
+        name: "memory", "redis" or "none"
+
+    Returns:
+        Backend instance, None when caching is disabled
+    """
+    if name == "none":
+        return None
+    if name == "memory":
+        return MemoryAnswerCacheBackend()
+    if name == "redis":
+        try:
+            return RedisAnswerCacheBackend()
+        except ImportError:
+            logger.warning("redis package is not installed, falling back to the in-memory answer cache")
+            return MemoryAnswerCacheBackend()
+    raise ValueError(f"Unsupported answer cache backend: {name}")
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_initialized = False
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Get the process-wide answer cache
+
+    The cache stays disabled when the configured embedding provider is not semantic. Bag-of-words
+    vectors score a question and its negation ("公司允许员工在家办公吗" / "公司不允许员工在家办公吗")
+    above any usable threshold, so a hit would return the opposite answer.
+
+    Returns:
+        Shared AnswerCache, None when ANSWER_CACHE_BACKEND is "none" or the embeddings are lexical
+    """
+    global _answer_cache, _answer_cache_initialized
+    if not _answer_cache_initialized:
+        with _answer_cache_lock:
+            if not _answer_cache_initialized:
+                backend = None
+                if ANSWER_CACHE_BACKEND != "none":
+                    provider = get_embedding_service().provider
+                    if provider.semantic:
+                        backend = create_answer_cache_backend(ANSWER_CACHE_BACKEND)
+                    else:
+                        logger.warning(
+                            f"Answer cache disabled: embedding provider '{provider.name}' is not semantic, "
+                            f"configure a semantic EMBEDDING_PROVIDER to enable ANSWER_CACHE_BACKEND={ANSWER_CACHE_BACKEND}"
+                        )
+                _answer_cache = AnswerCache(backend) if backend is not None else None
+                _answer_cache_initialized = True
+    return _answer_cache
+
+
+def invalidate_answer_cache(kb_id: int) -> None:
+    """
+    Invalidate the cached answers of a knowledge base if caching is enabled
+
+    Args:
+        kb_id: Knowledge base ID
+    """
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate(kb_id)
@@ -0,0 +1,391 @@
+"""
+Blob store, content-addressed file storage keyed by SHA-256
+
+Every distinct file content is stored once, no matter how many File or Document rows (in
+how many knowledge bases) point to it. Rows reference a blob through their content_hash
+column; a blob whose reference count has dropped to zero is deleted when its last row is
+released or by garbage collection, but only once it has been untouched for the grace
+period. Files derived from a blob, such as the extracted and chunked text, are stored next
+to it and removed together with it.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Iterator, Optional, Tuple, Dict, Any
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models.knowledge import Document, File
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+logger = get_logger(__name__)
+
+# Blob location and garbage collection settings, overridable through environment variables
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "files/blobs")
+# Unreferenced blobs younger than this are kept, their rows may not be committed yet
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+# Bytes read per step when streaming content into the store
+BLOB_READ_SIZE = 1024 * 1024
+# Largest file accepted in a single upload request, 0 disables the limit; larger files use resumable uploads
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(200 * 1024 * 1024)))
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when uploaded content exceeds the size limit"""
+
+
+class BlobStore:
+    """
+    Blob store class, keeps blobs under objects/<2>/<2>/<sha256><ext> on local disk
+
+    The file extension is part of the blob name because text extraction picks the parser by
+    extension. Blobs are written to a temporary file first and moved into place atomically,
+    so readers never see a partial blob.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        """
+        Initialize blob store
+
+        Args:
+            root: Directory holding the blobs, defaults to BLOB_STORE_DIR
+        """
+        self.root = root or BLOB_STORE_DIR
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.derived_dir = os.path.join(self.root, "derived")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        for directory in (self.objects_dir, self.derived_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, sha256: str, ext: str = "") -> str:
+        """
+        Path of a blob
+
+        Args:
+            sha256: Hex SHA-256 of the content
+            ext: File extension including the leading dot
+
+        Returns:
+            Blob path
+        """
+        return os.path.join(self.objects_dir, sha256[:2], sha256[2:4], f"{sha256}{ext.lower()}")
+
+    def exists(self, sha256: str, ext: str = "") -> bool:
+        return os.path.exists(self.path(sha256, ext))
+
+    def temp_file(self):
+        """Open a temporary file on the same filesystem as the blobs"""
+        return tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+
+    def commit(self, temp_path: str, sha256: str, ext: str = "") -> str:
+        """
+        Move a fully written temporary file into place, or drop it if the blob already exists
+
+        Args:
+            temp_path: Temporary file holding the content
+            sha256: Hex SHA-256 of the content
+            ext: File extension including the leading dot
+
+        Returns:
+            Blob path
+        """
+        path = self.path(sha256, ext)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            # Refresh the mtime so garbage collection treats the blob as newly referenced
+            os.utime(path, None)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path
+
+    async def put_upload(self, file, ext: str, max_size: Optional[int] = None) -> Tuple[str, int, str]:
+        """
+        Store an uploaded file, copied to the store block by block while hashing
+
+        Only one block is held in memory at a time, and file writes, the final move and cleanup
+        run in threads so the event loop never waits on the disk. By the time this runs the
+        server has already received the whole multipart body (Starlette spools it to a temporary
+        file), so max_size bounds what is stored, not what is received; request bodies are
+        bounded earlier by MultipartBodyLimitMiddleware.
+
+        Args:
+            file: UploadFile (anything with an async read(size))
+            ext: File extension including the leading dot
+            max_size: Size limit in bytes, defaults to MAX_UPLOAD_SIZE, 0 disables the limit
+
+        Returns:
+            (blob path, size, SHA-256)
+        """
+        max_size = MAX_UPLOAD_SIZE if max_size is None else max_size
+        digest = hashlib.sha256()
+        size = 0
+        temp = await asyncio.to_thread(self.temp_file)
+        try:
+            with temp:
+                while True:
+                    block = await file.read(BLOB_READ_SIZE)
+                    if not block:
+                        break
+                    size += len(block)
+                    if max_size and size > max_size:
+                        raise UploadTooLargeError(f"File exceeds the upload limit of {max_size} bytes")
+                    digest.update(block)
+                    await asyncio.to_thread(temp.write, block)
+            sha256 = digest.hexdigest()
+            path = await asyncio.to_thread(self.commit, temp.name, sha256, ext)
+            return path, size, sha256
+        except BaseException:
+            await asyncio.to_thread(self._remove_temp, temp.name)
+            raise
+
+    @staticmethod
+    def _remove_temp(path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def put_file(self, source_path: str, ext: Optional[str] = None, sha256: Optional[str] = None) -> Tuple[str, int, str]:
+        """
+        Store a local file
+
+        Args:
+            source_path: File to store
+            ext: File extension, defaults to the extension of source_path
+            sha256: Known hash of the file, lets an existing blob be reused without reading the file
+
+        Returns:
+            (blob path, size, SHA-256)
+        """
+        ext = os.path.splitext(source_path)[1] if ext is None else ext
+        size = os.path.getsize(source_path)
+        if sha256 and self.exists(sha256, ext):
+            path = self.path(sha256, ext)
+            os.utime(path, None)
+            return path, size, sha256
+
+        digest = hashlib.sha256()
+        temp = self.temp_file()
+        try:
+            with temp, open(source_path, "rb") as source:
+                for block in iter(lambda: source.read(BLOB_READ_SIZE), b""):
+                    digest.update(block)
+                    temp.write(block)
+            sha256 = digest.hexdigest()
+            return self.commit(temp.name, sha256, ext), size, sha256
+        except BaseException:
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+            raise
+
+    def derived_path(self, sha256: str, name: str) -> str:
+        """
+        Path of a file derived from a blob, e.g. its processed chunks
+
+        Args:
+            sha256: Hex SHA-256 of the source blob
+            name: Name of the derived file
+
+        Returns:
+            Derived file path
+        """
+        return os.path.join(self.derived_dir, sha256[:2], sha256, name)
+
+    def save_derived(self, sha256: str, name: str, source_path: str) -> str:
+        """
+        Copy a file into the derived files of a blob, atomically
+
+        Args:
+            sha256: Hex SHA-256 of the source blob
+            name: Name of the derived file
+            source_path: File to copy
+
+        Returns:
+            Derived file path
+        """
+        path = self.derived_path(sha256, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.temp_file() as temp, open(source_path, "rb") as source:
+            shutil.copyfileobj(source, temp)
+        os.replace(temp.name, path)
+        return path
+
+    def delete(self, sha256: str) -> int:
+        """
+        Delete a blob (under any extension) and its derived files
+
+        Args:
+            sha256: Hex SHA-256 of the content
+
+        Returns:
+            Number of blob files removed
+        """
+        removed = 0
+        directory = os.path.dirname(self.path(sha256))
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith(sha256):
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        shutil.rmtree(os.path.dirname(self.derived_path(sha256, "x")), ignore_errors=True)
+        return removed
+
+    def last_modified(self, sha256: str) -> Optional[float]:
+        """
+        Newest mtime of a blob under any extension, storing or reusing a blob refreshes it
+
+        Args:
+            sha256: Hex SHA-256 of the content
+
+        Returns:
+            mtime, or None when the blob does not exist
+        """
+        directory = os.path.dirname(self.path(sha256))
+        mtimes = []
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith(sha256):
+                    try:
+                        mtimes.append(os.path.getmtime(os.path.join(directory, name)))
+                    except FileNotFoundError:
+                        continue
+        return max(mtimes) if mtimes else None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, str, float]]:
+        """
+        Iterate over stored blobs
+
+        Returns:
+            Iterator of (SHA-256, path, mtime)
+        """
+        for directory, _, names in os.walk(self.objects_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                yield name[:64], path, mtime
+
+    def is_blob_path(self, path: Optional[str]) -> bool:
+        """Whether a path points into the object store (older rows point to per-upload files)"""
+        if not path:
+            return False
+        return os.path.abspath(path).startswith(os.path.abspath(self.objects_dir) + os.sep)
+
+
+def blob_references(db: Session, sha256: str) -> int:
+    """
+    Reference count of a blob, the number of File and Document rows pointing to it
+
+    Args:
+        db: Database session
+        sha256: Hex SHA-256 of the content
+
+    Returns:
+        Number of referencing rows
+    """
+    files = db.query(func.count(File.id)).filter(File.content_hash == sha256).scalar() or 0
+    documents = db.query(func.count(Document.id)).filter(Document.content_hash == sha256).scalar() or 0
+    return files + documents
+
+
+def release_blob(db: Session, sha256: Optional[str], grace_seconds: Optional[int] = None) -> bool:
+    """
+    Delete a blob if no row references it any more, call after deleting or repointing a row
+
+    A blob stored or reused within the grace period is kept and left to garbage collection:
+    a concurrent upload of the same content may already have written it but not yet
+    committed the row that references it.
+
+    Args:
+        db: Database session, the row change must already be committed
+        sha256: Hex SHA-256 of the content
+        grace_seconds: Minimum age of a blob before it may be deleted, defaults to BLOB_GC_GRACE_SECONDS
+
+    Returns:
+        Whether the blob was deleted
+    """
+    if not sha256 or blob_references(db, sha256) > 0:
+        return False
+    store = get_blob_store()
+    grace = BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    mtime = store.last_modified(sha256)
+    if mtime is None or mtime > time.time() - grace:
+        return False
+    removed = store.delete(sha256)
+    if removed:
+        logger.info(f"Blob released: sha256={sha256}")
+    return bool(removed)
+
+
+def collect_garbage(db: Optional[Session] = None, grace_seconds: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Delete unreferenced blobs, e.g. those left behind by knowledge bases deleted with their documents
+
+    Args:
+        db: Database session, a new session is opened when omitted
+        grace_seconds: Minimum age of a blob before it may be collected, defaults to BLOB_GC_GRACE_SECONDS
+
+    Returns:
+        Statistics with the number of blobs scanned and deleted and the bytes freed
+    """
+    if db is None:
+        from ..database import SessionLocal
+        session = SessionLocal()
+        try:
+            return collect_garbage(session, grace_seconds)
+        finally:
+            session.close()
+
+    store = get_blob_store()
+    grace = BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace
+    stats = {"scanned": 0, "deleted": 0, "freed_bytes": 0}
+    for sha256, path, mtime in store.iter_blobs():
+        stats["scanned"] += 1
+        if mtime > cutoff or blob_references(db, sha256) > 0:
+            continue
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            continue
+        if store.delete(sha256):
+            stats["deleted"] += 1
+            stats["freed_bytes"] += size
+    logger.info(f"Blob garbage collection finished: {json.dumps(stats)}")
+    return stats
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Get the process-wide blob store instance
+
+    Returns:
+        Shared BlobStore
+    """
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = BlobStore()
+    return _blob_store
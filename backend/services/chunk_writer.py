@@ -0,0 +1,82 @@
+"""
+Chunk writer, bulk persistence of DocumentChunk rows
+"""
+
+import os
+from itertools import islice
+from typing import Iterable, Dict, Any, Optional
+
+from sqlalchemy import insert, delete, update
+from sqlalchemy.orm import Session
+
+from ..models.knowledge import Document, DocumentChunk, DocumentStatus
+from .embedding_service import content_hash
+
+# Rows sent per executemany call
+CHUNK_INSERT_BATCH_SIZE = int(os.getenv("CHUNK_INSERT_BATCH_SIZE", "1000"))
+
+
+def bulk_write_chunks(
+    db: Session,
+    doc_id: int,
+    kb_id: int,
+    chunks: Iterable[Dict[str, Any]],
+    status: Optional[str] = DocumentStatus.COMPLETED,
+    batch_size: int = CHUNK_INSERT_BATCH_SIZE,
+    commit: bool = True
+) -> int:
+    """
+    Replace the chunks of a document using batched executemany inserts
+
+    Existing chunks of the document are removed first so the write is idempotent. The chunk rows,
+    Document.chunk_count and Document.status are written in the same transaction. chunks may be
+    any iterable, only one batch of rows is materialized at a time.
+
+    Args:
+        db: Database session
+        doc_id: Document ID
+        kb_id: Knowledge base ID
+        chunks: Chunk information as produced by iter_document_chunks
+        status: Document status to set, None leaves it unchanged
+        batch_size: Rows per executemany batch
+        commit: Whether to commit, pass False to add more statements to the same transaction
+
+    Returns:
+        Number of chunks written
+    """
+    count = 0
+    chunk_iter = iter(chunks)
+    try:
+        db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == doc_id))
+
+        while True:
+            rows = [
+                {
+                    "document_id": doc_id,
+                    "knowledge_base_id": kb_id,
+                    "chunk_index": chunk["chunk_index"],
+                    "chunk_text": chunk["content"],
+                    "page_number": chunk.get("page_number"),
+                    "vector_id": chunk["embedding_id"],
+                    "content_hash": content_hash(chunk["content"]),
+                    "chunk_metadata": chunk["metadata"]
+                }
+                for chunk in islice(chunk_iter, max(1, batch_size))
+            ]
+            if not rows:
+                break
+            db.execute(insert(DocumentChunk), rows)
+            count += len(rows)
+
+        values: Dict[Any, Any] = {Document.chunk_count: count}
+        if status is not None:
+            values[Document.status] = status
+        db.execute(update(Document).where(Document.id == doc_id).values(values))
+
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return count
@@ -0,0 +1,419 @@
+"""
+Chunking, strategies that split streamed document text into retrieval chunks
+
+The strategy and its parameters are chosen per knowledge base through the "chunking" entry
+of KnowledgeBase.kb_metadata, for example:
+
+    {"chunking": {"strategy": "recursive", "chunk_size": 512, "chunk_overlap": 64}}
+
+Sizes are measured in estimated tokens (see estimate_tokens), not characters or lines.
+"""
+
+import os
+import re
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Iterable, Iterator, Dict, List, Any, Optional, NamedTuple, Type
+
+import numpy as np
+
+try:
+    from .text_extractors import TextBlock
+except ImportError:
+    from backend.services.text_extractors import TextBlock
+
+# Defaults for knowledge bases without a chunking configuration
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "recursive")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "64"))
+
+# CJK ideographs, kana and hangul are roughly one token per character
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_SPACE_PATTERN = re.compile(r"\s+")
+# Smallest units a chunk can be cut into: one CJK character, or a word with its trailing whitespace
+_UNIT_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]\s*"
+    r"|[^\s\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+\s*"
+    r"|\s+"
+)
+# Sentence boundaries: after CJK or exclamation/question marks, after ./; followed by whitespace, or at newlines
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？；!?])|(?<=[.;])(?=\s)|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheaply estimate the number of model tokens in a text
+
+    Counts one token per CJK character and one per four other non-space characters, which
+    tracks BPE tokenizers closely enough for sizing chunks without loading a tokenizer.
+
+    Args:
+        text: Text content
+
+    Returns:
+        Estimated token count
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk - sum(len(space) for space in _SPACE_PATTERN.findall(text))
+    return cjk + (other + 3) // 4
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences
+
+    Args:
+        text: Text content
+
+    Returns:
+        Non-empty sentences with surrounding whitespace removed
+    """
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+
+def join_sentences(sentences: List[str]) -> str:
+    """Join sentences, separating them with a space unless the previous one ends in CJK text"""
+    parts: List[str] = []
+    for sentence in sentences:
+        if parts and not _CJK_PATTERN.match(parts[-1][-1]) and parts[-1][-1] not in "。！？；":
+            parts.append(" ")
+        parts.append(sentence)
+    return "".join(parts)
+
+
+class ChunkingConfigError(ValueError):
+    """Raised for an invalid chunking configuration"""
+
+
+class ChunkingConfig(NamedTuple):
+    """Chunking strategy and parameters of a knowledge base"""
+    strategy: str = CHUNK_STRATEGY
+    chunk_size: int = CHUNK_SIZE
+    chunk_overlap: int = CHUNK_OVERLAP
+    #: Sentences of context kept on each side of a sentence-window chunk
+    window_size: int = 2
+    #: Percentile of adjacent-sentence distances above which the semantic chunker breaks
+    breakpoint_percentile: float = 90.0
+
+    @classmethod
+    def from_metadata(cls, kb_metadata: Optional[Dict[str, Any]]) -> "ChunkingConfig":
+        """
+        Build the configuration from knowledge base metadata
+
+        Args:
+            kb_metadata: KnowledgeBase.kb_metadata, may be None
+
+        Returns:
+            Chunking configuration, defaults are used for missing keys
+        """
+        options = dict((kb_metadata or {}).get("chunking") or {})
+        unknown = set(options) - set(cls._fields)
+        if unknown:
+            raise ChunkingConfigError(f"Unknown chunking options: {', '.join(sorted(unknown))}")
+
+        try:
+            config = cls(**{key: cls.__annotations__[key](value) for key, value in options.items()})
+        except (TypeError, ValueError) as e:
+            raise ChunkingConfigError(f"Invalid chunking options: {str(e)}")
+        if "chunk_overlap" not in options:
+            # Keep the default overlap proportionate for small chunk sizes
+            config = config._replace(chunk_overlap=min(config.chunk_overlap, config.chunk_size // 4))
+        if config.strategy not in _chunkers:
+            raise ChunkingConfigError(f"Unsupported chunking strategy: {config.strategy}")
+        if config.chunk_size <= 0 or not 0 <= config.chunk_overlap < config.chunk_size:
+            raise ChunkingConfigError(
+                f"Invalid chunk size/overlap: chunk_size={config.chunk_size}, chunk_overlap={config.chunk_overlap}"
+            )
+        return config
+
+
+class Chunk(NamedTuple):
+    """A chunk of text produced by a chunker"""
+    text: str
+    page_number: Optional[int] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class Chunker(ABC):
+    """
+    Chunker interface
+
+    Subclasses implement split_text for a bounded piece of text. chunk() streams blocks through
+    it, carrying the last (possibly incomplete) chunk over into the next block so chunks are not
+    cut at block boundaries while only one block plus one chunk is held in memory. Chunks never
+    span pages.
+    """
+
+    #: Strategy name used in the chunking configuration
+    name: str = "base"
+
+    def __init__(self, config: ChunkingConfig):
+        self.config = config
+
+    @abstractmethod
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split a piece of text into chunks
+
+        Args:
+            text: Text content
+
+        Returns:
+            Chunk texts in order
+        """
+
+    def chunk(self, blocks: Iterable[TextBlock]) -> Iterator[Chunk]:
+        """
+        Chunk a stream of text blocks
+
+        Args:
+            blocks: Text blocks as produced by the text extractors
+
+        Returns:
+            Iterator of chunks
+        """
+        tail = ""
+        page_number = None
+        for block in blocks:
+            if block.page_number != page_number and tail:
+                yield from self._emit(self.split_text(tail), page_number)
+                tail = ""
+            page_number = block.page_number
+
+            pieces = self.split_text(tail + block.text)
+            if not pieces:
+                tail = ""
+                continue
+            yield from self._emit(pieces[:-1], page_number)
+            tail = pieces[-1]
+
+        if tail:
+            yield from self._emit(self.split_text(tail), page_number)
+
+    @staticmethod
+    def _emit(pieces: List[str], page_number: Optional[int]) -> Iterator[Chunk]:
+        for piece in pieces:
+            piece = piece.strip()
+            if piece:
+                yield Chunk(piece, page_number)
+
+    def _merge(self, pieces: List[str]) -> List[str]:
+        """
+        Greedily merge small pieces into chunks of at most chunk_size tokens
+
+        Consecutive chunks share up to chunk_overlap tokens of trailing pieces.
+        """
+        size, overlap = self.config.chunk_size, self.config.chunk_overlap
+        chunks: List[str] = []
+        window: deque = deque()
+        total = 0
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if window and total + tokens > size:
+                chunks.append("".join(text for text, _ in window))
+                while window and (total > overlap or total + tokens > size):
+                    total -= window.popleft()[1]
+            window.append((piece, tokens))
+            total += tokens
+        if window:
+            chunks.append("".join(text for text, _ in window))
+        return chunks
+
+
+class FixedTokenChunker(Chunker):
+    """
+    Fixed-size chunks of chunk_size estimated tokens with chunk_overlap tokens of overlap
+    """
+
+    name = "fixed_token"
+
+    def split_text(self, text: str) -> List[str]:
+        return self._merge(_UNIT_PATTERN.findall(text))
+
+
+class RecursiveChunker(Chunker):
+    """
+    Recursive separator chunking: split on the coarsest separator (paragraphs, lines, sentences,
+    words) that brings pieces under chunk_size, then merge neighbouring pieces back up to chunk_size
+    """
+
+    name = "recursive"
+
+    separators = ("\n\n", "\n", "。", "！", "？", ". ", "; ", "；", "，", ", ", " ")
+
+    def split_text(self, text: str) -> List[str]:
+        return self._merge(self._pieces(text, 0))
+
+    def _pieces(self, text: str, level: int) -> List[str]:
+        """Split text into pieces that each fit into one chunk"""
+        if estimate_tokens(text) <= self.config.chunk_size:
+            return [text]
+
+        separator = None
+        for index in range(level, len(self.separators)):
+            if self.separators[index] in text:
+                separator, level = self.separators[index], index
+                break
+        if separator is None:
+            # No separator left, fall back to word/character units
+            return _UNIT_PATTERN.findall(text)
+
+        parts = text.split(separator)
+        pieces: List[str] = []
+        for position, part in enumerate(parts):
+            # Keep the separator attached to the end of the piece so no text is lost
+            if position < len(parts) - 1:
+                part += separator
+            if part:
+                pieces.extend(self._pieces(part, level + 1))
+        return pieces
+
+
+class SentenceWindowChunker(Chunker):
+    """
+    Sentence-window chunking: each chunk is a single sentence (sentences longer than chunk_size
+    are cut) and carries window_size sentences of surrounding context in its "window" metadata,
+    so retrieval matches on precise sentences while generation can use the wider window
+    """
+
+    name = "sentence_window"
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk.text for chunk in self.chunk([TextBlock(text)])]
+
+    def chunk(self, blocks: Iterable[TextBlock]) -> Iterator[Chunk]:
+        window_size = max(0, self.config.window_size)
+        before: deque = deque(maxlen=window_size)
+        # Sentences waiting for their trailing context: [sentence, page_number, before, after]
+        waiting: deque = deque()
+
+        for sentence, page_number in self._sentences(blocks):
+            for item in waiting:
+                item[3].append(sentence)
+            while waiting and len(waiting[0][3]) >= window_size:
+                yield self._finish(waiting.popleft())
+            waiting.append([sentence, page_number, list(before), []])
+            before.append(sentence)
+
+        while waiting:
+            yield self._finish(waiting.popleft())
+
+    def _sentences(self, blocks: Iterable[TextBlock]) -> Iterator[tuple]:
+        """Stream (sentence, page_number) pairs, a sentence cut by a block boundary is rejoined"""
+        tail = ""
+        page_number = None
+        for block in blocks:
+            if block.page_number != page_number and tail:
+                yield from self._fit(tail, page_number)
+                tail = ""
+            page_number = block.page_number
+            sentences = split_sentences(tail + block.text)
+            if not sentences:
+                tail = ""
+                continue
+            for sentence in sentences[:-1]:
+                yield from self._fit(sentence, page_number)
+            tail = sentences[-1]
+        if tail:
+            yield from self._fit(tail, page_number)
+
+    def _fit(self, sentence: str, page_number: Optional[int]) -> Iterator[tuple]:
+        """Cut a sentence longer than chunk_size into pieces"""
+        if estimate_tokens(sentence) <= self.config.chunk_size:
+            yield sentence, page_number
+            return
+        for piece in self._merge(_UNIT_PATTERN.findall(sentence)):
+            if piece.strip():
+                yield piece.strip(), page_number
+
+    @staticmethod
+    def _finish(item: list) -> Chunk:
+        sentence, page_number, before, after = item
+        return Chunk(sentence, page_number, {"window": join_sentences(before + [sentence] + after)})
+
+
+class SemanticChunker(Chunker):
+    """
+    Semantic chunking: embed sentences and start a new chunk where the cosine distance between
+    neighbouring sentences is above the breakpoint_percentile of the distances in the text, or
+    when the chunk would exceed chunk_size
+    """
+
+    name = "semantic"
+
+    def __init__(self, config: ChunkingConfig, embedding_service=None):
+        super().__init__(config)
+        self._embedding_service = embedding_service
+
+    @property
+    def embedding_service(self):
+        if self._embedding_service is None:
+            try:
+                from .embedding_service import get_embedding_service
+            except ImportError:
+                from backend.services.embedding_service import get_embedding_service
+            self._embedding_service = get_embedding_service()
+        return self._embedding_service
+
+    def split_text(self, text: str) -> List[str]:
+        sentences = split_sentences(text)
+        if len(sentences) <= 1:
+            return [text] if text.strip() else []
+
+        vectors = np.asarray(self.embedding_service.embed_texts(sentences), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        # Cosine distance between each sentence and the next, computed in one pass
+        distances = 1.0 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+        threshold = np.percentile(distances, self.config.breakpoint_percentile)
+        breakpoints = distances > threshold
+
+        token_counts = [estimate_tokens(sentence) for sentence in sentences]
+        chunks: List[str] = []
+        group = [sentences[0]]
+        group_tokens = token_counts[0]
+        for index in range(1, len(sentences)):
+            if breakpoints[index - 1] or group_tokens + token_counts[index] > self.config.chunk_size:
+                chunks.append(join_sentences(group))
+                group, group_tokens = [], 0
+            group.append(sentences[index])
+            group_tokens += token_counts[index]
+        chunks.append(join_sentences(group))
+        return chunks
+
+
+_chunkers: Dict[str, Type[Chunker]] = {}
+
+
+def register_chunker(chunker_class: Type[Chunker]) -> None:
+    """
+    Register a chunking strategy
+
+    Args:
+        chunker_class: Chunker subclass, registered under its name
+    """
+    _chunkers[chunker_class.name] = chunker_class
+
+
+for _chunker_class in (FixedTokenChunker, RecursiveChunker, SentenceWindowChunker, SemanticChunker):
+    register_chunker(_chunker_class)
+
+
+def get_chunker(config: Optional[ChunkingConfig] = None) -> Chunker:
+    """
+    Create the chunker of a configuration
+
+    Args:
+        config: Chunking configuration, defaults to the environment defaults
+
+    Returns:
+        Chunker instance
+    """
+    config = config or ChunkingConfig()
+    chunker_class = _chunkers.get(config.strategy)
+    if chunker_class is None:
+        raise ChunkingConfigError(f"Unsupported chunking strategy: {config.strategy}")
+    return chunker_class(config)
@@ -1,17 +1,54 @@
 from sqlalchemy.orm import Session
 from fastapi import UploadFile
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+import hashlib
 import logging
 import os
-import uuid
 from datetime import datetime
 
 # Import models
-from ..models.knowledge import Document, DocumentStatus, KnowledgeBase, File
+from ..models.knowledge import Document, DocumentStatus, KnowledgeBase, File, IngestionJob, IngestionJobStatus
 from ..schemas.knowledge import DocumentCreate, DocumentUpdate, DocumentResponse
+from ..services.ingestion_service import enqueue_document, get_ingestion_queue
+from ..services.answer_cache import invalidate_answer_cache
+from ..services.blob_store import get_blob_store, release_blob, UploadTooLargeError
+from ..services.metadata_filters import document_attributes
+from ..services.rag_service import RAGService
+from ..common.pagination import apply_page, page_items, cached_count
 
 logger = logging.getLogger(__name__)
 
+# 支持的文件类型，每种类型在 text_extractors 中都有对应的文本提取器
+ALLOWED_EXTENSIONS = {'.txt', '.pdf', '.docx', '.md', '.pptx', '.xlsx'}
+# 不支持的旧版Office格式及可以另存为的新格式
+LEGACY_OFFICE_EXTENSIONS = {'.doc': '.docx', '.ppt': '.pptx', '.xls': '.xlsx'}
+# 流式读写文件时每次读取的字节数
+UPLOAD_READ_SIZE = 1024 * 1024
+
+def unsupported_file_type(filename: Optional[str]) -> Optional[str]:
+    """文件类型不支持时返回面向用户的错误说明，支持时返回None"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in ALLOWED_EXTENSIONS:
+        return None
+    message = f"不支持的文件类型: {extension or filename}，支持的类型: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+    if extension in LEGACY_OFFICE_EXTENSIONS:
+        message += f"，请将文件另存为 {LEGACY_OFFICE_EXTENSIONS[extension]} 后上传"
+    return message
+
+class SyncAction:
+    """增量导入时对单个文件的处理结果"""
+    CREATED = "created"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+
+def file_sha256(file_path: str) -> str:
+    """流式计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 class DocumentService:
     def __init__(self, db: Session):
         self.db = db
@@ -27,49 +64,245 @@ class DocumentService:
         if not kb:
             return None
         
-        # 支持的文件类型
-        allowed_extensions = {'.txt', '.pdf', '.doc', '.docx', '.md', '.ppt', '.pptx', '.xls', '.xlsx'}
         file_extension = os.path.splitext(file.filename)[1].lower()
-        if file_extension not in allowed_extensions:
+        if file_extension not in ALLOWED_EXTENSIONS:
             return None
         
-        # 生成唯一文件名
-        unique_filename = f"{uuid.uuid4().hex}_{file.filename}"
-        
-        # 创建上传目录 - 使用files目录
-        upload_dir = f"files/knowledge_base_{kb_id}"
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # 保存文件
-        file_path = os.path.join(upload_dir, unique_filename)
-        
         try:
-            contents = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
+            file_path, file_size, file_hash = await get_blob_store().put_upload(file, file_extension)
+        except UploadTooLargeError:
+            raise
         except Exception as e:
             logger.error(f"文件保存失败: {e}")
             return None
         
+        doc = self._create_document(kb_id, user_id, file.filename, file_path, file_size, file_hash, source_path=file.filename)
+        return DocumentResponse.from_orm(doc)
+    
+    async def sync_upload(
+        self,
+        kb_id: int,
+        user_id: int,
+        file: UploadFile,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Optional[DocumentResponse], Optional[str]]:
+        """
+        增量上传：按文件名匹配知识库中已有的文档，内容未变化时跳过，变化时替换文件并重新入库
+        
+        Returns:
+            (文档, 处理结果)，知识库不存在或文件类型不支持时为(None, None)
+        """
+        kb = (
+            self.db.query(KnowledgeBase)
+            .filter(KnowledgeBase.id == kb_id, KnowledgeBase.created_by == user_id)
+            .first()
+        )
+        file_extension = os.path.splitext(file.filename)[1].lower()
+        if not kb or file_extension not in ALLOWED_EXTENSIONS:
+            return None, None
+        
+        # 文件内容按哈希去重存储，内容未变化时不会产生新文件
+        file_path, file_size, file_hash = await get_blob_store().put_upload(file, file_extension)
+        doc, action = self._sync_document(
+            kb_id, user_id, file.filename, file_path, file_size, file_hash,
+            source_path=file.filename, metadata=metadata
+        )
+        return DocumentResponse.from_orm(doc), action
+    
+    def sync_path(
+        self,
+        kb_id: int,
+        user_id: int,
+        source_path: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Optional[DocumentResponse], Optional[str]]:
+        """
+        增量导入本地文件：按源路径匹配已有文档
+        
+        大小和修改时间都未变化时不读取文件；否则流式计算哈希，内容未变化时跳过，
+        变化时复制文件并重新入库（只重新向量化变化的块）。
+        只有入库已完成的文档才会跳过，失败或未完成的文档即使内容未变化也重新入库。
+        
+        Returns:
+            (文档, 处理结果)，文件类型不支持时为(None, None)
+        """
+        source_path = os.path.abspath(source_path)
+        file_extension = os.path.splitext(source_path)[1].lower()
+        if file_extension not in ALLOWED_EXTENSIONS:
+            return None, None
+        
+        stat = os.stat(source_path)
+        doc = self._find_by_source(kb_id, source_path)
+        completed = doc is not None and doc.status == DocumentStatus.COMPLETED
+        if completed and doc.file_size == stat.st_size and doc.source_mtime == stat.st_mtime and doc.content_hash:
+            self._apply_metadata(doc, metadata)
+            return DocumentResponse.from_orm(doc), SyncAction.UNCHANGED
+        
+        file_hash = file_sha256(source_path)
+        if completed and doc.content_hash == file_hash:
+            doc.source_mtime = stat.st_mtime
+            self._apply_metadata(doc, metadata)
+            return DocumentResponse.from_orm(doc), SyncAction.UNCHANGED
+        
+        filename = os.path.basename(source_path)
+        file_path, _, file_hash = get_blob_store().put_file(source_path, file_extension, sha256=file_hash)
+        doc, action = self._sync_document(
+            kb_id, user_id, filename, file_path, stat.st_size, file_hash,
+            source_path=source_path, metadata=metadata, source_mtime=stat.st_mtime, existing=doc
+        )
+        return DocumentResponse.from_orm(doc), action
+    
+    def _find_by_source(self, kb_id: int, source_path: str) -> Optional[Document]:
+        return (
+            self.db.query(Document)
+            .filter(Document.knowledge_base_id == kb_id, Document.source_path == source_path)
+            .order_by(Document.id.desc())
+            .first()
+        )
+    
+    def _create_document(
+        self,
+        kb_id: int,
+        user_id: int,
+        title: str,
+        file_path: str,
+        file_size: int,
+        file_hash: str,
+        source_path: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        source_mtime: Optional[float] = None
+    ) -> Document:
         # 创建文档记录
         doc = Document(
             knowledge_base_id=kb_id,
-            title=file.filename,
+            title=title,
             file_path=file_path,
-            file_size=len(contents),
-            file_type=file_extension,
-            status="processing",
+            file_size=file_size,
+            file_type=os.path.splitext(title)[1].lower(),
+            content_hash=file_hash,
+            source_path=source_path,
+            source_mtime=source_mtime,
+            doc_metadata=metadata or None,
+            status=DocumentStatus.PENDING,
             created_by=user_id
         )
         
         self.db.add(doc)
+        self.db.flush()
+        # 文档解析、分块和向量化由后台入库队列异步完成
+        enqueue_document(self.db, doc)
         self.db.commit()
         self.db.refresh(doc)
+        get_ingestion_queue().notify()
+        invalidate_answer_cache(kb_id)
+        return doc
+    
+    def _sync_document(
+        self,
+        kb_id: int,
+        user_id: int,
+        title: str,
+        file_path: str,
+        file_size: int,
+        file_hash: str,
+        source_path: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        source_mtime: Optional[float] = None,
+        existing: Optional[Document] = None
+    ) -> Tuple[Document, str]:
+        """
+        按源匹配已有文档：不存在则创建，内容相同且已入库则跳过，内容变化则替换文件并重新入库
         
-        return DocumentResponse.from_orm(doc)
+        内容相同但入库失败或未完成时重新入库，已有排队或执行中的入库任务时不重复添加
+        """
+        doc = existing or self._find_by_source(kb_id, source_path)
+        if doc is None:
+            doc = self._create_document(
+                kb_id, user_id, title, file_path, file_size, file_hash,
+                source_path=source_path, metadata=metadata, source_mtime=source_mtime
+            )
+            return doc, SyncAction.CREATED
+        
+        if doc.content_hash == file_hash:
+            if source_mtime is not None:
+                doc.source_mtime = source_mtime
+            self._apply_metadata(doc, metadata)
+            if doc.status == DocumentStatus.COMPLETED:
+                return doc, SyncAction.UNCHANGED
+            if not self._has_active_job(doc):
+                enqueue_document(self.db, doc)
+            self.db.commit()
+            self.db.refresh(doc)
+            get_ingestion_queue().notify()
+            return doc, SyncAction.UPDATED
+        
+        old_hash, old_path = doc.content_hash, doc.file_path
+        doc.file_path = file_path
+        doc.file_size = file_size
+        doc.content_hash = file_hash
+        doc.source_mtime = source_mtime
+        if metadata:
+            doc.doc_metadata = {**(doc.doc_metadata or {}), **metadata}
+        # 重新入库时按块哈希只向量化变化的块，删除的块从索引中移除
+        enqueue_document(self.db, doc)
+        self.db.commit()
+        self.db.refresh(doc)
+        get_ingestion_queue().notify()
+        invalidate_answer_cache(kb_id)
+        
+        # 旧内容不再被任何文档或文件记录引用时删除
+        self._release(old_hash, old_path)
+        return doc, SyncAction.UPDATED
+    
+    def _has_active_job(self, doc: Document) -> bool:
+        """文档是否已有排队或执行中的入库任务"""
+        return self.db.query(
+            self.db.query(IngestionJob)
+            .filter(
+                IngestionJob.document_id == doc.id,
+                IngestionJob.status.in_([IngestionJobStatus.PENDING, IngestionJobStatus.RUNNING])
+            )
+            .exists()
+        ).scalar()
+    
+    def _release(self, file_hash: Optional[str], file_path: Optional[str] = None) -> None:
+        """释放不再被引用的文件内容，旧版本按上传单独保存的文件直接删除"""
+        try:
+            if file_path and not get_blob_store().is_blob_path(file_path) and os.path.exists(file_path):
+                os.remove(file_path)
+            release_blob(self.db, file_hash)
+        except Exception as e:
+            logger.warning(f"释放文件内容失败: sha256={file_hash}, error={e}")
+    
+    def _apply_metadata(self, doc: Document, metadata: Optional[Dict[str, Any]]) -> None:
+        """合并未变化文档的元数据，标签变化时同步更新索引中的过滤属性"""
+        current = doc.doc_metadata or {}
+        if metadata and any(current.get(key) != value for key, value in metadata.items()):
+            tags_changed = "tags" in metadata and current.get("tags") != metadata["tags"]
+            doc.doc_metadata = {**current, **metadata}
+            self.db.commit()
+            if tags_changed and doc.chunk_count:
+                try:
+                    RAGService().update_document_attributes(doc.knowledge_base_id, doc.id, document_attributes(doc))
+                except Exception as e:
+                    logger.error(f"更新文档索引属性失败: doc_id={doc.id}, error={e}")
+        else:
+            self.db.commit()
     
     def get_all_by_kb(self, kb_id: int, user_id: int, skip: int = 0, limit: int = 100) -> List[DocumentResponse]:
         """获取知识库的文档列表"""
+        page = self.page_by_kb(kb_id, user_id, limit, skip=skip)
+        return page[0] if page else []
+
+    def page_by_kb(
+        self, kb_id: int, user_id: int, limit: int = 100, cursor: Optional[str] = None, skip: int = 0
+    ) -> Optional[Tuple[List[DocumentResponse], int, Optional[str]]]:
+        """
+        按 (created_at, id) 倒序分页获取知识库的文档，传入游标时从上一页末尾继续
+
+        Returns:
+            (文档列表, 近似总数, 下一页游标)；知识库不存在或无权限时返回None
+        """
         # 检查知识库权限
         kb = (
             self.db.query(KnowledgeBase)
@@ -77,17 +310,14 @@ class DocumentService:
             .first()
         )
         if not kb:
-            return []
-        
-        documents = (
-            self.db.query(Document)
-            .filter(Document.knowledge_base_id == kb_id)
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
-        
-        return [DocumentResponse.from_orm(doc) for doc in documents]
+            return None
+
+        query = self.db.query(Document).filter(Document.knowledge_base_id == kb_id)
+        total = cached_count(("kb_documents", kb_id), query.count)
+        keys = [Document.created_at, Document.id]
+        rows = apply_page(query, keys, limit, cursor, skip, descending=True).all()
+        documents, next_cursor = page_items(rows, keys, limit)
+        return [DocumentResponse.from_orm(doc) for doc in documents], total, next_cursor
     
     def get_by_id(self, doc_id: int, user_id: int) -> Optional[DocumentResponse]:
         """根据ID获取文档"""
@@ -141,22 +371,29 @@ class DocumentService:
         if not doc:
             return False
         
-        # 删除物理文件
+        # 删除向量索引和关键词索引中的块，失败时仍删除文档记录
         try:
-            if os.path.exists(doc.file_path):
-                os.remove(doc.file_path)
+            RAGService().delete_document_chunks(doc_id, doc.knowledge_base_id)
         except Exception as e:
-            logger.error(f"删除文件失败: {e}")
+            logger.error(f"删除向量数据失败: doc_id={doc_id}, error={e}")
         
         # 删除files表中的记录
+        released = [(doc.content_hash, doc.file_path)]
         if doc.file_id:
             file_record = self.db.query(File).filter(File.id == doc.file_id).first()
             if file_record:
+                released.append((file_record.content_hash, file_record.file_path))
                 self.db.delete(file_record)
         
         # 删除文档记录
+        kb_id = doc.knowledge_base_id
         self.db.delete(doc)
         self.db.commit()
+        invalidate_answer_cache(kb_id)
+        
+        # 文件内容可能被其他知识库的文档共享，引用计数归零时才删除
+        for file_hash, file_path in released:
+            self._release(file_hash, file_path)
         return True
     
     def get_all_documents(self, user_id: int, skip: int = 0, limit: int = 100) -> List[DocumentResponse]:
@@ -185,13 +422,18 @@ class DocumentService:
             file_type=file_record.file_type,
             file_size=file_record.file_size,
             file_id=file_record.id,  # 关联file_id
-            status="processing",
+            content_hash=file_record.content_hash,
+            status=DocumentStatus.PENDING,
             created_by=user_id,
             doc_metadata={"description": description, "tags": tags}
         )
         
         self.db.add(doc)
+        self.db.flush()
+        enqueue_document(self.db, doc)
         self.db.commit()
         self.db.refresh(doc)
+        get_ingestion_queue().notify()
+        invalidate_answer_cache(kb_id)
         
         return DocumentResponse.from_orm(doc) 
\ No newline at end of file
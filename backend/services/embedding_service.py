@@ -0,0 +1,471 @@
+"""
+Embedding service, pluggable embedding providers with batched and content-hash cached vectorization
+"""
+
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+# Embedding configuration, overridable through environment variables
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "hashing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "100000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "files/embedding_cache.sqlite3")
+# Upper bound on vectors kept in the SQLite file, the least recently used are evicted; 0 disables the limit
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "1000000"))
+
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]|[A-Za-z0-9_]+")
+
+
+def content_hash(text: str) -> str:
+    """
+    Compute the content hash of a text
+
+    Args:
+        text: Text content
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingProvider(ABC):
+    """
+    Embedding provider interface
+    """
+
+    #: Provider name as registered in the provider registry
+    name: str = "base"
+
+    #: Whether similar vectors mean similar meaning; lexical models are unfit for the answer cache
+    semantic: bool = True
+
+    @property
+    @abstractmethod
+    def model_name(self) -> str:
+        """Identifier of the model, vectors of different models are never mixed"""
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        """Dimension of the produced vectors"""
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Float32 matrix of shape (len(texts), dimension)
+        """
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic local CPU model based on signed feature hashing of words and CJK characters
+    """
+
+    name = "hashing"
+    semantic = False
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self._dimension = dimension
+
+    @property
+    def model_name(self) -> str:
+        return f"hashing-{self._dimension}"
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in _TOKEN_PATTERN.findall(text.lower()):
+                digest = hashlib.md5(token.encode("utf-8")).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self._dimension
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Remote provider for OpenAI-compatible /embeddings endpoints
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        model: str = "text-embedding-ada-002",
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        dimension: Optional[int] = None
+    ):
+        from openai import OpenAI
+
+        self._model = model
+        self._dimension = dimension
+        self._client = OpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("EMBEDDING_BASE_URL") or None
+        )
+
+    @property
+    def model_name(self) -> str:
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = int(self.embed(["dimension probe"]).shape[1])
+        return self._dimension
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self._client.embeddings.create(model=self._model, input=texts)
+        data = sorted(response.data, key=lambda item: item.index)
+        vectors = np.asarray([item.embedding for item in data], dtype=np.float32)
+        if self._dimension is None:
+            self._dimension = int(vectors.shape[1])
+        return vectors
+
+
+class EmbeddingCache:
+    """
+    Content-hash keyed embedding cache: an in-memory LRU in front of an optional SQLite file
+
+    The SQLite tier records when each vector was last stored or read. Once it holds more than
+    disk_max_entries vectors, the least recently used are deleted down to 90% of the limit, so
+    vectors of deleted documents and retired models age out instead of accumulating forever.
+    """
+
+    #: Fraction of the disk limit kept after an eviction, so eviction does not run on every write
+    disk_low_watermark = 0.9
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_SIZE,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        disk_max_entries: int = EMBEDDING_CACHE_DISK_MAX_ENTRIES
+    ):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self._memory: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_used INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (model, hash))"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "last_used" not in columns:
+                # Files created before eviction existed, their vectors count as least recently used
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached vectors
+
+        Args:
+            model: Model identifier
+            hashes: Content hashes
+
+        Returns:
+            Mapping from content hash to vector for the hashes found
+        """
+        found: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        with self._lock:
+            for digest in hashes:
+                vector = self._memory.get((model, digest))
+                if vector is None:
+                    missing.append(digest)
+                else:
+                    self._memory.move_to_end((model, digest))
+                    found[digest] = vector
+
+            if missing and self._db is not None:
+                # SQLite limits the number of bound parameters per statement
+                for start in range(0, len(missing), 500):
+                    part = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                        [model, *part]
+                    ).fetchall()
+                    for digest, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[digest] = vector
+                        self._remember(model, digest, vector)
+                    if rows:
+                        self._db.executemany(
+                            "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                            [(int(time.time()), model, digest) for digest, _ in rows]
+                        )
+                        self._db.commit()
+
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, np.ndarray]) -> None:
+        """
+        Store vectors in the cache
+
+        Args:
+            model: Model identifier
+            items: Mapping from content hash to vector
+        """
+        if not items:
+            return
+        with self._lock:
+            for digest, vector in items.items():
+                self._remember(model, digest, vector)
+            if self._db is not None:
+                now = int(time.time())
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                    [
+                        (model, digest, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                        for digest, vector in items.items()
+                    ]
+                )
+                self._db.commit()
+                # Replaced rows are counted too, the exact count is only taken when the limit may be exceeded
+                self._disk_entries += len(items)
+                if self.disk_max_entries and self._disk_entries > self.disk_max_entries:
+                    self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Delete the least recently used vectors of the SQLite tier down to the low watermark"""
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_entries - int(self.disk_max_entries * self.disk_low_watermark)
+        if self._disk_entries <= self.disk_max_entries or excess <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self._db.commit()
+        self._disk_entries -= excess
+        self.evictions += excess
+
+    def _remember(self, model: str, digest: str, vector: np.ndarray) -> None:
+        """Insert into the in-memory LRU, evicting the oldest entries"""
+        self._memory[(model, digest)] = vector
+        self._memory.move_to_end((model, digest))
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+
+        Returns:
+            Hit/miss counters, in-memory size, approximate on-disk size and evicted vectors
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+            "evictions": self.evictions
+        }
+
+
+class EmbeddingService:
+    """
+    Embedding service class, embeds texts in batches and skips texts already embedded by the same model
+    """
+
+    def __init__(
+        self,
+        provider: Optional[EmbeddingProvider] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        """
+        Initialize embedding service
+
+        Args:
+            provider: Embedding provider, defaults to the provider configured by EMBEDDING_PROVIDER
+            batch_size: Number of texts sent to the provider per call
+            cache: Embedding cache, defaults to the shared cache
+        """
+        self.logger = get_logger(__name__)
+        self.provider = provider or create_embedding_provider(EMBEDDING_PROVIDER)
+        self.batch_size = max(1, batch_size)
+        self.cache = cache if cache is not None else get_embedding_cache()
+
+    @property
+    def model_name(self) -> str:
+        return self.provider.model_name
+
+    @property
+    def dimension(self) -> int:
+        return self.provider.dimension
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, reusing cached vectors of identical content
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Embedding vectors in the same order as texts
+        """
+        if not texts:
+            return []
+
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_name, list(dict.fromkeys(hashes)))
+
+        # Deduplicate identical texts that are not cached yet
+        pending: Dict[str, str] = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in vectors and digest not in pending:
+                pending[digest] = text
+
+        if pending:
+            pending_items = list(pending.items())
+            self.logger.info(
+                f"Embedding texts: model={self.model_name}, total={len(texts)}, "
+                f"to_embed={len(pending_items)}, batch_size={self.batch_size}"
+            )
+            for start in range(0, len(pending_items), self.batch_size):
+                batch = pending_items[start:start + self.batch_size]
+                embedded = self.provider.embed([text for _, text in batch])
+                fresh = {digest: embedded[row] for row, (digest, _) in enumerate(batch)}
+                self.cache.put_many(self.model_name, fresh)
+                vectors.update(fresh)
+
+        return [vectors[digest].tolist() for digest in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query text
+
+        Args:
+            text: Query text
+
+        Returns:
+            Embedding vector
+        """
+        return self.embed_texts([text])[0]
+
+
+_provider_factories: Dict[str, Callable[[], EmbeddingProvider]] = {
+    "hashing": lambda: HashingEmbeddingProvider(EMBEDDING_DIMENSION),
+    "openai": lambda: OpenAIEmbeddingProvider(
+        model=EMBEDDING_MODEL or "text-embedding-ada-002",
+        dimension=int(os.getenv("EMBEDDING_DIMENSION")) if os.getenv("EMBEDDING_DIMENSION") else None
+    ),
+}
+
+
+def register_embedding_provider(name: str, factory: Callable[[], EmbeddingProvider]) -> None:
+    """
+    Register an embedding provider factory
+
+    Args:
+        name: Provider name used by EMBEDDING_PROVIDER
+        factory: Callable returning a provider instance
+    """
+    _provider_factories[name] = factory
+
+
+def create_embedding_provider(name: str) -> EmbeddingProvider:
+    """
+    Create an embedding provider by name
+
+    Args:
+        name: Registered provider name
+
+    Returns:
+        Provider instance
+    """
+    factory = _provider_factories.get(name)
+    if factory is None:
+        raise ValueError(f"Unsupported embedding provider: {name}")
+    return factory()
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_service: Optional[EmbeddingService] = None
+_embedding_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Get the process-wide embedding cache
+
+    Returns:
+        Shared EmbeddingCache
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def get_embedding_service() -> EmbeddingService:
+    """
+    Get the process-wide embedding service
+
+    Returns:
+        Shared EmbeddingService
+    """
+    global _embedding_service
+    if _embedding_service is None:
+        cache = get_embedding_cache()
+        with _embedding_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(cache=cache)
+    return _embedding_service
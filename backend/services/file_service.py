@@ -0,0 +1,61 @@
+from sqlalchemy.orm import Session
+from fastapi import UploadFile
+from typing import Optional, Dict, Any
+import asyncio
+import logging
+import os
+
+from ..models.knowledge import File
+from ..services.blob_store import get_blob_store, UploadTooLargeError
+from ..services.document_service import ALLOWED_EXTENSIONS
+from ..services.upload_service import get_upload_service
+
+logger = logging.getLogger(__name__)
+
+class FileService:
+    """上传文件管理，文件内容按SHA-256去重存储在blob存储中"""
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def upload(self, user_id: int, file: UploadFile) -> Optional[int]:
+        """上传文件，分块写入磁盘并计算哈希，返回文件记录ID；相同内容的文件只保存一份"""
+        file_extension = os.path.splitext(file.filename or "")[1].lower()
+        if file_extension not in ALLOWED_EXTENSIONS:
+            return None
+
+        try:
+            file_path, file_size, file_hash = await get_blob_store().put_upload(file, file_extension)
+        except UploadTooLargeError:
+            raise
+        except Exception as e:
+            logger.error(f"文件保存失败: {e}")
+            return None
+
+        return self._create_record(user_id, file.filename, file_path, file_size, file_hash)
+
+    def start_upload(self, user_id: int, filename: str, size: int) -> Optional[Dict[str, Any]]:
+        """创建可续传的分片上传会话，文件类型不支持时返回None"""
+        if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+            return None
+        return get_upload_service().create(user_id, filename, size)
+
+    async def complete_upload(self, user_id: int, upload_id: str) -> int:
+        """完成分片上传：计算哈希并移入blob存储，返回文件记录ID"""
+        file_path, file_size, file_hash, filename = await asyncio.to_thread(
+            get_upload_service().complete, upload_id, user_id
+        )
+        return self._create_record(user_id, filename, file_path, file_size, file_hash)
+
+    def _create_record(self, user_id: int, filename: str, file_path: str, file_size: int, file_hash: str) -> int:
+        file_record = File(
+            original_name=filename,
+            file_path=file_path,
+            file_size=file_size,
+            file_type=os.path.splitext(filename)[1].lower(),
+            content_hash=file_hash,
+            created_by=user_id
+        )
+        self.db.add(file_record)
+        self.db.commit()
+        self.db.refresh(file_record)
+        return file_record.id
@@ -0,0 +1,406 @@
+"""
+Import service, background directory imports with bounded concurrency and pollable progress
+
+A directory import is an import_jobs row. Files are discovered lazily, one directory entry at
+a time, and handed to a fixed number of workers through a bounded queue, so neither the file
+list nor the work in flight grows with the size of the directory. Every file is synchronized
+incrementally (unchanged files are skipped) in a thread, keeping directory walking, hashing,
+copying and database writes off the event loop. The outcome of each file is recorded in
+import_job_files and the counters on the job are updated as files finish, so clients can poll
+the job while it runs.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable, Iterator
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..models.knowledge import ImportJob, ImportJobFile, ImportJobStatus
+from ..services.document_service import DocumentService, SyncAction, ALLOWED_EXTENSIONS
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+# Import configuration, overridable through environment variables
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+# Discovered file count is written to the job every this many files
+IMPORT_DISCOVERY_FLUSH = int(os.getenv("IMPORT_DISCOVERY_FLUSH", "100"))
+# A running job holds a lease renewed every heartbeat interval; a job whose heartbeat is older
+# than the lease belongs to a dead process and is restarted
+IMPORT_HEARTBEAT_SECONDS = float(os.getenv("IMPORT_HEARTBEAT_SECONDS", "30"))
+IMPORT_LEASE_SECONDS = float(os.getenv("IMPORT_LEASE_SECONDS", "300"))
+
+# Per-file outcome of a failed file, next to the SyncAction values
+IMPORT_FILE_FAILED = "failed"
+
+_ACTION_COUNTERS = {
+    SyncAction.CREATED: ImportJob.created_files,
+    SyncAction.UPDATED: ImportJob.updated_files,
+    SyncAction.UNCHANGED: ImportJob.unchanged_files,
+    IMPORT_FILE_FAILED: ImportJob.failed_files,
+}
+
+
+def iter_import_paths(directory: str, recursive: bool = False) -> Iterator[str]:
+    """
+    Lazily list the importable files of a directory
+
+    Entries are read with os.scandir one directory at a time, nothing is collected up front.
+    Unreadable subdirectories are skipped.
+
+    Args:
+        directory: Directory to import
+        recursive: Whether to descend into subdirectories
+
+    Returns:
+        Iterator of file paths with a supported extension
+    """
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            logger.warning(f"无法读取目录: {current}, error={e}")
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in ALLOWED_EXTENSIONS:
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+def create_import_job(
+    db: Session,
+    kb_id: int,
+    user_id: int,
+    directory_path: str,
+    recursive: bool = False,
+    metadata: Optional[Dict[str, Any]] = None
+) -> ImportJob:
+    """
+    Create a pending directory import job, start it with DirectoryImporter.start
+
+    Args:
+        db: Database session
+        kb_id: Knowledge base ID
+        user_id: User starting the import
+        directory_path: Directory to import
+        recursive: Whether to descend into subdirectories
+        metadata: Metadata attached to every imported document
+
+    Returns:
+        The new job
+    """
+    job = ImportJob(
+        knowledge_base_id=kb_id,
+        directory_path=os.path.abspath(directory_path),
+        recursive=recursive,
+        file_metadata=metadata or None,
+        status=ImportJobStatus.PENDING,
+        created_by=user_id
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+class DirectoryImporter:
+    """
+    Directory importer class, runs import jobs as tasks on the event loop, each with its own worker pool
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None, workers: int = IMPORT_WORKERS):
+        """
+        Initialize directory importer
+
+        Args:
+            session_factory: Callable returning a new database session, defaults to SessionLocal
+            workers: Number of files imported concurrently per job
+        """
+        self._session_factory = session_factory
+        self.workers = max(1, workers)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._lease_task: Optional[asyncio.Task] = None
+
+    def _session(self) -> Session:
+        if self._session_factory is None:
+            from ..database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def start(self, job_id: int) -> None:
+        """Run a pending job in the background, must be called from the event loop"""
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._run(job_id), name=f"directory-import-{job_id}")
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def recover(self) -> None:
+        """
+        Restart pending jobs and running jobs whose lease has expired, and keep the leases of
+        this process's jobs from then on, must be called from the event loop on startup
+        """
+        await self._restart_recovered_jobs()
+        if self._lease_task is None or self._lease_task.done():
+            self._lease_task = asyncio.create_task(self._lease_keeper(), name="directory-import-lease-keeper")
+
+    async def stop(self) -> None:
+        """Cancel running jobs, jobs interrupted by the stop are restarted by recover on next start"""
+        interrupted = list(self._tasks)
+        tasks = list(self._tasks.values())
+        if self._lease_task is not None:
+            tasks.append(self._lease_task)
+            self._lease_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+        if interrupted:
+            try:
+                await asyncio.to_thread(self._requeue_jobs, interrupted)
+            except Exception as e:
+                logger.error(f"重新排队中断的目录导入任务失败: job_ids={interrupted}, error={str(e)}")
+
+    async def _restart_recovered_jobs(self) -> None:
+        job_ids = await asyncio.to_thread(self._recover_jobs)
+        job_ids = [job_id for job_id in job_ids if job_id not in self._tasks]
+        if job_ids:
+            logger.info(f"重新启动未完成的目录导入任务: {job_ids}")
+        for job_id in job_ids:
+            self.start(job_id)
+
+    async def _lease_keeper(self) -> None:
+        """Renew the leases of this process's running jobs and restart jobs whose lease has expired"""
+        while True:
+            await asyncio.sleep(IMPORT_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._renew_leases, list(self._tasks))
+                await self._restart_recovered_jobs()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"更新目录导入任务租约失败: error={str(e)}")
+
+    async def _run(self, job_id: int) -> None:
+        job = await asyncio.to_thread(self._claim_job, job_id)
+        if job is None:
+            return
+        logger.info(f"开始目录导入: job_id={job_id}, directory={job['directory_path']}, workers={self.workers}")
+
+        # 有界队列：工作线程处理不过来时暂停遍历目录
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(job, queue)) for _ in range(self.workers)]
+        try:
+            paths = iter_import_paths(job["directory_path"], job["recursive"])
+            discovered = 0
+            while True:
+                path = await asyncio.to_thread(next, paths, None)
+                if path is None:
+                    break
+                await queue.put(path)
+                discovered += 1
+                if discovered % IMPORT_DISCOVERY_FLUSH == 0:
+                    await asyncio.to_thread(self._set_discovered, job_id, discovered, False)
+            await asyncio.to_thread(self._set_discovered, job_id, discovered, True)
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await asyncio.to_thread(self._finish_job, job_id, ImportJobStatus.COMPLETED)
+            logger.info(f"目录导入完成: job_id={job_id}, files={discovered}")
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            raise
+        except Exception as e:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            logger.error(f"目录导入失败: job_id={job_id}, error={str(e)}", exc_info=True)
+            await asyncio.to_thread(self._finish_job, job_id, ImportJobStatus.FAILED, str(e))
+
+    async def _worker(self, job: Dict[str, Any], queue: asyncio.Queue) -> None:
+        db = self._session()
+        try:
+            service = DocumentService(db)
+            while True:
+                path = await queue.get()
+                if path is None:
+                    return
+                try:
+                    await asyncio.to_thread(self._import_file, db, service, job, path)
+                except Exception as e:
+                    # 记录结果失败（如数据库暂时不可用）时继续处理其他文件，避免阻塞目录遍历
+                    db.rollback()
+                    logger.error(f"记录导入结果失败: job_id={job['id']}, path={path}, error={str(e)}")
+        finally:
+            db.close()
+
+    def _import_file(self, db: Session, service: DocumentService, job: Dict[str, Any], path: str) -> None:
+        """Synchronize one file and record its outcome on the job"""
+        document_id = None
+        error = None
+        try:
+            document, action = service.sync_path(job["knowledge_base_id"], job["created_by"], path, job["metadata"])
+            if document is None:
+                action, error = IMPORT_FILE_FAILED, "不支持的文件类型"
+            else:
+                document_id = document.id
+        except Exception as e:
+            db.rollback()
+            logger.error(f"导入文件失败: job_id={job['id']}, path={path}, error={str(e)}")
+            action, error = IMPORT_FILE_FAILED, str(e)
+
+        db.add(ImportJobFile(job_id=job["id"], path=path, action=action, document_id=document_id, error=error))
+        counter = _ACTION_COUNTERS[action]
+        db.query(ImportJob).filter(ImportJob.id == job["id"]).update(
+            {ImportJob.processed_files: ImportJob.processed_files + 1, counter: counter + 1},
+            synchronize_session=False
+        )
+        db.commit()
+
+    def _claim_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Atomically move a pending job to running and reset its progress"""
+        db = self._session()
+        try:
+            claimed = (
+                db.query(ImportJob)
+                .filter(ImportJob.id == job_id, ImportJob.status == ImportJobStatus.PENDING)
+                .update(
+                    {
+                        ImportJob.status: ImportJobStatus.RUNNING,
+                        ImportJob.started_at: datetime.now(),
+                        ImportJob.heartbeat_at: datetime.now(),
+                        ImportJob.discovered_files: 0,
+                        ImportJob.discovery_done: False,
+                        ImportJob.processed_files: 0,
+                        ImportJob.created_files: 0,
+                        ImportJob.updated_files: 0,
+                        ImportJob.unchanged_files: 0,
+                        ImportJob.failed_files: 0,
+                        ImportJob.last_error: None
+                    },
+                    synchronize_session=False
+                )
+            )
+            if not claimed:
+                db.commit()
+                return None
+            # 重新开始的任务从头导入，未变化的文件会被快速跳过
+            db.query(ImportJobFile).filter(ImportJobFile.job_id == job_id).delete(synchronize_session=False)
+            db.commit()
+            job = db.query(ImportJob).filter(ImportJob.id == job_id).first()
+            return {
+                "id": job.id,
+                "knowledge_base_id": job.knowledge_base_id,
+                "created_by": job.created_by,
+                "directory_path": job.directory_path,
+                "recursive": bool(job.recursive),
+                "metadata": job.file_metadata
+            }
+        finally:
+            db.close()
+
+    def _renew_leases(self, job_ids: List[int]) -> None:
+        if not job_ids:
+            return
+        db = self._session()
+        try:
+            db.query(ImportJob).filter(
+                ImportJob.id.in_(job_ids), ImportJob.status == ImportJobStatus.RUNNING
+            ).update({ImportJob.heartbeat_at: datetime.now()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _requeue_jobs(self, job_ids: List[int]) -> None:
+        db = self._session()
+        try:
+            db.query(ImportJob).filter(
+                ImportJob.id.in_(job_ids), ImportJob.status == ImportJobStatus.RUNNING
+            ).update(
+                {ImportJob.status: ImportJobStatus.PENDING, ImportJob.heartbeat_at: None},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _recover_jobs(self) -> List[int]:
+        """Move running jobs whose lease has expired back to pending and list all pending jobs"""
+        db = self._session()
+        try:
+            expired = datetime.now() - timedelta(seconds=IMPORT_LEASE_SECONDS)
+            db.query(ImportJob).filter(
+                ImportJob.status == ImportJobStatus.RUNNING,
+                or_(ImportJob.heartbeat_at < expired, ImportJob.heartbeat_at.is_(None))
+            ).update(
+                {ImportJob.status: ImportJobStatus.PENDING, ImportJob.heartbeat_at: None},
+                synchronize_session=False
+            )
+            db.commit()
+            return [
+                job_id for (job_id,) in
+                db.query(ImportJob.id).filter(ImportJob.status == ImportJobStatus.PENDING).order_by(ImportJob.id).all()
+            ]
+        finally:
+            db.close()
+
+    def _set_discovered(self, job_id: int, discovered: int, done: bool) -> None:
+        db = self._session()
+        try:
+            db.query(ImportJob).filter(ImportJob.id == job_id).update(
+                {ImportJob.discovered_files: discovered, ImportJob.discovery_done: done},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish_job(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        db = self._session()
+        try:
+            db.query(ImportJob).filter(ImportJob.id == job_id).update(
+                {
+                    ImportJob.status: status,
+                    ImportJob.last_error: error,
+                    ImportJob.finished_at: datetime.now(),
+                    ImportJob.heartbeat_at: None
+                },
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+_directory_importer: Optional[DirectoryImporter] = None
+_directory_importer_lock = threading.Lock()
+
+
+def get_directory_importer() -> DirectoryImporter:
+    """
+    Get the process-wide directory importer instance
+
+    Returns:
+        Shared DirectoryImporter
+    """
+    global _directory_importer
+    if _directory_importer is None:
+        with _directory_importer_lock:
+            if _directory_importer is None:
+                _directory_importer = DirectoryImporter()
+    return _directory_importer
@@ -0,0 +1,529 @@
+"""
+Ingestion service, a persistent document ingestion job queue drained by a background worker pool
+
+Jobs are rows of the ingestion_jobs table, so queued work survives restarts. CPU-bound text
+extraction and chunking run in a process pool and stream chunks to a spool file; embedding, indexing
+and persistence read the spool back in batches in threads, so memory stays bounded and the event
+loop is never blocked. Progress is reported through Document.status and chunk_count.
+
+Processed chunks are cached next to the content-addressed file blob, keyed by the chunking
+configuration and embedding model, so the same file added to several knowledge bases is only
+extracted and chunked once; its embeddings are shared through the embedding cache.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable, Iterator, Set
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..models.knowledge import KnowledgeBase, Document, DocumentStatus, IngestionJob, IngestionJobStatus
+from ..services.rag_service import RAGService, iter_document_chunks, chunk_vector_id
+from ..services.chunk_writer import bulk_write_chunks
+from ..services.text_extractors import UnsupportedFileTypeError
+from ..services.chunking import ChunkingConfig, ChunkingConfigError
+from ..services.answer_cache import invalidate_answer_cache
+from ..services.metadata_filters import document_attributes
+from ..services.blob_store import get_blob_store
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+# Queue configuration, overridable through environment variables
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "4"))
+INGESTION_PROCESSES = int(os.getenv("INGESTION_PROCESSES", str(os.cpu_count() or 2)))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+INGESTION_RETRY_BASE_SECONDS = float(os.getenv("INGESTION_RETRY_BASE_SECONDS", "5"))
+INGESTION_POLL_INTERVAL = float(os.getenv("INGESTION_POLL_INTERVAL", "2"))
+INGESTION_INDEX_BATCH_SIZE = int(os.getenv("INGESTION_INDEX_BATCH_SIZE", "512"))
+# A running job holds a lease renewed every heartbeat interval; a job whose heartbeat is older
+# than the lease belongs to a dead worker process and is queued again
+INGESTION_HEARTBEAT_SECONDS = float(os.getenv("INGESTION_HEARTBEAT_SECONDS", "30"))
+INGESTION_LEASE_SECONDS = float(os.getenv("INGESTION_LEASE_SECONDS", "300"))
+
+# Errors that will not go away by retrying
+NON_RETRYABLE_ERRORS = (UnsupportedFileTypeError, ChunkingConfigError)
+
+
+def spool_document_chunks(
+    file_path: str,
+    doc_id: int,
+    kb_id: int,
+    spool_path: str,
+    kb_metadata: Optional[Dict[str, Any]] = None
+) -> int:
+    """
+    Extract and chunk a document into a JSON lines spool file
+
+    Runs in a worker process. Chunks are written as they are produced, so neither the worker
+    nor the parent ever holds the whole document in memory, and only the chunk count is sent
+    back over the process boundary.
+
+    Args:
+        file_path: Document path
+        doc_id: Document ID
+        kb_id: Knowledge base ID
+        spool_path: Path of the spool file to write
+        kb_metadata: Knowledge base metadata selecting the chunking strategy
+
+    Returns:
+        Number of chunks written
+    """
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for chunk in iter_document_chunks(file_path, doc_id, kb_id, kb_metadata):
+            spool.write(json.dumps(chunk, ensure_ascii=False))
+            spool.write("\n")
+            count += 1
+    return count
+
+
+def read_spooled_chunks(spool_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read chunks back from a spool file one at a time
+
+    Args:
+        spool_path: Spool file written by spool_document_chunks
+
+    Returns:
+        Iterator of chunk information
+    """
+    with open(spool_path, "r", encoding="utf-8") as spool:
+        for line in spool:
+            if line.strip():
+                yield json.loads(line)
+
+
+def chunk_cache_name(kb_metadata: Optional[Dict[str, Any]], model_name: str) -> str:
+    """
+    Name of the processed chunk cache of a file, for a chunking configuration and embedding model
+
+    Args:
+        kb_metadata: Knowledge base metadata selecting the chunking strategy
+        model_name: Embedding model, semantic chunking depends on it
+
+    Returns:
+        Derived file name
+    """
+    config = ChunkingConfig.from_metadata(kb_metadata)
+    key = json.dumps({"chunking": config._asdict(), "model": model_name}, sort_keys=True)
+    return f"chunks-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.jsonl"
+
+
+def rebind_spooled_chunks(source_path: str, doc_id: int, kb_id: int, spool_path: str) -> int:
+    """
+    Copy cached chunks into a spool file, rewriting the document and knowledge base they belong to
+
+    Args:
+        source_path: Cached spool file of another document with the same content
+        doc_id: Document ID
+        kb_id: Knowledge base ID
+        spool_path: Path of the spool file to write
+
+    Returns:
+        Number of chunks written
+    """
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for chunk in read_spooled_chunks(source_path):
+            chunk["embedding_id"] = chunk_vector_id(doc_id, chunk["chunk_index"])
+            chunk["metadata"]["doc_id"] = doc_id
+            chunk["metadata"]["kb_id"] = kb_id
+            spool.write(json.dumps(chunk, ensure_ascii=False))
+            spool.write("\n")
+            count += 1
+    return count
+
+
+def enqueue_document(db: Session, doc: Document) -> IngestionJob:
+    """
+    Add an ingestion job for a document to the session
+
+    The caller commits, so the job is persisted atomically with the document row, and then
+    calls get_ingestion_queue().notify() to wake up idle workers.
+
+    Args:
+        db: Database session
+        doc: Document to ingest (must already have an ID, flush first)
+
+    Returns:
+        The new job
+    """
+    job = IngestionJob(
+        document_id=doc.id,
+        knowledge_base_id=doc.knowledge_base_id,
+        status=IngestionJobStatus.PENDING,
+        attempts=0,
+        max_attempts=INGESTION_MAX_ATTEMPTS,
+        next_run_at=datetime.now()
+    )
+    db.add(job)
+    doc.status = DocumentStatus.PENDING
+    return job
+
+
+class IngestionQueue:
+    """
+    Ingestion queue class, runs ingestion jobs with bounded concurrency, retrying failures with exponential backoff
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        workers: int = INGESTION_WORKERS,
+        processes: int = INGESTION_PROCESSES
+    ):
+        """
+        Initialize ingestion queue
+
+        Args:
+            session_factory: Callable returning a new database session, defaults to SessionLocal
+            workers: Number of jobs processed concurrently
+            processes: Size of the process pool used for extraction and chunking
+        """
+        self._session_factory = session_factory
+        self.workers = max(1, workers)
+        self.processes = max(1, processes)
+        self._tasks: List[asyncio.Task] = []
+        self._running_jobs: Set[int] = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._rag_service: Optional[RAGService] = None
+
+    def _session(self) -> Session:
+        if self._session_factory is None:
+            from ..database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        """Start the worker pool, re-queueing running jobs whose lease has expired"""
+        if self.running:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        # spawn keeps the worker processes free of the parent's threads and open connections
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        self._rag_service = RAGService()
+
+        recovered = await asyncio.to_thread(self._recover_running_jobs)
+        if recovered:
+            logger.info(f"重新排队未完成的入库任务: {recovered}")
+
+        self._tasks = [
+            asyncio.create_task(self._worker(worker_id), name=f"ingestion-worker-{worker_id}")
+            for worker_id in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._lease_keeper(), name="ingestion-lease-keeper"))
+        logger.info(f"文档入库队列已启动: workers={self.workers}, processes={self.processes}")
+
+    async def stop(self) -> None:
+        """Stop the worker pool, jobs interrupted by the stop are queued again right away"""
+        interrupted = list(self._running_jobs)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if interrupted:
+            try:
+                await asyncio.to_thread(self._requeue_jobs, interrupted)
+            except Exception as e:
+                logger.error(f"重新排队中断的入库任务失败: job_ids={interrupted}, error={str(e)}")
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        logger.info("文档入库队列已停止")
+
+    def notify(self) -> None:
+        """Wake up idle workers, safe to call from any thread"""
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            # 先清除唤醒标记，领取任务期间到达的通知不会丢失
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self._claim_next_job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"获取入库任务失败: worker={worker_id}, error={str(e)}", exc_info=True)
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=INGESTION_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_job(job)
+
+    async def _lease_keeper(self) -> None:
+        """Renew the leases of this process's running jobs and re-queue jobs whose lease has expired"""
+        while True:
+            await asyncio.sleep(INGESTION_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._renew_leases, list(self._running_jobs))
+                recovered = await asyncio.to_thread(self._recover_running_jobs)
+                if recovered:
+                    logger.info(f"重新排队租约过期的入库任务: {recovered}")
+                    self._wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"更新入库任务租约失败: error={str(e)}")
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        self._running_jobs.add(job["id"])
+        try:
+            await self._process_job(job)
+        finally:
+            self._running_jobs.discard(job["id"])
+
+    async def _process_job(self, job: Dict[str, Any]) -> None:
+        doc_id = job["document_id"]
+        kb_id = job["knowledge_base_id"]
+        logger.info(f"开始处理入库任务: job_id={job['id']}, doc_id={doc_id}, attempt={job['attempts']}")
+
+        fd, spool_path = tempfile.mkstemp(prefix=f"ingest-{doc_id}-", suffix=".jsonl")
+        os.close(fd)
+        try:
+            cache_name = None
+            if job["content_hash"]:
+                cache_name = chunk_cache_name(job["kb_metadata"], self._rag_service.embedding_service.model_name)
+                cache_path = get_blob_store().derived_path(job["content_hash"], cache_name)
+            if cache_name and os.path.exists(cache_path):
+                # 相同内容已按相同配置处理过（可能在其他知识库中），直接复用分块结果
+                chunk_count = await asyncio.to_thread(rebind_spooled_chunks, cache_path, doc_id, kb_id, spool_path)
+            else:
+                # 提取文本和分块在进程池中执行，结果流式写入临时文件
+                chunk_count = await self._loop.run_in_executor(
+                    self._pool, spool_document_chunks, job["file_path"], doc_id, kb_id, spool_path, job["kb_metadata"]
+                )
+                if cache_name:
+                    await asyncio.to_thread(get_blob_store().save_derived, job["content_hash"], cache_name, spool_path)
+            # 向量化和写入向量索引在线程中分批执行，块数为0时也要清理旧的块
+            await asyncio.to_thread(self._index_spool, kb_id, doc_id, spool_path, job["attributes"])
+            await asyncio.to_thread(self._complete_job, job, spool_path)
+            # 新内容可检索后，缓存的答案可能已过时
+            await asyncio.to_thread(invalidate_answer_cache, kb_id)
+            logger.info(f"入库任务完成: job_id={job['id']}, doc_id={doc_id}, chunks={chunk_count}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"入库任务失败: job_id={job['id']}, doc_id={doc_id}, error={str(e)}", exc_info=True)
+            try:
+                retryable = not isinstance(e, NON_RETRYABLE_ERRORS)
+                await asyncio.to_thread(self._fail_job, job, str(e), retryable)
+            except Exception as e2:
+                logger.error(f"记录入库任务失败状态出错: job_id={job['id']}, error={str(e2)}")
+        finally:
+            try:
+                os.remove(spool_path)
+            except OSError:
+                pass
+
+    def _index_spool(
+        self,
+        kb_id: int,
+        doc_id: int,
+        spool_path: str,
+        attributes: Optional[Dict[str, Any]] = None
+    ) -> None:
+        # 重新入库时只向量化内容变化的块，并移除已不存在的块
+        self._rag_service.sync_document_chunks(
+            kb_id, doc_id, read_spooled_chunks(spool_path), attributes, batch_size=INGESTION_INDEX_BATCH_SIZE
+        )
+
+    def _renew_leases(self, job_ids: List[int]) -> None:
+        if not job_ids:
+            return
+        db = self._session()
+        try:
+            db.query(IngestionJob).filter(
+                IngestionJob.id.in_(job_ids), IngestionJob.status == IngestionJobStatus.RUNNING
+            ).update({IngestionJob.heartbeat_at: datetime.now()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _requeue_jobs(self, job_ids: List[int]) -> None:
+        db = self._session()
+        try:
+            db.query(IngestionJob).filter(
+                IngestionJob.id.in_(job_ids), IngestionJob.status == IngestionJobStatus.RUNNING
+            ).update(
+                {IngestionJob.status: IngestionJobStatus.PENDING, IngestionJob.heartbeat_at: None},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _recover_running_jobs(self) -> int:
+        """Move running jobs whose lease has expired back to pending, jobs of live workers are left alone"""
+        db = self._session()
+        try:
+            expired = datetime.now() - timedelta(seconds=INGESTION_LEASE_SECONDS)
+            count = (
+                db.query(IngestionJob)
+                .filter(
+                    IngestionJob.status == IngestionJobStatus.RUNNING,
+                    or_(IngestionJob.heartbeat_at < expired, IngestionJob.heartbeat_at.is_(None))
+                )
+                .update(
+                    {IngestionJob.status: IngestionJobStatus.PENDING, IngestionJob.heartbeat_at: None},
+                    synchronize_session=False
+                )
+            )
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def _claim_next_job(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the next due job from pending to running"""
+        db = self._session()
+        try:
+            candidates = (
+                db.query(IngestionJob.id)
+                .filter(
+                    IngestionJob.status == IngestionJobStatus.PENDING,
+                    IngestionJob.next_run_at <= datetime.now()
+                )
+                .order_by(IngestionJob.next_run_at, IngestionJob.id)
+                .limit(self.workers)
+                .all()
+            )
+            for (job_id,) in candidates:
+                # 条件更新保证同一任务只会被一个worker（或进程）领取
+                claimed = (
+                    db.query(IngestionJob)
+                    .filter(IngestionJob.id == job_id, IngestionJob.status == IngestionJobStatus.PENDING)
+                    .update(
+                        {
+                            IngestionJob.status: IngestionJobStatus.RUNNING,
+                            IngestionJob.attempts: IngestionJob.attempts + 1,
+                            IngestionJob.heartbeat_at: datetime.now()
+                        },
+                        synchronize_session=False
+                    )
+                )
+                db.commit()
+                if not claimed:
+                    continue
+
+                job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+                doc = db.query(Document).filter(Document.id == job.document_id).first()
+                if doc is None:
+                    job.status = IngestionJobStatus.FAILED
+                    job.last_error = "文档不存在"
+                    db.commit()
+                    continue
+
+                doc.status = DocumentStatus.PROCESSING
+                db.commit()
+                kb_metadata = (
+                    db.query(KnowledgeBase.kb_metadata)
+                    .filter(KnowledgeBase.id == job.knowledge_base_id)
+                    .scalar()
+                )
+                return {
+                    "id": job.id,
+                    "document_id": job.document_id,
+                    "knowledge_base_id": job.knowledge_base_id,
+                    "kb_metadata": kb_metadata,
+                    "attributes": document_attributes(doc),
+                    "file_path": doc.file_path,
+                    "content_hash": doc.content_hash,
+                    "attempts": job.attempts,
+                    "max_attempts": job.max_attempts
+                }
+            return None
+        finally:
+            db.close()
+
+    def _complete_job(self, job: Dict[str, Any], spool_path: str) -> None:
+        db = self._session()
+        try:
+            # 块、chunk_count、文档状态和任务状态在同一事务中提交
+            bulk_write_chunks(
+                db, job["document_id"], job["knowledge_base_id"], read_spooled_chunks(spool_path), commit=False
+            )
+            db.query(IngestionJob).filter(IngestionJob.id == job["id"]).update(
+                {IngestionJob.status: IngestionJobStatus.COMPLETED, IngestionJob.last_error: None},
+                synchronize_session=False
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _fail_job(self, job: Dict[str, Any], error: str, retryable: bool = True) -> None:
+        db = self._session()
+        try:
+            db_job = db.query(IngestionJob).filter(IngestionJob.id == job["id"]).first()
+            doc = db.query(Document).filter(Document.id == job["document_id"]).first()
+            if db_job is None:
+                return
+
+            db_job.last_error = error
+            if retryable and db_job.attempts < db_job.max_attempts:
+                # 指数退避加随机抖动
+                delay = INGESTION_RETRY_BASE_SECONDS * (2 ** (db_job.attempts - 1))
+                delay *= random.uniform(0.8, 1.2)
+                db_job.status = IngestionJobStatus.PENDING
+                db_job.next_run_at = datetime.now() + timedelta(seconds=delay)
+                doc_status = DocumentStatus.PENDING
+                logger.info(f"入库任务将重试: job_id={db_job.id}, delay={delay:.1f}s")
+            else:
+                db_job.status = IngestionJobStatus.FAILED
+                doc_status = DocumentStatus.FAILED
+
+            if doc is not None:
+                doc.status = doc_status
+                metadata = dict(doc.doc_metadata or {})
+                metadata["error"] = error
+                doc.doc_metadata = metadata
+            db.commit()
+        finally:
+            db.close()
+
+
+_ingestion_queue: Optional[IngestionQueue] = None
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """
+    Get the process-wide ingestion queue
+
+    Returns:
+        Shared IngestionQueue
+    """
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        _ingestion_queue = IngestionQueue()
+    return _ingestion_queue
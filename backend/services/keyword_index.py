@@ -0,0 +1,440 @@
+"""
+Keyword index, an incrementally maintained BM25 inverted index with one SQLite file per knowledge base
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+try:
+    from .metadata_filters import MetadataFilter
+except ImportError:
+    from backend.services.metadata_filters import MetadataFilter
+
+# Index location and BM25 parameters, overridable through environment variables
+KEYWORD_INDEX_DIR = os.getenv("KEYWORD_INDEX_DIR", "files/keyword_index")
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Upper bound on distinct query terms, very long queries are truncated
+BM25_MAX_QUERY_TERMS = int(os.getenv("BM25_MAX_QUERY_TERMS", "64"))
+# Postings read per query term, the highest term frequencies first; 0 reads all of them
+BM25_MAX_POSTINGS_PER_TERM = int(os.getenv("BM25_MAX_POSTINGS_PER_TERM", "2000"))
+# Terms occurring in more than this fraction of chunks are skipped when the query has rarer terms
+BM25_MAX_TERM_DF_RATIO = float(os.getenv("BM25_MAX_TERM_DF_RATIO", "0.5"))
+
+_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+# Latin words, numbers and codes such as "ERR-1042", "v2.3.1" or "SKU_88A"
+_WORD = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+_WORD_PART = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenize text for keyword search
+
+    CJK runs are split into overlapping character bigrams (a single character stays a unigram),
+    so Chinese text needs no dictionary. Latin words are lowercased; codes joined by "-", "_" or
+    "." are indexed both whole and by their parts, so "ERR-1042" also matches "1042".
+
+    Args:
+        text: Text content
+
+    Returns:
+        Tokens in order of appearance
+    """
+    text = text.lower()
+    tokens: List[str] = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for word in _WORD.findall(text):
+        tokens.append(word)
+        parts = _WORD_PART.findall(word)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    Keyword index class, keeps a BM25 inverted index per knowledge base on local disk
+    """
+
+    def __init__(self, persist_dir: Optional[str] = None):
+        """
+        Initialize keyword index
+
+        Args:
+            persist_dir: Directory holding the index files, defaults to KEYWORD_INDEX_DIR
+        """
+        self.logger = get_logger(__name__)
+        self.persist_dir = persist_dir or KEYWORD_INDEX_DIR
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._locks: Dict[int, threading.Lock] = {}
+        self._stats: Dict[int, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, kb_id: int) -> str:
+        return os.path.join(self.persist_dir, f"kb_{kb_id}.sqlite3")
+
+    def _connection(self, kb_id: int, create: bool = True) -> Tuple[Optional[sqlite3.Connection], threading.Lock]:
+        """Get (and optionally create) the index database of a knowledge base"""
+        with self._lock:
+            connection = self._connections.get(kb_id)
+            if connection is None:
+                path = self._path(kb_id)
+                if not create and not os.path.exists(path):
+                    return None, self._locks.setdefault(kb_id, threading.Lock())
+                connection = sqlite3.connect(path, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS chunks ("
+                    "vector_id TEXT PRIMARY KEY, doc_id INTEGER NOT NULL, length INTEGER NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id)")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS postings ("
+                    "term TEXT NOT NULL, vector_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+                    "PRIMARY KEY (term, vector_id)) WITHOUT ROWID"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_postings_vector ON postings (vector_id)")
+                # Lets search read the top postings of a term by frequency without scanning them all
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_postings_term_tf ON postings (term, tf DESC)")
+                # Document frequency per term, kept in step with postings so search never counts them
+                has_term_df = connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'term_df'"
+                ).fetchone()
+                if not has_term_df:
+                    connection.execute(
+                        "CREATE TABLE term_df (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID"
+                    )
+                    # Index files written before the table existed are counted once
+                    connection.execute("INSERT INTO term_df (term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+                # Document attributes used by metadata filters
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS documents ("
+                    "doc_id INTEGER PRIMARY KEY, file_type TEXT, created_at INTEGER)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS document_tags ("
+                    "tag TEXT NOT NULL, doc_id INTEGER NOT NULL, PRIMARY KEY (tag, doc_id)) WITHOUT ROWID"
+                )
+                connection.commit()
+                self._connections[kb_id] = connection
+            return connection, self._locks.setdefault(kb_id, threading.Lock())
+
+    def add(
+        self,
+        kb_id: int,
+        doc_id: int,
+        items: List[Tuple[str, str]],
+        attributes: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Index chunks, replacing earlier postings of the same vector IDs
+
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            items: (vector ID, chunk text) pairs
+            attributes: Filterable document attributes (file_type, created_at, tags)
+
+        Returns:
+            Number of chunks indexed
+        """
+        if not items:
+            return 0
+
+        connection, lock = self._connection(kb_id)
+        with lock:
+            try:
+                self._delete_vectors(connection, [vector_id for vector_id, _ in items])
+                chunk_rows = []
+                posting_rows = []
+                document_frequency: Counter = Counter()
+                for vector_id, text in items:
+                    counts = Counter(tokenize(text))
+                    chunk_rows.append((vector_id, doc_id, sum(counts.values())))
+                    posting_rows.extend((term, vector_id, tf) for term, tf in counts.items())
+                    document_frequency.update(counts.keys())
+                connection.executemany("INSERT INTO chunks (vector_id, doc_id, length) VALUES (?, ?, ?)", chunk_rows)
+                connection.executemany("INSERT INTO postings (term, vector_id, tf) VALUES (?, ?, ?)", posting_rows)
+                connection.executemany(
+                    "INSERT INTO term_df (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                    document_frequency.items()
+                )
+                if attributes is not None:
+                    self._write_attributes(connection, doc_id, attributes)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            self._stats.pop(kb_id, None)
+        return len(items)
+
+    @staticmethod
+    def _delete_vectors(connection: sqlite3.Connection, vector_ids: List[str]) -> None:
+        """Remove the postings and chunks of vector IDs and take them out of the term frequencies"""
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(vector_ids), 500):
+            part = vector_ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            removed = connection.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE vector_id IN ({placeholders}) GROUP BY term", part
+            ).fetchall()
+            if removed:
+                connection.executemany("UPDATE term_df SET df = df - ? WHERE term = ?", [(df, term) for term, df in removed])
+                connection.executemany("DELETE FROM term_df WHERE term = ? AND df <= 0", [(term,) for term, _ in removed])
+            connection.execute(f"DELETE FROM postings WHERE vector_id IN ({placeholders})", part)
+            connection.execute(f"DELETE FROM chunks WHERE vector_id IN ({placeholders})", part)
+
+    @staticmethod
+    def _write_attributes(connection: sqlite3.Connection, doc_id: int, attributes: Dict[str, Any]) -> None:
+        connection.execute(
+            "INSERT OR REPLACE INTO documents (doc_id, file_type, created_at) VALUES (?, ?, ?)",
+            (doc_id, attributes.get("file_type"), attributes.get("created_at"))
+        )
+        connection.execute("DELETE FROM document_tags WHERE doc_id = ?", (doc_id,))
+        connection.executemany(
+            "INSERT INTO document_tags (tag, doc_id) VALUES (?, ?)",
+            [(tag, doc_id) for tag in attributes.get("tags") or ()]
+        )
+
+    def set_document_attributes(self, kb_id: int, doc_id: int, attributes: Dict[str, Any]) -> None:
+        """
+        Replace the filterable attributes of a document
+
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            attributes: Document attributes (file_type, created_at, tags)
+        """
+        connection, lock = self._connection(kb_id)
+        with lock:
+            self._write_attributes(connection, doc_id, attributes)
+            connection.commit()
+
+    def delete(self, kb_id: int, vector_ids: List[str]) -> None:
+        """
+        Remove chunks from the index
+
+        Args:
+            kb_id: Knowledge base ID
+            vector_ids: Vector IDs of the chunks
+        """
+        if not vector_ids:
+            return
+        connection, lock = self._connection(kb_id, create=False)
+        if connection is None:
+            return
+        with lock:
+            try:
+                self._delete_vectors(connection, vector_ids)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            self._stats.pop(kb_id, None)
+
+    def delete_document(self, kb_id: int, doc_id: int) -> None:
+        """
+        Remove all chunks of a document from the index
+
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+        """
+        connection, lock = self._connection(kb_id, create=False)
+        if connection is None:
+            return
+        with lock:
+            try:
+                vector_ids = [
+                    vector_id for (vector_id,) in
+                    connection.execute("SELECT vector_id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+                ]
+                self._delete_vectors(connection, vector_ids)
+                connection.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                connection.execute("DELETE FROM document_tags WHERE doc_id = ?", (doc_id,))
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            self._stats.pop(kb_id, None)
+
+    def drop(self, kb_id: int) -> None:
+        """
+        Drop the whole index of a knowledge base
+
+        Args:
+            kb_id: Knowledge base ID
+        """
+        with self._lock:
+            connection = self._connections.pop(kb_id, None)
+            self._stats.pop(kb_id, None)
+            if connection is not None:
+                connection.close()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self._path(kb_id) + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def _corpus_stats(self, kb_id: int, connection: sqlite3.Connection) -> Tuple[int, float]:
+        """Number of chunks and average chunk length, cached until the next write"""
+        stats = self._stats.get(kb_id)
+        if stats is None:
+            count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            stats = (count, total / count if count else 0.0)
+            self._stats[kb_id] = stats
+        return stats
+
+    @staticmethod
+    def _filter_clause(metadata_filter: Optional[MetadataFilter]) -> Tuple[str, List[Any]]:
+        """SQL conditions on chunks (aliased c) selecting the documents matched by a filter"""
+        if metadata_filter is None:
+            return "", []
+        clauses: List[str] = []
+        params: List[Any] = []
+        if metadata_filter.doc_ids:
+            clauses.append(f"c.doc_id IN ({','.join('?' * len(metadata_filter.doc_ids))})")
+            params.extend(metadata_filter.doc_ids)
+        if metadata_filter.tags:
+            clauses.append(
+                f"c.doc_id IN (SELECT doc_id FROM document_tags WHERE tag IN ({','.join('?' * len(metadata_filter.tags))}) "
+                f"GROUP BY doc_id HAVING COUNT(*) = ?)"
+            )
+            params.extend(metadata_filter.tags)
+            params.append(len(metadata_filter.tags))
+        document_conditions: List[str] = []
+        if metadata_filter.file_types:
+            document_conditions.append(f"file_type IN ({','.join('?' * len(metadata_filter.file_types))})")
+            params.extend(metadata_filter.file_types)
+        if metadata_filter.created_after is not None:
+            document_conditions.append("created_at >= ?")
+            params.append(metadata_filter.created_after)
+        if metadata_filter.created_before is not None:
+            document_conditions.append("created_at <= ?")
+            params.append(metadata_filter.created_before)
+        if document_conditions:
+            clauses.append(f"c.doc_id IN (SELECT doc_id FROM documents WHERE {' AND '.join(document_conditions)})")
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def search(
+        self,
+        kb_id: int,
+        query: str,
+        limit: int = 5,
+        metadata_filter: Optional[MetadataFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Rank chunks against a query with BM25
+
+        The work per query is bounded. Terms occurring in more than BM25_MAX_TERM_DF_RATIO of the
+        chunks carry almost no weight and are skipped when the query has rarer terms. Of each
+        remaining term only the BM25_MAX_POSTINGS_PER_TERM postings with the highest term
+        frequency are read. A chunk matching a very common term with a low frequency can
+        therefore miss that term's contribution, which only affects the tail of the ranking.
+
+        Args:
+            kb_id: Knowledge base ID
+            query: Query text
+            limit: Maximum number of results to return
+            metadata_filter: Only chunks of documents matching the filter are ranked
+
+        Returns:
+            List of hits with vector ID and BM25 score, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:BM25_MAX_QUERY_TERMS]
+        if not terms or limit <= 0:
+            return []
+        connection, lock = self._connection(kb_id, create=False)
+        if connection is None:
+            return []
+
+        with lock:
+            count, avg_length = self._corpus_stats(kb_id, connection)
+            if not count:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            document_frequency = dict(connection.execute(
+                f"SELECT term, df FROM term_df WHERE term IN ({placeholders})", terms
+            ).fetchall())
+            rare = [term for term, df in document_frequency.items() if df <= BM25_MAX_TERM_DF_RATIO * count]
+            filter_sql, filter_params = self._filter_clause(metadata_filter)
+            limit_sql = " ORDER BY p.tf DESC LIMIT ?" if BM25_MAX_POSTINGS_PER_TERM > 0 else ""
+            limit_params = [BM25_MAX_POSTINGS_PER_TERM] if BM25_MAX_POSTINGS_PER_TERM > 0 else []
+            rows = []
+            for term in rare or list(document_frequency):
+                rows.extend(connection.execute(
+                    f"SELECT p.term, p.vector_id, p.tf, c.length FROM postings p "
+                    f"JOIN chunks c ON c.vector_id = p.vector_id WHERE p.term = ?{filter_sql}{limit_sql}",
+                    [term] + filter_params + limit_params
+                ).fetchall())
+
+        idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        scores: Dict[str, float] = {}
+        for term, vector_id, tf, length in rows:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (avg_length or 1))
+            scores[vector_id] = scores.get(vector_id, 0.0) + idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{"vector_id": vector_id, "score": score} for vector_id, score in ranked]
+
+    def stats(self, kb_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get statistics of a knowledge base index
+
+        Args:
+            kb_id: Knowledge base ID
+
+        Returns:
+            Chunk count, average chunk length and number of distinct terms, or None if there is no index
+        """
+        connection, lock = self._connection(kb_id, create=False)
+        if connection is None:
+            return None
+        with lock:
+            count, avg_length = self._corpus_stats(kb_id, connection)
+            terms = connection.execute("SELECT COUNT(*) FROM term_df").fetchone()[0]
+        return {"kb_id": kb_id, "chunk_count": count, "avg_chunk_length": avg_length, "term_count": terms}
+
+
+_keyword_index: Optional[KeywordIndex] = None
+_keyword_index_lock = threading.Lock()
+
+
+def get_keyword_index() -> KeywordIndex:
+    """
+    Get the process-wide keyword index instance
+
+    Returns:
+        Shared KeywordIndex
+    """
+    global _keyword_index
+    if _keyword_index is None:
+        with _keyword_index_lock:
+            if _keyword_index is None:
+                _keyword_index = KeywordIndex()
+    return _keyword_index
@@ -1,13 +1,176 @@
 import json
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
 import httpx
 import openai
 from openai import AsyncOpenAI
 import logging
 import os
+import asyncio
+import threading
+
+try:
+    from .rag_service import RAGService
+    from .chunking import estimate_tokens
+    from .answer_cache import get_answer_cache
+    from .metadata_filters import MetadataFilter
+except ImportError:
+    from backend.services.rag_service import RAGService
+    from backend.services.chunking import estimate_tokens
+    from backend.services.answer_cache import get_answer_cache
+    from backend.services.metadata_filters import MetadataFilter
 
 logger = logging.getLogger(__name__)
 
+# LLM HTTP连接池配置，可通过环境变量覆盖
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "30"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+# 上下文窗口（token数），未知模型使用默认值，可在ModelConfig.config["context_window"]中覆盖
+LLM_DEFAULT_CONTEXT_WINDOW = int(os.getenv("LLM_DEFAULT_CONTEXT_WINDOW", "8192"))
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4o": 128000,
+    "deepseek-chat": 65536,
+    "deepseek-coder": 65536,
+    "qwen-turbo": 8192,
+    "qwen-plus": 32768,
+    "glm-4": 128000,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+}
+
+# RAG提示词组装配置
+RAG_CONTEXT_SAFETY_MARGIN = int(os.getenv("RAG_CONTEXT_SAFETY_MARGIN", "64"))
+RAG_HISTORY_BUDGET_RATIO = float(os.getenv("RAG_HISTORY_BUDGET_RATIO", "0.25"))
+RAG_CANDIDATE_MULTIPLIER = int(os.getenv("RAG_CANDIDATE_MULTIPLIER", "2"))
+
+RAG_SYSTEM_PROMPT = (
+    "你是一个知识库问答助手。请优先依据下面编号的参考资料回答用户的问题，"
+    "引用资料时使用对应编号，如[1]。如果参考资料不足以回答问题，请如实说明。"
+)
+
+_encoders: Dict[str, Any] = {}
+
+def count_tokens(text: str, model: str = None) -> int:
+    """计算文本token数，安装了tiktoken时精确计算，否则使用估算值"""
+    if not text:
+        return 0
+    encoder = _get_encoder(model or "")
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+def _get_encoder(model: str):
+    if model not in _encoders:
+        try:
+            import tiktoken
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoders[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # 未安装tiktoken或无法加载编码文件
+            _encoders[model] = None
+    return _encoders[model]
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = None) -> int:
+    """计算消息列表的token数，包含每条消息的格式开销"""
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3
+
+class LLMClientRegistry:
+    """LLM客户端注册表，按(provider, base_url, api_key)复用AsyncOpenAI客户端及其连接池"""
+    
+    def __init__(self):
+        self._clients: Dict[Tuple[str, Optional[str], Optional[str]], AsyncOpenAI] = {}
+        self._lock = threading.Lock()
+        self.http2 = LLM_HTTP2 and self._http2_available()
+    
+    @staticmethod
+    def _http2_available() -> bool:
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            logger.warning("未安装h2，LLM客户端使用HTTP/1.1")
+            return False
+    
+    def get_client(self, provider: str, base_url: Optional[str], api_key: Optional[str]) -> AsyncOpenAI:
+        """获取共享客户端，不存在时创建"""
+        key = (provider, base_url, api_key)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                http_client = httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=httpx.Timeout(
+                        connect=LLM_CONNECT_TIMEOUT,
+                        read=LLM_READ_TIMEOUT,
+                        write=LLM_WRITE_TIMEOUT,
+                        pool=LLM_POOL_TIMEOUT
+                    )
+                )
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=LLM_MAX_RETRIES,
+                    http_client=http_client
+                )
+                self._clients[key] = client
+                logger.info(f"创建LLM客户端: provider={provider}, base_url={base_url}, http2={self.http2}")
+            return client
+    
+    async def close(self):
+        """关闭所有客户端及其连接池"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"关闭LLM客户端失败: {e}")
+        if clients:
+            logger.info(f"已关闭LLM客户端: {len(clients)}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """客户端数量和连接池配置"""
+        return {
+            "clients": len(self._clients),
+            "http2": self.http2,
+            "max_connections": LLM_MAX_CONNECTIONS,
+            "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS
+        }
+
+_client_registry: Optional[LLMClientRegistry] = None
+
+def get_llm_client_registry() -> LLMClientRegistry:
+    """获取全局LLM客户端注册表"""
+    global _client_registry
+    if _client_registry is None:
+        _client_registry = LLMClientRegistry()
+    return _client_registry
+
 class ModelConfig:
     """模型配置类"""
     def __init__(self, name: str, provider: str, model_name: str, api_key: str, base_url: str = None, config: Dict[str, Any] = None):
@@ -54,9 +217,45 @@ class LLMService:
             name = self.default_model
         return self.models.get(name)
     
-    async def chat_completion(self, messages: List[Dict[str, str]], model_name: str = None, stream: bool = False, **kwargs) -> Any:
+    def resolve_model(self, provider: str = None, model: str = None) -> Optional[ModelConfig]:
+        """按提供商和模型名（配置名或模型ID）查找模型配置，未配置的模型复用同一提供商的连接配置"""
+        if provider is None and model is None:
+            return self.get_model()
+        
+        config = self.models.get(model) if model else None
+        if config and (provider is None or config.provider == provider):
+            return config
+        
+        for config in self.models.values():
+            if (model is None or config.model_name == model) and (provider is None or config.provider == provider):
+                return config
+        
+        if model:
+            for config in self.models.values():
+                if provider is None or config.provider == provider:
+                    return ModelConfig(
+                        name=model,
+                        provider=config.provider,
+                        model_name=model,
+                        api_key=config.api_key,
+                        base_url=config.base_url,
+                        config=config.config
+                    )
+        return None
+    
+    def get_context_window(self, config: ModelConfig) -> int:
+        """获取模型的上下文窗口大小（token数）"""
+        if config.config.get("context_window"):
+            return int(config.config["context_window"])
+        # 按最长前缀匹配，如 gpt-4-turbo 优先于 gpt-4
+        for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+            if config.model_name.startswith(prefix):
+                return MODEL_CONTEXT_WINDOWS[prefix]
+        return LLM_DEFAULT_CONTEXT_WINDOW
+    
+    async def chat_completion(self, messages: List[Dict[str, str]], model_name: str = None, stream: bool = False, provider: str = None, **kwargs) -> Any:
         """聊天补全"""
-        config = self.get_model(model_name)
+        config = self.resolve_model(provider, model_name)
         if not config:
             raise ValueError(f"Model {model_name} not found")
         
@@ -67,10 +266,7 @@ class LLMService:
     
     async def _openai_chat_completion(self, config: ModelConfig, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
         """OpenAI 聊天补全"""
-        client = AsyncOpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url
-        )
+        client = get_llm_client_registry().get_client(config.provider, config.base_url, config.api_key)
         
         try:
             response = await client.chat.completions.create(
@@ -87,49 +283,265 @@ class LLMService:
 class RAGChatService:
     """RAG 聊天服务"""
     
-    def __init__(self, llm_service: LLMService = None):
+    def __init__(self, llm_service: LLMService = None, rag_service: RAGService = None):
         self.llm_service = llm_service or LLMService()
+        self._rag_service = rag_service
+    
+    @property
+    def rag_service(self) -> RAGService:
+        if self._rag_service is None:
+            self._rag_service = RAGService()
+        return self._rag_service
+    
+    async def chat(self,
+                   query: str,
+                   kb_id: Optional[int] = None,
+                   chat_history: List[Dict[str, str]] = None,
+                   provider: str = None,
+                   model: str = None,
+                   temperature: float = 0.7,
+                   max_tokens: int = 1000,
+                   top_k: int = 5,
+                   use_cache: bool = True,
+                   search_mode: str = None,
+                   filters: MetadataFilter = None) -> Dict[str, Any]:
+        """基于知识库的问答，返回回答、引用来源、token用量和模型"""
+        # 语义答案缓存只用于会话中的首个问题，追问的含义依赖上下文
+        cache = get_answer_cache() if use_cache and kb_id is not None else None
+        if cache is not None and self._history_without_query(chat_history, query):
+            cache = None
+        
+        if cache is not None:
+            config = self.llm_service.resolve_model(provider, model)
+            if not config:
+                raise ValueError(f"Model {model} not found")
+            cache_key = {
+                "provider": config.provider,
+                "model": config.model_name,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "top_k": top_k,
+                "search_mode": search_mode,
+                "filters": filters._asdict() if filters else None,
+                "embedding_model": self.rag_service.embedding_service.model_name
+            }
+            query_embedding = await asyncio.to_thread(self.rag_service.embedding_service.embed_query, query)
+            cached = await asyncio.to_thread(cache.lookup, kb_id, cache_key, query_embedding)
+            if cached is not None:
+                logger.info(f"命中语义答案缓存: kb_id={kb_id}, similarity={cached['cache_similarity']:.3f}")
+                return cached
         
+        prepared = await self.prepare(
+            query=query,
+            kb_id=kb_id,
+            chat_history=chat_history,
+            provider=provider,
+            model=model,
+            max_tokens=max_tokens,
+            top_k=top_k,
+            search_mode=search_mode,
+            filters=filters
+        )
+        config = prepared["model_config"]
+        response = await self.llm_service.chat_completion(
+            messages=prepared["messages"],
+            model_name=config.name,
+            provider=config.provider,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        answer = response.choices[0].message.content or ""
+        if response.usage is not None:
+            usage = {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
+            }
+        else:
+            completion_tokens = count_tokens(answer, config.model_name)
+            usage = {
+                "prompt_tokens": prepared["prompt_tokens"],
+                "completion_tokens": completion_tokens,
+                "total_tokens": prepared["prompt_tokens"] + completion_tokens
+            }
+        
+        result = {
+            "answer": answer,
+            "sources": prepared["sources"],
+            "usage": usage,
+            "model": getattr(response, "model", None) or config.model_name
+        }
+        if cache is not None and answer:
+            await asyncio.to_thread(cache.store, kb_id, cache_key, query_embedding, result)
+        return result
+    
+    async def prepare(self,
+                      query: str,
+                      kb_id: Optional[int] = None,
+                      chat_history: List[Dict[str, str]] = None,
+                      provider: str = None,
+                      model: str = None,
+                      max_tokens: int = 1000,
+                      top_k: int = 5,
+                      search_mode: str = None,
+                      filters: MetadataFilter = None) -> Dict[str, Any]:
+        """检索知识库并在模型上下文窗口的token预算内组装提示词"""
+        config = self.llm_service.resolve_model(provider, model)
+        if not config:
+            raise ValueError(f"Model {model} not found")
+        model_name = config.model_name
+        
+        hits = []
+        if kb_id is not None and top_k > 0:
+            # 多取一些候选，去重后仍能保留top_k条
+            hits = await asyncio.to_thread(
+                self.rag_service.search, kb_id, query, top_k * max(1, RAG_CANDIDATE_MULTIPLIER), search_mode,
+                filters=filters
+            )
+        candidates = self._dedupe(hits)[:top_k]
+        
+        # 预算 = 上下文窗口 - 回答预留 - 安全余量 - 系统提示和问题
+        budget = self.llm_service.get_context_window(config) - max_tokens - RAG_CONTEXT_SAFETY_MARGIN
+        question_message = {"role": "user", "content": query}
+        budget -= count_message_tokens([{"role": "system", "content": RAG_SYSTEM_PROMPT}, question_message], model_name)
+        if budget < 0:
+            raise ValueError(f"问题过长，超出模型上下文窗口: model={model_name}")
+        
+        # 历史消息从新到旧放入，最多占用预算的一部分
+        history: List[Dict[str, str]] = []
+        history_budget = int(budget * RAG_HISTORY_BUDGET_RATIO)
+        history_tokens = 0
+        for message in reversed(self._history_without_query(chat_history, query)):
+            tokens = count_tokens(message["content"], model_name) + 4
+            if history_tokens + tokens > history_budget:
+                break
+            history.insert(0, {"role": message["role"], "content": message["content"]})
+            history_tokens += tokens
+        budget -= history_tokens
+        
+        # 按相关度从高到低装入资料，放不下的跳过，再按文档顺序排列
+        packed = []
+        for hit in candidates:
+            tokens = count_tokens(hit["text"], model_name) + 16
+            if tokens > budget:
+                continue
+            packed.append(hit)
+            budget -= tokens
+        packed.sort(key=lambda hit: (hit["doc_id"] is None, hit["doc_id"] or 0, hit["chunk_index"] or 0))
+        
+        sources = []
+        context_parts = []
+        for number, hit in enumerate(packed, start=1):
+            location = f"文档{hit['doc_id']}"
+            if hit["page_number"] is not None:
+                location += f" 第{hit['page_number']}页"
+            context_parts.append(f"[{number}] ({location})\n{hit['text']}")
+            sources.append({
+                "index": number,
+                "doc_id": hit["doc_id"],
+                "chunk_index": hit["chunk_index"],
+                "page_number": hit["page_number"],
+                "vector_id": hit["vector_id"],
+                "score": hit["score"],
+                "content": hit["content"]
+            })
+        
+        system_prompt = RAG_SYSTEM_PROMPT
+        if context_parts:
+            system_prompt += "\n\n参考资料:\n" + "\n\n".join(context_parts)
+        messages = [{"role": "system", "content": system_prompt}, *history, question_message]
+        
+        return {
+            "messages": messages,
+            "sources": sources,
+            "model_config": config,
+            "prompt_tokens": count_message_tokens(messages, model_name)
+        }
+    
+    @staticmethod
+    def _history_without_query(chat_history: Optional[List[Dict[str, str]]], query: str) -> List[Dict[str, str]]:
+        """去掉历史末尾与当前问题相同的用户消息（调用方通常已先保存了当前问题）"""
+        history = list(chat_history or [])
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == query:
+            history.pop()
+        return history
+    
+    @staticmethod
+    def _dedupe(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """去除内容重复的检索结果并保持检索（或重排序）给出的顺序，句子窗口分块使用窗口文本作为上下文"""
+        seen = set()
+        unique = []
+        for hit in hits:
+            metadata = hit.get("metadata") or {}
+            text = metadata.get("window") or hit["content"]
+            key = " ".join(text.split())
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            unique.append({
+                "vector_id": hit["vector_id"],
+                "content": hit["content"],
+                "text": text,
+                "score": hit["score"],
+                "doc_id": metadata.get("doc_id"),
+                "chunk_index": metadata.get("chunk_index"),
+                "page_number": metadata.get("page_number")
+            })
+        return unique
+    
     async def chat_with_knowledge(self, 
                                 question: str, 
                                 knowledge_base_id: int,
                                 chat_history: List[Dict[str, str]] = None,
                                 model_name: str = None,
-                                stream: bool = False) -> Any:
-        """基于知识库的聊天"""
-        
-        # TODO: 实现知识检索逻辑
-        # 1. 从知识库中检索相关文档
-        # 2. 构建上下文
-        # 3. 调用LLM生成回答
-        
-        # 临时实现：直接调用LLM
-        messages = []
-        if chat_history:
-            messages.extend(chat_history)
-        
-        messages.append({"role": "user", "content": question})
-        
+                                stream: bool = False,
+                                **kwargs) -> Any:
+        """基于知识库的聊天，返回原始的模型响应"""
+        prepared = await self.prepare(
+            query=question,
+            kb_id=knowledge_base_id,
+            chat_history=chat_history,
+            model=model_name,
+            max_tokens=kwargs.get("max_tokens", 1000),
+            top_k=kwargs.pop("top_k", 5)
+        )
+        return await self.complete(prepared, stream=stream, **kwargs)
+    
+    async def complete(self, prepared: Dict[str, Any], stream: bool = False, **kwargs) -> Any:
+        """用prepare()组装好的消息调用模型"""
+        config = prepared["model_config"]
         return await self.llm_service.chat_completion(
-            messages=messages,
-            model_name=model_name,
-            stream=stream
+            messages=prepared["messages"],
+            model_name=config.name,
+            provider=config.provider,
+            stream=stream,
+            **kwargs
         )
     
     async def stream_chat_with_knowledge(self, 
                                        question: str, 
                                        knowledge_base_id: int,
                                        chat_history: List[Dict[str, str]] = None,
-                                       model_name: str = None) -> AsyncGenerator[str, None]:
-        """流式聊天"""
-        response = await self.chat_with_knowledge(
-            question=question,
-            knowledge_base_id=knowledge_base_id,
-            chat_history=chat_history,
-            model_name=model_name,
-            stream=True
-        )
+                                       model_name: str = None,
+                                       prepared: Dict[str, Any] = None,
+                                       **kwargs) -> AsyncGenerator[str, None]:
+        """流式聊天，生成器被关闭（如客户端断开）时同时关闭上游的流式响应"""
+        if prepared is None:
+            prepared = await self.prepare(
+                query=question,
+                kb_id=knowledge_base_id,
+                chat_history=chat_history,
+                model=model_name,
+                max_tokens=kwargs.get("max_tokens", 1000),
+                top_k=kwargs.pop("top_k", 5)
+            )
+        response = await self.complete(prepared, stream=True, **kwargs)
         
-        async for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
\ No newline at end of file
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # 释放上游HTTP连接，避免客户端断开后模型继续生成
+            await response.response.aclose()
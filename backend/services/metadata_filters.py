@@ -0,0 +1,162 @@
+"""
+Metadata filters, restrict retrieval to documents with given tags, file types, IDs or dates
+
+Filters are evaluated inside the indexes before ranking: the vector store receives a
+metadata `where` clause and the keyword index restricts its posting lists with SQL, so
+a filtered search still returns up to `limit` hits instead of post-filtering a top-k.
+
+Document attributes are stored with every chunk. Tags are flattened into one boolean
+key per tag ("tag:<name>") and dates into integer timestamps, because the vector index
+only accepts scalar metadata values.
+"""
+
+from datetime import datetime, date
+from typing import List, Dict, Any, Optional, NamedTuple, Tuple, Union
+
+# Metadata key prefix of flattened tags
+TAG_PREFIX = "tag:"
+
+
+class MetadataFilterError(ValueError):
+    """Raised when a filter expression is invalid"""
+
+
+def _timestamp(value: Union[datetime, date, str, int, float, None]) -> Optional[int]:
+    """Convert a date, datetime, ISO string or epoch seconds into epoch seconds"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            raise MetadataFilterError(f"Invalid date: {value}")
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return int(value.timestamp())
+
+
+def normalize_tags(tags: Union[str, List[str], None]) -> List[str]:
+    """Tags as a list of stripped names, comma separated strings are split"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return sorted({str(tag).strip() for tag in tags if str(tag).strip()})
+
+
+def normalize_file_type(file_type: Optional[str]) -> Optional[str]:
+    """File type as a lowercase extension without the leading dot"""
+    if not file_type:
+        return None
+    return file_type.lower().lstrip(".")
+
+
+class MetadataFilter(NamedTuple):
+    """
+    Filter on document attributes, all given conditions must hold
+
+    tags: the document has every one of these tags
+    file_types: the document file type is one of these
+    doc_ids: the document ID is one of these
+    created_after / created_before: inclusive bounds on the document creation time, epoch seconds
+    """
+    tags: Tuple[str, ...] = ()
+    file_types: Tuple[str, ...] = ()
+    doc_ids: Tuple[int, ...] = ()
+    created_after: Optional[int] = None
+    created_before: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, filters: Optional[Dict[str, Any]]) -> Optional["MetadataFilter"]:
+        """
+        Build a filter from a request dictionary
+
+        Args:
+            filters: Dictionary with any of tags, file_types, doc_ids, created_after and created_before
+
+        Returns:
+            Filter, or None when no condition is given
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - set(cls._fields)
+        if unknown:
+            raise MetadataFilterError(f"Unsupported filter fields: {', '.join(sorted(unknown))}")
+        try:
+            metadata_filter = cls(
+                tags=tuple(normalize_tags(filters.get("tags"))),
+                file_types=tuple(sorted({normalize_file_type(t) for t in filters.get("file_types") or () if t})),
+                doc_ids=tuple(sorted({int(doc_id) for doc_id in filters.get("doc_ids") or ()})),
+                created_after=_timestamp(filters.get("created_after")),
+                created_before=_timestamp(filters.get("created_before"))
+            )
+        except (TypeError, ValueError) as e:
+            if isinstance(e, MetadataFilterError):
+                raise
+            raise MetadataFilterError(f"Invalid filter: {str(e)}")
+        return None if metadata_filter.is_empty else metadata_filter
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(self)
+
+    def to_where(self) -> Optional[Dict[str, Any]]:
+        """
+        Vector store metadata filter
+
+        Returns:
+            `where` clause, or None when there is no condition
+        """
+        conditions: List[Dict[str, Any]] = [{f"{TAG_PREFIX}{tag}": True} for tag in self.tags]
+        if self.file_types:
+            conditions.append({"file_type": {"$in": list(self.file_types)}})
+        if self.doc_ids:
+            conditions.append({"doc_id": {"$in": list(self.doc_ids)}})
+        if self.created_after is not None:
+            conditions.append({"created_at": {"$gte": self.created_after}})
+        if self.created_before is not None:
+            conditions.append({"created_at": {"$lte": self.created_before}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def document_attributes(doc: Any) -> Dict[str, Any]:
+    """
+    Filterable attributes of a document
+
+    Args:
+        doc: Document row
+
+    Returns:
+        Dictionary with file_type, created_at (epoch seconds) and tags
+    """
+    metadata = doc.doc_metadata or {}
+    file_type = doc.file_type or (doc.file_path.rsplit(".", 1)[-1] if doc.file_path and "." in doc.file_path else None)
+    return {
+        "file_type": normalize_file_type(file_type),
+        "created_at": _timestamp(doc.created_at),
+        "tags": normalize_tags(metadata.get("tags"))
+    }
+
+
+def attribute_metadata(attributes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Flatten document attributes into scalar vector metadata
+
+    Args:
+        attributes: Attributes as returned by document_attributes
+
+    Returns:
+        Metadata entries, one boolean per tag
+    """
+    if not attributes:
+        return {}
+    metadata: Dict[str, Any] = {f"{TAG_PREFIX}{tag}": True for tag in attributes.get("tags") or ()}
+    if attributes.get("file_type"):
+        metadata["file_type"] = attributes["file_type"]
+    if attributes.get("created_at") is not None:
+        metadata["created_at"] = attributes["created_at"]
+    return metadata
@@ -4,8 +4,10 @@ RAG Service, responsible for document processing, chunking, vectorization, and r
 
 import os
 import sys
-import uuid
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Iterator, Iterable
 import json
 
 try:
@@ -18,17 +20,239 @@ except ImportError:
         def get_logger(name):
             return logging.getLogger(name)
 
+try:
+    from .vector_store import VectorStore, get_vector_store
+    from .embedding_service import EmbeddingService, get_embedding_service, content_hash
+    from .text_extractors import extract_text
+    from .chunking import ChunkingConfig, get_chunker, estimate_tokens
+    from .keyword_index import KeywordIndex, get_keyword_index
+    from .reranker import RERANK_CANDIDATES, get_reranker, rerank
+    from .metadata_filters import MetadataFilter, TAG_PREFIX, attribute_metadata
+except ImportError:
+    from backend.services.vector_store import VectorStore, get_vector_store
+    from backend.services.embedding_service import EmbeddingService, get_embedding_service, content_hash
+    from backend.services.text_extractors import extract_text
+    from backend.services.chunking import ChunkingConfig, get_chunker, estimate_tokens
+    from backend.services.keyword_index import KeywordIndex, get_keyword_index
+    from backend.services.reranker import RERANK_CANDIDATES, get_reranker, rerank
+    from backend.services.metadata_filters import MetadataFilter, TAG_PREFIX, attribute_metadata
+
+logger = get_logger(__name__)
+
+# Retrieval mode: "vector", "keyword" (BM25) or "hybrid" (both, fused)
+SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "hybrid")
+# Fusion of hybrid results: "rrf" (reciprocal rank fusion) or "weighted" (normalized score blend)
+HYBRID_FUSION = os.getenv("RAG_HYBRID_FUSION", "rrf")
+# Rank constant of reciprocal rank fusion
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Weight of the vector score in weighted fusion, the keyword score gets the rest
+HYBRID_VECTOR_WEIGHT = float(os.getenv("RAG_HYBRID_VECTOR_WEIGHT", "0.5"))
+# Each retriever returns limit * multiplier candidates before fusion
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("RAG_HYBRID_CANDIDATE_MULTIPLIER", "4"))
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+# Threads shared by federated searches across knowledge bases
+FEDERATED_SEARCH_WORKERS = int(os.getenv("FEDERATED_SEARCH_WORKERS", "8"))
+# Time allowed for a whole federated search, in seconds, including time queued for a free thread
+FEDERATED_SEARCH_TIMEOUT = float(os.getenv("FEDERATED_SEARCH_TIMEOUT", "2.0"))
+
+_federated_executor: Optional[ThreadPoolExecutor] = None
+_federated_executor_lock = threading.Lock()
+
+def _get_federated_executor() -> ThreadPoolExecutor:
+    """Shared, bounded pool so searches that time out cannot pile up threads"""
+    global _federated_executor
+    if _federated_executor is None:
+        with _federated_executor_lock:
+            if _federated_executor is None:
+                _federated_executor = ThreadPoolExecutor(
+                    max_workers=FEDERATED_SEARCH_WORKERS, thread_name_prefix="federated-search"
+                )
+    return _federated_executor
+
+def chunk_vector_id(doc_id: int, chunk_index: int) -> str:
+    """Stable vector ID of a chunk, re-processing a document overwrites its vectors"""
+    return f"{doc_id}-{chunk_index}"
+
+def iter_document_chunks(
+    file_path: str,
+    doc_id: int,
+    kb_id: int,
+    kb_metadata: Optional[Dict[str, Any]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream chunks out of a document
+    
+    Text is pulled from the extractor block by block and chunked incrementally, so memory use
+    is bounded by the block size instead of the size of the document.
+    
+    Args:
+        file_path: Document path
+        doc_id: Document ID
+        kb_id: Knowledge base ID
+        kb_metadata: Knowledge base metadata selecting the chunking strategy, defaults apply when omitted
+        
+    Returns:
+        Iterator of chunk information, each chunk contains content, index, vector ID, page number and metadata
+    """
+    # Check if file exists
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File does not exist: {file_path}")
+    
+    file_ext = os.path.splitext(file_path)[1].lower()
+    config = ChunkingConfig.from_metadata(kb_metadata)
+    chunker = get_chunker(config)
+    
+    for chunk_index, chunk in enumerate(chunker.chunk(extract_text(file_path))):
+        metadata = {
+            "page_number": chunk.page_number,
+            "token_count": estimate_tokens(chunk.text),
+            "chunk_strategy": config.strategy,
+            "file_type": file_ext[1:],
+            "doc_id": doc_id,
+            "kb_id": kb_id
+        }
+        if chunk.metadata:
+            metadata.update(chunk.metadata)
+        yield {
+            "content": chunk.text,
+            "chunk_index": chunk_index,
+            "embedding_id": chunk_vector_id(doc_id, chunk_index),
+            "page_number": chunk.page_number,
+            "metadata": metadata
+        }
+
+def extract_chunks(
+    file_path: str,
+    doc_id: int,
+    kb_id: int,
+    kb_metadata: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Extract text from a document and split it into chunks
+    
+    This is the CPU-bound part of document processing. It only depends on its arguments,
+    so it can run in a worker process. Prefer iter_document_chunks for large documents.
+    
+    Args:
+        file_path: Document path
+        doc_id: Document ID
+        kb_id: Knowledge base ID
+        kb_metadata: Knowledge base metadata selecting the chunking strategy
+        
+    Returns:
+        List of chunk information, each chunk contains content, index, vector ID and metadata
+    """
+    return list(iter_document_chunks(file_path, doc_id, kb_id, kb_metadata))
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """
+    Hash of everything a chunk vector stores, so a re-processed chunk is re-indexed when either
+    its text, page or sentence window changed
+    """
+    window = (chunk.get("metadata") or {}).get("window") or ""
+    page_number = chunk.get("page_number")
+    if not window and page_number is None:
+        return content_hash(chunk["content"])
+    return content_hash(f"{chunk['content']}\x00{page_number}\x00{window}")
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked result lists by reciprocal rank, score = sum of 1 / (k + rank)
+
+    Only ranks are used, so retrievers with incomparable score scales (cosine similarity,
+    BM25) can be combined without calibration.
+
+    Args:
+        result_lists: Ranked hit lists, each hit has at least a vector_id
+        k: Rank constant, larger values flatten the contribution of top ranks
+
+    Returns:
+        Fused hits best first, the first occurrence of each vector ID keeps its other fields
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["vector_id"], {**hit, "score": 0.0})
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)
+
+def weighted_fusion(result_lists: List[List[Dict[str, Any]]], weights: List[float]) -> List[Dict[str, Any]]:
+    """
+    Fuse result lists by a weighted sum of min-max normalized scores
+
+    Args:
+        result_lists: Hit lists with a score per hit
+        weights: Weight of each list
+
+    Returns:
+        Fused hits best first
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for hits, weight in zip(result_lists, weights):
+        if not hits:
+            continue
+        scores = [hit["score"] for hit in hits]
+        low, high = min(scores), max(scores)
+        for hit in hits:
+            normalized = (hit["score"] - low) / (high - low) if high > low else 1.0
+            entry = fused.setdefault(hit["vector_id"], {**hit, "score": 0.0})
+            entry["score"] += weight * normalized
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)
+
+def federated_scores(hits: List[Dict[str, Any]], by_similarity: bool) -> List[Dict[str, Any]]:
+    """
+    Add a score comparable across knowledge bases to the hits of one knowledge base
+    
+    Cosine similarity of the same embedding model is comparable as is, so vector hits keep it.
+    BM25 depends on the corpus and fused or reranked scores on the candidate lists, so other
+    hits are scored by reciprocal rank within their knowledge base, which merges all knowledge
+    bases as one global reciprocal rank fusion. Min-max normalizing each list instead would
+    give every knowledge base's top hit 1.0, however poor its match.
+    
+    Args:
+        hits: Hits of one knowledge base, best first
+        by_similarity: Whether the hit scores are cosine similarities
+        
+    Returns:
+        Hits with "merged_score" added
+    """
+    return [
+        {**hit, "merged_score": hit["score"] if by_similarity else 1.0 / (RRF_K + rank)}
+        for rank, hit in enumerate(hits, start=1)
+    ]
+
 class RAGService:
     """
     RAG Service class, responsible for document processing, chunking, vectorization, and retrieval
     """
     
-    def __init__(self):
-        """Initialize RAG Service"""
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        embedding_service: Optional[EmbeddingService] = None,
+        keyword_index: Optional[KeywordIndex] = None
+    ):
+        """
+        Initialize RAG Service
+
+        Args:
+            vector_store: Vector store to use, defaults to the shared instance
+            embedding_service: Embedding service to use, defaults to the shared instance
+            keyword_index: Keyword index to use, defaults to the shared instance
+        """
         self.logger = get_logger(__name__)
         self.logger.info("Initializing RAG Service")
+        self.vector_store = vector_store or get_vector_store()
+        self.embedding_service = embedding_service or get_embedding_service()
+        self.keyword_index = keyword_index or get_keyword_index()
     
-    def process_document(self, file_path: str, doc_id: int, kb_id: int) -> List[Dict[str, Any]]:
+    def process_document(
+        self,
+        file_path: str,
+        doc_id: int,
+        kb_id: int,
+        kb_metadata: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
         """
         Process document: extract text, chunk, vectorize
         
@@ -36,59 +260,19 @@ class RAGService:
             file_path: Document path
             doc_id: Document ID
             kb_id: Knowledge base ID
+            kb_metadata: Knowledge base metadata selecting the chunking strategy
             
         Returns:
             List of chunk information, each chunk contains content, index, vector ID and metadata
         """
         self.logger.info(f"Processing document: doc_id={doc_id}, kb_id={kb_id}, path={file_path}")
         
-        # Check if file exists
-        if not os.path.exists(file_path):
-            self.logger.error(f"File does not exist: {file_path}")
-            return []
-        
-        # Get file type
-        file_ext = os.path.splitext(file_path)[1].lower()
-        
-        # Simple example: read text file and chunk by lines
-        # In a real application, different processing methods should be used based on file type
         try:
-            chunks = []
-            if file_ext in ['.txt', '.md']:
-                # Text files chunked by lines
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    
-                chunk_size = 5  # 5 lines per chunk
-                for i in range(0, len(lines), chunk_size):
-                    chunk_text = ''.join(lines[i:i+chunk_size]).strip()
-                    if chunk_text:
-                        # Generate unique vector ID
-                        embedding_id = str(uuid.uuid4())
-                        chunks.append({
-                            "content": chunk_text,
-                            "chunk_index": i // chunk_size,
-                            "embedding_id": embedding_id,
-                            "metadata": {
-                                "start_line": i,
-                                "end_line": min(i + chunk_size, len(lines)),
-                                "doc_id": doc_id,
-                                "kb_id": kb_id
-                            }
-                        })
-            else:
-                # Other file types: add a placeholder chunk
-                self.logger.warning(f"Unsupported file type: {file_ext}, adding placeholder chunk")
-                chunks.append({
-                    "content": f"File type {file_ext} content placeholder",
-                    "chunk_index": 0,
-                    "embedding_id": str(uuid.uuid4()),
-                    "metadata": {
-                        "file_type": file_ext[1:],
-                        "doc_id": doc_id,
-                        "kb_id": kb_id
-                    }
-                })
+            chunks = extract_chunks(file_path, doc_id, kb_id, kb_metadata)
+            
+            # Vectorize chunks in batches and write them into the knowledge base index
+            if chunks:
+                self.index_chunks(kb_id, doc_id, chunks)
                 
             self.logger.info(f"Document processing completed: doc_id={doc_id}, chunks={len(chunks)}")
             return chunks
@@ -97,64 +281,418 @@ class RAGService:
             self.logger.error(f"Error processing document: {str(e)}", exc_info=True)
             return []
     
-    def delete_document_chunks(self, doc_id: int) -> bool:
+    def index_chunks(
+        self,
+        kb_id: int,
+        doc_id: int,
+        chunks: List[Dict[str, Any]],
+        attributes: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Embed chunks and write them into the knowledge base index
+        
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            chunks: Chunk information as returned by process_document
+            attributes: Filterable document attributes, see metadata_filters.document_attributes
+            
+        Returns:
+            Number of vectors written
+        """
+        contents = [chunk["content"] for chunk in chunks]
+        vector_ids = [chunk["embedding_id"] for chunk in chunks]
+        embeddings = self.embedding_service.embed_texts(contents)
+        written = self.vector_store.upsert(
+            kb_id,
+            ids=vector_ids,
+            embeddings=embeddings,
+            documents=contents,
+            metadatas=[self._vector_metadata(doc_id, kb_id, chunk, attributes) for chunk in chunks]
+        )
+        self.keyword_index.add(kb_id, doc_id, list(zip(vector_ids, contents)), attributes)
+        return written
+    
+    @staticmethod
+    def _vector_metadata(
+        doc_id: int,
+        kb_id: int,
+        chunk: Dict[str, Any],
+        attributes: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Metadata stored with a chunk vector, the index only accepts non-null scalar values"""
+        chunk_metadata = chunk.get("metadata") or {}
+        metadata = {
+            "doc_id": doc_id,
+            "kb_id": kb_id,
+            "chunk_index": chunk["chunk_index"],
+            "content_hash": chunk_hash(chunk)
+        }
+        if chunk.get("page_number") is not None:
+            metadata["page_number"] = chunk["page_number"]
+        window = chunk_metadata.get("window")
+        if window:
+            metadata["window"] = window
+        if chunk_metadata.get("file_type"):
+            metadata["file_type"] = chunk_metadata["file_type"]
+        metadata.update(attribute_metadata(attributes))
+        return metadata
+    
+    def sync_document_chunks(
+        self,
+        kb_id: int,
+        doc_id: int,
+        chunks: Iterable[Dict[str, Any]],
+        attributes: Optional[Dict[str, Any]] = None,
+        batch_size: int = 512
+    ) -> Dict[str, int]:
+        """
+        Bring the index of a re-processed document up to date with its new chunks
+        
+        Chunks whose vector already holds the same content hash are skipped, changed and new
+        chunks are embedded and written, and vectors of chunks that no longer exist are removed
+        from the vector and keyword indexes. A first-time document simply has every chunk embedded.
+        
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            chunks: Chunk information as produced by iter_document_chunks, may be a generator
+            attributes: Filterable document attributes
+            batch_size: Chunks embedded per batch
+            
+        Returns:
+            Counts of embedded, unchanged and removed chunks
+        """
+        existing = {
+            vector_id: metadata.get("content_hash")
+            for vector_id, metadata in self.vector_store.list_metadata(kb_id, {"doc_id": doc_id}).items()
+        }
+        seen = set()
+        counts = {"embedded": 0, "unchanged": 0, "removed": 0}
+        batch: List[Dict[str, Any]] = []
+        for chunk in chunks:
+            vector_id = chunk["embedding_id"]
+            seen.add(vector_id)
+            if existing.get(vector_id) == chunk_hash(chunk):
+                counts["unchanged"] += 1
+                continue
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                counts["embedded"] += self.index_chunks(kb_id, doc_id, batch, attributes)
+                batch = []
+        if batch:
+            counts["embedded"] += self.index_chunks(kb_id, doc_id, batch, attributes)
+        
+        stale = [vector_id for vector_id in existing if vector_id not in seen]
+        if stale:
+            self.delete_chunks(kb_id, stale)
+            counts["removed"] = len(stale)
+        self.logger.info(f"Document index synchronized: doc_id={doc_id}, kb_id={kb_id}, {counts}")
+        return counts
+    
+    def delete_chunks(self, kb_id: int, vector_ids: List[str]) -> None:
+        """
+        Remove chunks from the vector and keyword indexes of a knowledge base
+        
+        Args:
+            kb_id: Knowledge base ID
+            vector_ids: Vector IDs of the chunks
+        """
+        self.vector_store.delete(kb_id, ids=vector_ids)
+        self.keyword_index.delete(kb_id, vector_ids)
+    
+    def update_document_attributes(self, kb_id: int, doc_id: int, attributes: Dict[str, Any]) -> int:
+        """
+        Update the filterable attributes of an indexed document, e.g. after its tags changed
+        
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            attributes: Document attributes, see metadata_filters.document_attributes
+            
+        Returns:
+            Number of vectors updated
+        """
+        updated = self.vector_store.update_metadata(
+            kb_id, {"doc_id": doc_id}, attribute_metadata(attributes), clear_prefix=TAG_PREFIX
+        )
+        self.keyword_index.set_document_attributes(kb_id, doc_id, attributes)
+        return updated
+    
+    def delete_document_chunks(self, doc_id: int, kb_id: Optional[int] = None) -> bool:
         """
         Delete all chunks of a document
         
         Args:
             doc_id: Document ID
+            kb_id: Knowledge base ID, all indexes are scanned when omitted
             
         Returns:
             Whether deletion was successful
         """
-        self.logger.info(f"Deleting document chunks: doc_id={doc_id}")
+        self.logger.info(f"Deleting document chunks: doc_id={doc_id}, kb_id={kb_id}")
         
-        # Simulate deleting records from vector database
-        # In a real application, this should call the vector database API
+        kb_ids = [kb_id] if kb_id is not None else self.vector_store.list_kb_ids()
+        for index_kb_id in kb_ids:
+            self.vector_store.delete(index_kb_id, where={"doc_id": doc_id})
+            self.keyword_index.delete_document(index_kb_id, doc_id)
         self.logger.info(f"Document chunks deleted from vector database: doc_id={doc_id}")
         
         return True
     
-    def search(self, kb_id: int, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    def search(
+        self,
+        kb_id: int,
+        query: str,
+        limit: int = 5,
+        mode: Optional[str] = None,
+        reranker: Optional[str] = None,
+        rerank_budget_ms: Optional[int] = None,
+        filters: Optional[MetadataFilter] = None
+    ) -> List[Dict[str, Any]]:
         """
         Search for content related to the query in the knowledge base
         
+        With a reranker, the first stage retrieves RERANK_CANDIDATES hits and the reranker
+        picks the top limit among them within the time budget.
+        
+        Args:
+            kb_id: Knowledge base ID
+            query: Query text
+            limit: Maximum number of results to return
+            mode: "vector", "keyword" or "hybrid", defaults to RAG_SEARCH_MODE
+            reranker: Reranker name, "none" to skip reranking, defaults to RERANKER
+            rerank_budget_ms: Time budget of the rerank stage, defaults to RERANK_BUDGET_MS
+            filters: Only chunks of documents matching the filter are retrieved, evaluated inside the indexes
+            
+        Returns:
+            List of related content best first, each item contains vector ID, content, score and metadata
+        """
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unsupported search mode: {mode}")
+        self.logger.info(f"Knowledge base search: kb_id={kb_id}, mode={mode}, query={query}")
+        
+        second_stage = get_reranker(reranker)
+        if second_stage is None:
+            return self._first_stage(kb_id, query, limit, mode, filters)
+        hits = self._first_stage(kb_id, query, max(limit, RERANK_CANDIDATES), mode, filters)
+        return rerank(second_stage, query, hits, limit, budget_ms=rerank_budget_ms)
+    
+    def _first_stage(
+        self,
+        kb_id: int,
+        query: str,
+        limit: int,
+        mode: str,
+        filters: Optional[MetadataFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """Retrieve candidates with the vector index, the keyword index or both"""
+        if mode == "vector":
+            return self.vector_search(kb_id, query, limit, filters)
+        if mode == "keyword":
+            return self.keyword_search(kb_id, query, limit, filters)
+        
+        depth = limit * max(1, HYBRID_CANDIDATE_MULTIPLIER)
+        vector_hits = self.vector_search(kb_id, query, depth, filters)
+        keyword_hits = self.keyword_search(kb_id, query, depth, filters)
+        if HYBRID_FUSION == "weighted":
+            fused = weighted_fusion([vector_hits, keyword_hits], [HYBRID_VECTOR_WEIGHT, 1 - HYBRID_VECTOR_WEIGHT])
+        else:
+            fused = reciprocal_rank_fusion([vector_hits, keyword_hits])
+        return fused[:limit]
+    
+    def federated_search(
+        self,
+        kb_ids: List[int],
+        query: str,
+        limit: int = 5,
+        mode: Optional[str] = None,
+        filters: Optional[MetadataFilter] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Search several knowledge bases in parallel and merge the results into one ranked list
+        
+        Each knowledge base is searched on the shared federated pool. The timeout is the total for
+        the request: it starts at submission, so when there are more knowledge bases than
+        FEDERATED_SEARCH_WORKERS, or the pool is busy with other requests, time spent waiting for
+        a thread counts against it. Knowledge bases that do not answer within the timeout are
+        left out (their search finishes in the background) and reported in timed_out, failures
+        are reported in failed. Hits are merged by federated_scores.
+        
+        Args:
+            kb_ids: Knowledge base IDs
+            query: Query text
+            limit: Maximum number of merged results to return
+            mode: Search mode of each knowledge base, see search
+            filters: Metadata filter applied in every knowledge base
+            timeout: Seconds allowed for the whole search, defaults to FEDERATED_SEARCH_TIMEOUT
+            
+        Returns:
+            Dictionary with results (hits carrying kb_id and merged_score, best first),
+            timed_out (knowledge base IDs) and failed (knowledge base ID to error message)
+        """
+        kb_ids = list(dict.fromkeys(kb_ids))
+        timeout = FEDERATED_SEARCH_TIMEOUT if timeout is None else timeout
+        mode = mode or SEARCH_MODE
+        self.logger.info(f"Federated search: kb_ids={kb_ids}, mode={mode}, query={query}")
+        
+        started = time.monotonic()
+        executor = _get_federated_executor()
+        futures = {
+            executor.submit(self.search, kb_id, query, limit, mode, filters=filters): kb_id
+            for kb_id in kb_ids
+        }
+        # One deadline for the whole request, queueing for a pool thread included
+        done, pending = wait(futures, timeout=timeout)
+        
+        merged: List[Dict[str, Any]] = []
+        failed: Dict[int, str] = {}
+        for future in done:
+            kb_id = futures[future]
+            try:
+                hits = future.result()
+            except Exception as e:
+                self.logger.error(f"Federated search failed: kb_id={kb_id}, error={str(e)}")
+                failed[kb_id] = str(e)
+                continue
+            by_similarity = mode == "vector" and not any("rerank_score" in hit for hit in hits)
+            merged.extend({**hit, "kb_id": kb_id} for hit in federated_scores(hits, by_similarity))
+        timed_out = sorted(futures[future] for future in pending)
+        for future in pending:
+            future.cancel()
+        if timed_out:
+            self.logger.warning(f"Federated search timed out: kb_ids={timed_out}, timeout={timeout}s")
+        
+        merged.sort(key=lambda hit: hit["merged_score"], reverse=True)
+        self.logger.info(
+            f"Federated search completed: kb_count={len(kb_ids)}, hits={len(merged)}, "
+            f"elapsed_ms={(time.monotonic() - started) * 1000:.0f}"
+        )
+        return {"results": merged[:limit], "timed_out": timed_out, "failed": failed}
+    
+    def vector_search(
+        self,
+        kb_id: int,
+        query: str,
+        limit: int = 5,
+        filters: Optional[MetadataFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Dense retrieval, nearest neighbours of the query embedding
+        
         Args:
             kb_id: Knowledge base ID
             query: Query text
             limit: Maximum number of results to return
+            filters: Metadata filter applied by the index before ranking
             
         Returns:
-            List of related content
+            List of hits with vector ID, content, similarity score and metadata
+        """
+        query_embedding = self.embedding_service.embed_query(query)
+        return self.vector_store.query(kb_id, query_embedding, limit, where=filters.to_where() if filters else None)
+    
+    def keyword_search(
+        self,
+        kb_id: int,
+        query: str,
+        limit: int = 5,
+        filters: Optional[MetadataFilter] = None
+    ) -> List[Dict[str, Any]]:
         """
-        self.logger.info(f"Knowledge base search: kb_id={kb_id}, query={query}")
+        Sparse retrieval, BM25 over the keyword index
         
-        # Simulate vector search
-        # In a real application, this should call the vector database API
+        Exact terms such as product codes, error IDs and names that embeddings tend to blur
+        are matched here. Chunk content and metadata are loaded from the vector store.
         
-        return [{
-            "content": f"Example search result {i} (query: {query})",
-            "score": 1.0 - i * 0.1,
-            "metadata": {
-                "doc_id": i + 1000,
-                "chunk_index": i
-            }
-        } for i in range(limit)]
+        Args:
+            kb_id: Knowledge base ID
+            query: Query text
+            limit: Maximum number of results to return
+            filters: Metadata filter applied to the posting lists before ranking
+            
+        Returns:
+            List of hits with vector ID, content, BM25 score and metadata
+        """
+        ranked = self.keyword_index.search(kb_id, query, limit, filters)
+        if not ranked:
+            return []
+        stored = {hit["vector_id"]: hit for hit in self.vector_store.get(kb_id, [hit["vector_id"] for hit in ranked])}
+        return [
+            {**stored[hit["vector_id"]], "score": hit["score"]}
+            for hit in ranked if hit["vector_id"] in stored
+        ]
     
-    def get_collection_stats(self) -> Dict[str, Any]:
+    def rebuild_keyword_index(self, kb_id: int, chunks: Iterator[Any]) -> int:
+        """
+        Rebuild the keyword index of a knowledge base, e.g. for knowledge bases indexed before it existed
+        
+        Args:
+            kb_id: Knowledge base ID
+            chunks: DocumentChunk rows, or any objects with document_id, vector_id and chunk_text
+            
+        Returns:
+            Number of chunks indexed
+        """
+        self.keyword_index.drop(kb_id)
+        count = 0
+        batch: List[Any] = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= 500:
+                count += self._index_keyword_batch(kb_id, batch)
+                batch = []
+        if batch:
+            count += self._index_keyword_batch(kb_id, batch)
+        self.logger.info(f"Keyword index rebuilt: kb_id={kb_id}, chunks={count}")
+        return count
+    
+    def _index_keyword_batch(self, kb_id: int, chunks: List[Any]) -> int:
+        """
+        Add a batch of stored chunks to the keyword index, one write per document
+        
+        Args:
+            kb_id: Knowledge base ID
+            chunks: DocumentChunk rows with document_id, vector_id and chunk_text
+            
+        Returns:
+            Number of chunks indexed
+        """
+        by_document: Dict[int, List[tuple]] = {}
+        for chunk in chunks:
+            by_document.setdefault(chunk.document_id, []).append((chunk.vector_id, chunk.chunk_text))
+        return sum(self.keyword_index.add(kb_id, doc_id, items) for doc_id, items in by_document.items())
+    
+    def get_collection_stats(self, kb_id: Optional[int] = None) -> Dict[str, Any]:
         """
         Get vector database statistics
         
+        Args:
+            kb_id: Knowledge base ID, statistics of all indexes are aggregated when omitted
+            
         Returns:
             Statistics information
         """
-        self.logger.info("Getting vector database statistics")
+        self.logger.info(f"Getting vector database statistics: kb_id={kb_id}")
+        
+        kb_ids = [kb_id] if kb_id is not None else self.vector_store.list_kb_ids()
+        collections = [
+            stats for stats in (self.vector_store.stats(index_kb_id) for index_kb_id in kb_ids)
+            if stats is not None
+        ]
         
-        # Simulate returning statistics
-        # In a real application, this should call the vector database API
         return {
-            "vector_count": 0,
-            "dimension": 1536,
+            "vector_count": sum(stats["vector_count"] for stats in collections),
+            "dimension": collections[0]["dimension"] if collections else self.embedding_service.dimension,
             "index_type": "HNSW",
+            "index_params": (
+                collections[0]["index_params"] if collections
+                else VectorStore.describe_params(VectorStore.index_params())
+            ),
+            "embedding_model": self.embedding_service.model_name,
+            "embedding_cache": self.embedding_service.cache.stats(),
+            "collections": collections,
             "status": "ready"
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,261 @@
+"""
+Rerankers, second-stage scoring of retrieved chunks against the query
+
+Retrieval casts a wide net (top-N); a reranker reads each query/chunk pair and picks
+the best top-k to send to the LLM. Candidates are scored in batches against a time
+budget, and the first-stage order is kept when the budget runs out.
+"""
+
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import List, Dict, Any, Optional, Type
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+try:
+    from .keyword_index import tokenize
+except ImportError:
+    from backend.services.keyword_index import tokenize
+
+logger = get_logger(__name__)
+
+# Reranker used by RAGService.search: "none" disables the stage, "lexical" or "cross-encoder"
+RERANKER = os.getenv("RERANKER", "none")
+# Number of first-stage candidates passed to the reranker
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+# Pairs scored per batch, the time budget is checked between batches
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Time budget of the rerank stage per request, in milliseconds
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "300"))
+# Model of the cross-encoder reranker
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-base")
+
+
+class Reranker(ABC):
+    """
+    Reranker interface
+    """
+
+    #: Name the reranker is registered under
+    name: str = ""
+
+    def prepare(self, query: str, passages: List[str]) -> Any:
+        """
+        Compute statistics over all candidates once, before they are scored in batches
+
+        Scores that depend on such statistics are only comparable across batches when every
+        batch uses the same ones.
+
+        Args:
+            query: Query text
+            passages: All candidate passages
+
+        Returns:
+            Statistics passed to every score call, None by default
+        """
+        return None
+
+    @abstractmethod
+    def score(self, query: str, passages: List[str], stats: Any = None) -> List[float]:
+        """
+        Score passages against a query
+
+        Args:
+            query: Query text
+            passages: Candidate passages
+            stats: Result of prepare over all candidates, rerankers that need it compute it
+                from passages when None
+
+        Returns:
+            Relevance score per passage, higher is better
+        """
+
+
+class LexicalReranker(Reranker):
+    """
+    Local lightweight reranker without a model
+
+    Combines how much of the query (weighted by term rarity among the candidates) a passage
+    covers with how many adjacent query terms appear next to each other in the passage,
+    which favours passages containing the query phrases over scattered term matches.
+    Term rarity is computed once over all candidates by prepare, not per batch.
+    """
+
+    name = "lexical"
+
+    #: Weight of phrase adjacency, the rest goes to weighted term coverage
+    phrase_weight = 0.3
+
+    def prepare(self, query: str, passages: List[str]) -> Dict[str, float]:
+        """Inverse document frequency of each query term among the candidates"""
+        query_terms = set(tokenize(query))
+        document_frequency = Counter(
+            term for passage in passages for term in set(tokenize(passage)) & query_terms
+        )
+        return {
+            term: math.log(1 + (len(passages) + 1) / (document_frequency[term] + 0.5))
+            for term in query_terms
+        }
+
+    def score(self, query: str, passages: List[str], stats: Optional[Dict[str, float]] = None) -> List[float]:
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return [0.0] * len(passages)
+        query_terms = set(query_tokens)
+        query_pairs = set(zip(query_tokens, query_tokens[1:]))
+        idf = stats if stats is not None else self.prepare(query, passages)
+        total_weight = sum(idf.values())
+
+        scores = []
+        for tokens in (tokenize(passage) for passage in passages):
+            coverage = sum(idf[term] for term in query_terms & set(tokens)) / total_weight
+            if query_pairs:
+                phrase = len(query_pairs & set(zip(tokens, tokens[1:]))) / len(query_pairs)
+            else:
+                phrase = coverage
+            scores.append((1 - self.phrase_weight) * coverage + self.phrase_weight * phrase)
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Cross-encoder reranker using sentence-transformers, the model is loaded on first use
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or RERANKER_MODEL
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Loading cross-encoder reranker: {self.model_name}")
+                    self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    def score(self, query: str, passages: List[str], stats: Any = None) -> List[float]:
+        if not passages:
+            return []
+        model = self._load()
+        return [float(score) for score in model.predict([(query, passage) for passage in passages])]
+
+
+_rerankers: Dict[str, Type[Reranker]] = {}
+_instances: Dict[str, Reranker] = {}
+_instances_lock = threading.Lock()
+
+
+def register_reranker(reranker_class: Type[Reranker]) -> None:
+    """
+    Register a reranker
+
+    Args:
+        reranker_class: Reranker subclass, registered under its name
+    """
+    _rerankers[reranker_class.name] = reranker_class
+    _instances.pop(reranker_class.name, None)
+
+
+for _reranker_class in (LexicalReranker, CrossEncoderReranker):
+    register_reranker(_reranker_class)
+
+
+def get_reranker(name: Optional[str] = None) -> Optional[Reranker]:
+    """
+    Get the shared instance of a reranker
+
+    Args:
+        name: Reranker name, defaults to RERANKER
+
+    Returns:
+        Reranker instance, or None when reranking is disabled
+    """
+    name = name or RERANKER
+    if name == "none":
+        return None
+    reranker = _instances.get(name)
+    if reranker is None:
+        reranker_class = _rerankers.get(name)
+        if reranker_class is None:
+            raise ValueError(f"Unsupported reranker: {name}")
+        with _instances_lock:
+            reranker = _instances.setdefault(name, reranker_class())
+    return reranker
+
+
+def rerank(
+    reranker: Reranker,
+    query: str,
+    hits: List[Dict[str, Any]],
+    limit: int,
+    budget_ms: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Rerank first-stage hits within a time budget
+
+    Pairs are scored in batches sharing the statistics of Reranker.prepare over all hits, so
+    scores from different batches are comparable. Before each batch the remaining budget is
+    compared with the time the previous batches took; if the next batch would not fit,
+    reranking is abandoned and the first-stage order is returned unchanged. The first batch
+    has nothing to predict from and always runs, so a single-batch call can overrun the
+    budget; such overruns are logged but the scores are kept.
+
+    Args:
+        reranker: Reranker to use
+        query: Query text
+        hits: First-stage hits, best first
+        limit: Number of hits to return
+        budget_ms: Time budget in milliseconds, defaults to RERANK_BUDGET_MS
+        batch_size: Pairs per batch, defaults to RERANK_BATCH_SIZE
+
+    Returns:
+        Top hits, with the reranker score in "rerank_score" when reranking completed
+    """
+    budget = (budget_ms if budget_ms is not None else RERANK_BUDGET_MS) / 1000.0
+    batch_size = max(1, batch_size or RERANK_BATCH_SIZE)
+    if len(hits) <= 1:
+        return hits[:limit]
+
+    started = time.monotonic()
+    stats = reranker.prepare(query, [hit["content"] for hit in hits])
+    scores: List[float] = []
+    batches = 0
+    for start in range(0, len(hits), batch_size):
+        elapsed = time.monotonic() - started
+        if batches and elapsed + elapsed / batches > budget:
+            logger.warning(
+                f"Rerank budget exceeded, keeping first-stage order: reranker={reranker.name}, "
+                f"scored={len(scores)}/{len(hits)}, elapsed_ms={elapsed * 1000:.0f}"
+            )
+            return hits[:limit]
+        passages = [hit["content"] for hit in hits[start:start + batch_size]]
+        scores.extend(reranker.score(query, passages, stats))
+        batches += 1
+
+    elapsed = time.monotonic() - started
+    if elapsed > budget:
+        logger.warning(
+            f"Rerank exceeded its budget: reranker={reranker.name}, batches={batches}, "
+            f"elapsed_ms={elapsed * 1000:.0f}, budget_ms={budget * 1000:.0f}"
+        )
+
+    order = sorted(range(len(hits)), key=lambda index: scores[index], reverse=True)
+    return [{**hits[index], "rerank_score": scores[index]} for index in order[:limit]]
@@ -0,0 +1,411 @@
+"""
+Text extractors, stream text out of documents page by page or block by block
+
+Every extractor is a generator, so callers only ever hold one block of text in memory
+regardless of the size of the file. Office formats are parsed with zipfile and
+incremental XML parsing instead of loading the whole document tree.
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from typing import Iterator, Dict, List, Optional, NamedTuple, Type
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+logger = get_logger(__name__)
+
+# Approximate maximum number of characters per yielded block
+EXTRACT_BLOCK_CHARS = int(os.getenv("EXTRACT_BLOCK_CHARS", "8192"))
+# Characters of an xlsx shared string table kept in memory, larger tables spill to a temporary file
+XLSX_SHARED_STRINGS_MEMORY_CHARS = int(os.getenv("XLSX_SHARED_STRINGS_MEMORY_CHARS", str(16 * 1024 * 1024)))
+
+# OOXML namespaces
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_S_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+class TextBlock(NamedTuple):
+    """A block of extracted text and the page (or slide/sheet) it came from"""
+    text: str
+    page_number: Optional[int] = None
+
+
+class UnsupportedFileTypeError(ValueError):
+    """Raised when no extractor is registered for a file type"""
+
+
+class TextExtractor(ABC):
+    """
+    Text extractor interface
+    """
+
+    #: File extensions handled by the extractor, including the leading dot
+    extensions: tuple = ()
+
+    @abstractmethod
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        """
+        Stream text blocks out of a file
+
+        Args:
+            file_path: File path
+
+        Returns:
+            Iterator of text blocks in document order
+        """
+
+
+class PlainTextExtractor(TextExtractor):
+    """
+    Plain text and markdown, read line by line
+    """
+
+    extensions = (".txt", ".md")
+
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        encoding = self._detect_encoding(file_path)
+        buffer: List[str] = []
+        size = 0
+        with open(file_path, "r", encoding=encoding, errors="replace") as f:
+            for line in f:
+                buffer.append(line)
+                size += len(line)
+                if size >= EXTRACT_BLOCK_CHARS:
+                    yield TextBlock("".join(buffer))
+                    buffer, size = [], 0
+        if buffer:
+            yield TextBlock("".join(buffer))
+
+    @staticmethod
+    def _detect_encoding(file_path: str) -> str:
+        """Guess the encoding from the first 64 KB of the file"""
+        with open(file_path, "rb") as f:
+            sample = f.read(65536)
+        try:
+            sample.decode("utf-8")
+            return "utf-8-sig" if sample.startswith(b"\xef\xbb\xbf") else "utf-8"
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut off at the end of the sample is still valid UTF-8
+            if e.start >= len(sample) - 3:
+                return "utf-8"
+        try:
+            import chardet
+            return chardet.detect(sample).get("encoding") or "gb18030"
+        except ImportError:
+            return "gb18030"
+
+
+class PdfExtractor(TextExtractor):
+    """
+    PDF, one block per page using pypdf
+    """
+
+    extensions = (".pdf",)
+
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        from pypdf import PdfReader
+
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            for page_number, page in enumerate(reader.pages, start=1):
+                try:
+                    text = page.extract_text() or ""
+                except Exception as e:
+                    logger.warning(f"PDF page extraction failed: path={file_path}, page={page_number}, error={str(e)}")
+                    continue
+                if text.strip():
+                    yield TextBlock(text, page_number)
+
+
+class DocxExtractor(TextExtractor):
+    """
+    Word (.docx), paragraphs streamed from word/document.xml
+    """
+
+    extensions = (".docx",)
+
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        with zipfile.ZipFile(file_path) as archive:
+            with archive.open("word/document.xml") as xml_file:
+                yield from _blocks(self._paragraphs(xml_file))
+
+    @staticmethod
+    def _paragraphs(xml_file) -> Iterator[str]:
+        parts: List[str] = []
+        for elem in _iterparse(xml_file, prune_tags={f"{_W_NS}p"}):
+            if elem.tag == f"{_W_NS}t" and elem.text:
+                parts.append(elem.text)
+            elif elem.tag == f"{_W_NS}tab":
+                parts.append("\t")
+            elif elem.tag == f"{_W_NS}p":
+                if parts:
+                    yield "".join(parts) + "\n"
+                parts = []
+
+
+class PptxExtractor(TextExtractor):
+    """
+    PowerPoint (.pptx), one block per slide
+    """
+
+    extensions = (".pptx",)
+
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        with zipfile.ZipFile(file_path) as archive:
+            for slide_number, name in _numbered_members(archive, r"ppt/slides/slide(\d+)\.xml"):
+                with archive.open(name) as xml_file:
+                    lines: List[str] = []
+                    parts: List[str] = []
+                    for elem in _iterparse(xml_file, prune_tags={f"{_A_NS}p"}):
+                        if elem.tag == f"{_A_NS}t" and elem.text:
+                            parts.append(elem.text)
+                        elif elem.tag == f"{_A_NS}p":
+                            if parts:
+                                lines.append("".join(parts))
+                            parts = []
+                    if lines:
+                        yield TextBlock("\n".join(lines), slide_number)
+
+
+class SharedStrings:
+    """
+    Shared string table of an xlsx workbook, looked up by index while the sheets are read
+
+    Cells refer to their text by index into one table for the whole workbook, so it has to be
+    available while every sheet is streamed. Up to memory_chars characters it is a list; a
+    larger table moves to an indexed temporary SQLite file, keeping memory bounded for
+    workbooks with millions of distinct strings.
+    """
+
+    def __init__(self, memory_chars: int = XLSX_SHARED_STRINGS_MEMORY_CHARS):
+        self.memory_chars = memory_chars
+        self._strings: List[str] = []
+        self._chars = 0
+        self._count = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[str] = None
+        self._pending: List[tuple] = []
+
+    def append(self, text: str) -> None:
+        if self._db is None:
+            self._strings.append(text)
+            self._chars += len(text)
+            if self._chars > self.memory_chars:
+                self._spill()
+        else:
+            self._pending.append((self._count, text))
+            if len(self._pending) >= 10000:
+                self._flush()
+        self._count += 1
+
+    def _spill(self) -> None:
+        fd, self._db_path = tempfile.mkstemp(prefix="xlsx-strings-", suffix=".sqlite3")
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE strings (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+        self._pending = list(enumerate(self._strings))
+        self._strings = []
+        self._flush()
+
+    def _flush(self) -> None:
+        self._db.executemany("INSERT INTO strings (id, text) VALUES (?, ?)", self._pending)
+        self._db.commit()
+        self._pending = []
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> str:
+        if self._db is None:
+            return self._strings[index]
+        if self._pending:
+            self._flush()
+        row = self._db.execute("SELECT text FROM strings WHERE id = ?", (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return row[0]
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._db_path)
+
+    def __enter__(self) -> "SharedStrings":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class XlsxExtractor(TextExtractor):
+    """
+    Excel (.xlsx), rows streamed sheet by sheet as tab separated lines
+    """
+
+    extensions = (".xlsx",)
+
+    def extract(self, file_path: str) -> Iterator[TextBlock]:
+        with zipfile.ZipFile(file_path) as archive, self._shared_strings(archive) as shared_strings:
+            for sheet_number, name in _numbered_members(archive, r"xl/worksheets/sheet(\d+)\.xml"):
+                with archive.open(name) as xml_file:
+                    for block in _blocks(self._rows(xml_file, shared_strings)):
+                        yield TextBlock(block.text, sheet_number)
+
+    @staticmethod
+    def _shared_strings(archive: zipfile.ZipFile) -> SharedStrings:
+        """Read the shared string table, see SharedStrings for how large tables are kept"""
+        strings = SharedStrings()
+        try:
+            xml_file = archive.open("xl/sharedStrings.xml")
+        except KeyError:
+            return strings
+        try:
+            with xml_file:
+                parts: List[str] = []
+                for elem in _iterparse(xml_file, prune_tags={f"{_S_NS}si"}):
+                    if elem.tag == f"{_S_NS}t" and elem.text:
+                        parts.append(elem.text)
+                    elif elem.tag == f"{_S_NS}si":
+                        strings.append("".join(parts))
+                        parts = []
+        except BaseException:
+            strings.close()
+            raise
+        return strings
+
+    @staticmethod
+    def _rows(xml_file, shared_strings: SharedStrings) -> Iterator[str]:
+        cells: List[str] = []
+        value = None
+        inline: List[str] = []
+        for elem in _iterparse(xml_file, prune_tags={f"{_S_NS}row"}):
+            if elem.tag == f"{_S_NS}v":
+                value = elem.text
+            elif elem.tag == f"{_S_NS}t" and elem.text:
+                inline.append(elem.text)
+            elif elem.tag == f"{_S_NS}c":
+                cell_type = elem.get("t")
+                if cell_type == "s" and value is not None:
+                    try:
+                        cells.append(shared_strings[int(value)])
+                    except (ValueError, IndexError):
+                        pass
+                elif cell_type == "inlineStr":
+                    cells.append("".join(inline))
+                elif value is not None:
+                    cells.append(value)
+                value = None
+                inline = []
+            elif elem.tag == f"{_S_NS}row":
+                if any(cell.strip() for cell in cells):
+                    yield "\t".join(cells) + "\n"
+                cells = []
+
+
+def _iterparse(xml_file, prune_tags: set) -> Iterator[ET.Element]:
+    """
+    Incrementally parse XML, yielding elements as they are closed
+
+    Elements whose tag is in prune_tags are detached from their parent once the caller
+    has processed them, so the partially built tree never grows with the document.
+    """
+    stack: List[ET.Element] = []
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        yield elem
+        if elem.tag in prune_tags and stack:
+            stack[-1].remove(elem)
+
+
+def _numbered_members(archive: zipfile.ZipFile, pattern: str) -> List[tuple]:
+    """Archive members matching pattern, ordered by their numeric suffix"""
+    regex = re.compile(pattern)
+    members = []
+    for name in archive.namelist():
+        match = regex.fullmatch(name)
+        if match:
+            members.append((int(match.group(1)), name))
+    return sorted(members)
+
+
+def _blocks(pieces: Iterator[str]) -> Iterator[TextBlock]:
+    """Group small text pieces into blocks of about EXTRACT_BLOCK_CHARS characters"""
+    buffer: List[str] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXTRACT_BLOCK_CHARS:
+            yield TextBlock("".join(buffer))
+            buffer, size = [], 0
+    if buffer:
+        yield TextBlock("".join(buffer))
+
+
+_extractors: Dict[str, TextExtractor] = {}
+
+
+def register_extractor(extractor_class: Type[TextExtractor]) -> None:
+    """
+    Register an extractor for the file extensions it declares
+
+    Args:
+        extractor_class: TextExtractor subclass
+    """
+    extractor = extractor_class()
+    for extension in extractor.extensions:
+        _extractors[extension] = extractor
+
+
+for _extractor_class in (PlainTextExtractor, PdfExtractor, DocxExtractor, PptxExtractor, XlsxExtractor):
+    register_extractor(_extractor_class)
+
+
+def get_extractor(file_ext: str) -> TextExtractor:
+    """
+    Get the extractor of a file type
+
+    Args:
+        file_ext: File extension including the leading dot
+
+    Returns:
+        Registered extractor
+    """
+    extractor = _extractors.get(file_ext.lower())
+    if extractor is None:
+        raise UnsupportedFileTypeError(f"Unsupported file type: {file_ext}")
+    return extractor
+
+
+def extract_text(file_path: str) -> Iterator[TextBlock]:
+    """
+    Stream text blocks out of a file, choosing the extractor by extension
+
+    Args:
+        file_path: File path
+
+    Returns:
+        Iterator of text blocks
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    return get_extractor(file_ext).extract(file_path)
@@ -0,0 +1,274 @@
+"""
+Upload service, resumable multi-part uploads for large files
+
+A client opens an upload session with the file name and total size, sends the content in
+parts of any size with the byte offset each part starts at, and completes the session once
+every byte has arrived. Parts are streamed straight to a partial file on disk, so memory use
+does not depend on the file size, and an interrupted upload resumes from the offset reported
+by the session status. Completed uploads are moved into the content-addressed blob store.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
+
+from ..services.blob_store import get_blob_store, BLOB_READ_SIZE, UploadTooLargeError
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+# Session limits, overridable through environment variables
+MAX_RESUMABLE_UPLOAD_SIZE = int(os.getenv("MAX_RESUMABLE_UPLOAD_SIZE", str(10 * 1024 * 1024 * 1024)))
+# Part size suggested to clients, parts of any size are accepted
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+# Sessions without activity for this long are discarded
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+
+class UploadSessionError(ValueError):
+    """Raised when an upload session does not exist or a part cannot be accepted"""
+
+
+class UploadNotFoundError(UploadSessionError):
+    """Raised for an unknown, expired or foreign upload session"""
+
+
+class UploadOffsetError(UploadSessionError):
+    """Raised when a part does not start where the received content ends"""
+
+    def __init__(self, message: str, received: int):
+        super().__init__(message)
+        self.received = received
+
+
+class UploadService:
+    """
+    Upload service class, keeps resumable upload sessions as a partial file and a JSON state file
+    """
+
+    def __init__(self, session_dir: Optional[str] = None):
+        """
+        Initialize upload service
+
+        Args:
+            session_dir: Directory holding the sessions, defaults to uploads/ inside the blob store
+                temporary directory so completed files can be moved into place without copying
+        """
+        self.logger = get_logger(__name__)
+        self.session_dir = session_dir or os.path.join(get_blob_store().tmp_dir, "uploads")
+        os.makedirs(self.session_dir, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadNotFoundError("Upload session does not exist")
+        base = os.path.join(self.session_dir, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _load(self, upload_id: str, user_id: int) -> Dict[str, Any]:
+        state_path, part_path = self._paths(upload_id)
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise UploadNotFoundError("Upload session does not exist")
+        if state["user_id"] != user_id:
+            raise UploadNotFoundError("Upload session does not exist")
+        state["received"] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return state
+
+    def create(self, user_id: int, filename: str, size: int) -> Dict[str, Any]:
+        """
+        Open an upload session
+
+        Args:
+            user_id: Uploading user
+            filename: Original file name
+            size: Total size in bytes
+
+        Returns:
+            Session state with upload_id, received bytes and suggested part size
+        """
+        if size < 0:
+            raise UploadSessionError("Invalid upload size")
+        if MAX_RESUMABLE_UPLOAD_SIZE and size > MAX_RESUMABLE_UPLOAD_SIZE:
+            raise UploadTooLargeError(f"File exceeds the upload limit of {MAX_RESUMABLE_UPLOAD_SIZE} bytes")
+        self.purge_expired()
+
+        upload_id = uuid.uuid4().hex
+        state_path, part_path = self._paths(upload_id)
+        state = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "filename": filename,
+            "size": size,
+            "created_at": time.time()
+        }
+        open(part_path, "wb").close()
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        self.logger.info(f"Upload session opened: upload_id={upload_id}, size={size}")
+        return {**state, "received": 0, "part_size": UPLOAD_PART_SIZE}
+
+    def status(self, upload_id: str, user_id: int) -> Dict[str, Any]:
+        """
+        Session state, the received byte count is the offset to resume from
+
+        Args:
+            upload_id: Upload session ID
+            user_id: Uploading user
+
+        Returns:
+            Session state
+        """
+        return {**self._load(upload_id, user_id), "part_size": UPLOAD_PART_SIZE}
+
+    async def append(self, upload_id: str, user_id: int, offset: int, stream: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Append a part streamed from the request body
+
+        Args:
+            upload_id: Upload session ID
+            user_id: Uploading user
+            offset: Byte offset the part starts at, must equal the bytes received so far
+            stream: Async iterator of the part content
+
+        Returns:
+            Session state after the part
+        """
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            state = await asyncio.to_thread(self._load, upload_id, user_id)
+            if offset != state["received"]:
+                raise UploadOffsetError(f"Part must start at offset {state['received']}", state["received"])
+
+            state_path, part_path = self._paths(upload_id)
+            received = state["received"]
+            # File I/O runs in threads so the event loop never waits on the disk; request body blocks
+            # are gathered into BLOB_READ_SIZE writes. Content received before a disconnect is kept,
+            # the client resumes from the reported offset
+            part = await asyncio.to_thread(open, part_path, "ab")
+            buffer = bytearray()
+            try:
+                async for block in stream:
+                    if received + len(buffer) + len(block) > state["size"]:
+                        raise UploadTooLargeError("Part exceeds the declared upload size")
+                    buffer += block
+                    if len(buffer) >= BLOB_READ_SIZE:
+                        await asyncio.to_thread(part.write, buffer)
+                        received += len(buffer)
+                        buffer = bytearray()
+            finally:
+                # Content that arrived before an error or disconnect is written too
+                if buffer:
+                    await asyncio.to_thread(part.write, buffer)
+                    received += len(buffer)
+                await asyncio.to_thread(part.close)
+            await asyncio.to_thread(os.utime, state_path, None)
+            state["received"] = received
+            return {**state, "part_size": UPLOAD_PART_SIZE}
+
+    def complete(self, upload_id: str, user_id: int) -> Tuple[str, int, str, str]:
+        """
+        Finish a session whose content has fully arrived and move it into the blob store
+
+        Args:
+            upload_id: Upload session ID
+            user_id: Uploading user
+
+        Returns:
+            (blob path, size, SHA-256, original file name)
+        """
+        state = self._load(upload_id, user_id)
+        if state["received"] != state["size"]:
+            raise UploadOffsetError(
+                f"Upload incomplete: {state['received']} of {state['size']} bytes received", state["received"]
+            )
+
+        state_path, part_path = self._paths(upload_id)
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as part:
+            for block in iter(lambda: part.read(BLOB_READ_SIZE), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        ext = os.path.splitext(state["filename"])[1].lower()
+        path = get_blob_store().commit(part_path, sha256, ext)
+        os.remove(state_path)
+        self._locks.pop(upload_id, None)
+        self.logger.info(f"Upload session completed: upload_id={upload_id}, sha256={sha256}")
+        return path, state["size"], sha256, state["filename"]
+
+    def abort(self, upload_id: str, user_id: int) -> None:
+        """
+        Discard a session and its received content
+
+        Args:
+            upload_id: Upload session ID
+            user_id: Uploading user
+        """
+        self._load(upload_id, user_id)
+        self._remove(upload_id)
+
+    def purge_expired(self) -> int:
+        """
+        Discard sessions without activity for UPLOAD_SESSION_TTL_SECONDS
+
+        Returns:
+            Number of sessions discarded
+        """
+        cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        purged = 0
+        for name in os.listdir(self.session_dir):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            state_path, part_path = self._paths(upload_id)
+            try:
+                last_active = max(
+                    os.path.getmtime(path) for path in (state_path, part_path) if os.path.exists(path)
+                )
+            except ValueError:
+                continue
+            if last_active < cutoff:
+                self._remove(upload_id)
+                purged += 1
+        return purged
+
+    def _remove(self, upload_id: str) -> None:
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._locks.pop(upload_id, None)
+
+
+_upload_service: Optional[UploadService] = None
+_upload_service_lock = threading.Lock()
+
+
+def get_upload_service() -> UploadService:
+    """
+    Get the process-wide upload service instance
+
+    Returns:
+        Shared UploadService
+    """
+    global _upload_service
+    if _upload_service is None:
+        with _upload_service_lock:
+            if _upload_service is None:
+                _upload_service = UploadService()
+    return _upload_service
@@ -0,0 +1,384 @@
+"""
+Vector store, an embedded and persistent HNSW index with one collection per knowledge base
+"""
+
+import os
+import threading
+from typing import List, Dict, Any, Optional
+
+import chromadb
+from chromadb.config import Settings
+
+try:
+    from ..logger import get_logger
+except ImportError:
+    try:
+        from backend.logger import get_logger
+    except ImportError:
+        import logging
+        def get_logger(name):
+            return logging.getLogger(name)
+
+# Index location and HNSW build parameters, overridable through environment variables
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "files/vector_store")
+HNSW_SPACE = os.getenv("HNSW_SPACE", "cosine")
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "200"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "128"))
+HNSW_NUM_THREADS = int(os.getenv("HNSW_NUM_THREADS", str(os.cpu_count() or 4)))
+
+COLLECTION_PREFIX = "kb_"
+
+
+class VectorStore:
+    """
+    Vector store class, keeps one HNSW collection per knowledge base on local disk
+    """
+
+    def __init__(self, persist_dir: Optional[str] = None):
+        """
+        Initialize vector store
+
+        Args:
+            persist_dir: Directory holding the index files, defaults to VECTOR_STORE_DIR
+        """
+        self.logger = get_logger(__name__)
+        self.persist_dir = persist_dir or VECTOR_STORE_DIR
+        os.makedirs(self.persist_dir, exist_ok=True)
+
+        self.logger.info(f"Opening vector store: path={self.persist_dir}")
+        self._client = chromadb.PersistentClient(
+            path=self.persist_dir,
+            settings=Settings(anonymized_telemetry=False)
+        )
+        self._collections: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def index_params() -> Dict[str, Any]:
+        """
+        HNSW build and search parameters used for new collections
+
+        Returns:
+            Parameter dictionary in collection metadata format
+        """
+        return {
+            "hnsw:space": HNSW_SPACE,
+            "hnsw:M": HNSW_M,
+            "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+            "hnsw:search_ef": HNSW_SEARCH_EF,
+            "hnsw:num_threads": HNSW_NUM_THREADS,
+        }
+
+    def _collection(self, kb_id: int, dimension: Optional[int] = None, create: bool = True):
+        """
+        Get (and optionally create) the collection of a knowledge base
+
+        Args:
+            kb_id: Knowledge base ID
+            dimension: Embedding dimension, recorded when the collection is created
+            create: Whether to create the collection if it does not exist
+
+        Returns:
+            Collection object, or None if it does not exist and create is False
+        """
+        collection = self._collections.get(kb_id)
+        if collection is not None:
+            return collection
+
+        with self._lock:
+            collection = self._collections.get(kb_id)
+            if collection is not None:
+                return collection
+
+            name = f"{COLLECTION_PREFIX}{kb_id}"
+            if create:
+                metadata = self.index_params()
+                metadata["kb_id"] = kb_id
+                if dimension:
+                    metadata["dimension"] = dimension
+                collection = self._client.get_or_create_collection(
+                    name=name,
+                    metadata=metadata,
+                    embedding_function=None
+                )
+            else:
+                try:
+                    collection = self._client.get_collection(name=name, embedding_function=None)
+                except ValueError:
+                    return None
+
+            self._collections[kb_id] = collection
+            return collection
+
+    def upsert(
+        self,
+        kb_id: int,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> int:
+        """
+        Insert or update vectors in the knowledge base index
+
+        Args:
+            kb_id: Knowledge base ID
+            ids: Vector IDs
+            embeddings: Embedding vectors
+            documents: Chunk texts stored alongside the vectors
+            metadatas: Metadata of each vector
+
+        Returns:
+            Number of vectors written
+        """
+        if not ids:
+            return 0
+
+        collection = self._collection(kb_id, dimension=len(embeddings[0]))
+        batch_size = self._client.max_batch_size
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=documents[start:end] if documents else None,
+                metadatas=metadatas[start:end] if metadatas else None
+            )
+        return len(ids)
+
+    def query(
+        self,
+        kb_id: int,
+        embedding: List[float],
+        limit: int = 5,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Approximate nearest neighbour search in a knowledge base index
+
+        Args:
+            kb_id: Knowledge base ID
+            embedding: Query embedding
+            limit: Maximum number of results to return
+            where: Optional metadata filter
+
+        Returns:
+            List of hits with vector ID, content, similarity score and metadata
+        """
+        collection = self._collection(kb_id, create=False)
+        if collection is None or limit <= 0:
+            return []
+
+        result = collection.query(
+            query_embeddings=[embedding],
+            n_results=limit,
+            where=where or None,
+            include=["documents", "metadatas", "distances"]
+        )
+
+        hits = []
+        for vector_id, content, metadata, distance in zip(
+            result["ids"][0],
+            result["documents"][0],
+            result["metadatas"][0],
+            result["distances"][0]
+        ):
+            hits.append({
+                "vector_id": vector_id,
+                "content": content,
+                "score": self._similarity(distance),
+                "metadata": metadata or {}
+            })
+        return hits
+
+    def get(self, kb_id: int, ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetch stored chunks by vector ID
+
+        Args:
+            kb_id: Knowledge base ID
+            ids: Vector IDs
+
+        Returns:
+            List of hits with vector ID, content and metadata, in the order of ids; unknown IDs are skipped
+        """
+        collection = self._collection(kb_id, create=False)
+        if collection is None or not ids:
+            return []
+
+        result = collection.get(ids=ids, include=["documents", "metadatas"])
+        found = {
+            vector_id: {"vector_id": vector_id, "content": content, "metadata": metadata or {}}
+            for vector_id, content, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        }
+        return [found[vector_id] for vector_id in ids if vector_id in found]
+
+    def list_metadata(self, kb_id: int, where: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Metadata of the vectors matching a filter, without loading embeddings or documents
+
+        Args:
+            kb_id: Knowledge base ID
+            where: Metadata filter selecting the vectors
+
+        Returns:
+            Mapping of vector ID to metadata
+        """
+        collection = self._collection(kb_id, create=False)
+        if collection is None:
+            return {}
+        result = collection.get(where=where, include=["metadatas"])
+        return {vector_id: metadata or {} for vector_id, metadata in zip(result["ids"], result["metadatas"])}
+
+    def update_metadata(
+        self,
+        kb_id: int,
+        where: Dict[str, Any],
+        changes: Dict[str, Any],
+        clear_prefix: Optional[str] = None
+    ) -> int:
+        """
+        Update the metadata of the vectors matching a filter, embeddings are left untouched
+
+        Args:
+            kb_id: Knowledge base ID
+            where: Metadata filter selecting the vectors
+            changes: Metadata entries to set
+            clear_prefix: Boolean flags with this prefix that are not in changes are set to False
+
+        Returns:
+            Number of vectors updated
+        """
+        collection = self._collection(kb_id, create=False)
+        if collection is None:
+            return 0
+
+        result = collection.get(where=where, include=["metadatas"])
+        if not result["ids"]:
+            return 0
+        metadatas = []
+        for metadata in result["metadatas"]:
+            # Updates merge into the stored metadata and keys cannot be removed, so stale flags are switched off
+            update = {
+                key: False for key, value in (metadata or {}).items()
+                if clear_prefix and key.startswith(clear_prefix) and value is True and key not in changes
+            }
+            update.update(changes)
+            metadatas.append(update)
+        if any(metadatas):
+            collection.update(ids=result["ids"], metadatas=metadatas)
+        return len(result["ids"])
+
+    def delete(self, kb_id: int, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Delete vectors from a knowledge base index
+
+        Args:
+            kb_id: Knowledge base ID
+            ids: Vector IDs to delete
+            where: Metadata filter selecting the vectors to delete
+        """
+        if not ids and not where:
+            return
+        collection = self._collection(kb_id, create=False)
+        if collection is None:
+            return
+        collection.delete(ids=ids or None, where=where or None)
+
+    def drop(self, kb_id: int) -> None:
+        """
+        Drop the whole index of a knowledge base
+
+        Args:
+            kb_id: Knowledge base ID
+        """
+        with self._lock:
+            self._collections.pop(kb_id, None)
+            try:
+                self._client.delete_collection(name=f"{COLLECTION_PREFIX}{kb_id}")
+            except ValueError:
+                pass
+
+    def list_kb_ids(self) -> List[int]:
+        """
+        List knowledge bases that have an index
+
+        Returns:
+            Knowledge base IDs
+        """
+        kb_ids = []
+        for collection in self._client.list_collections():
+            if collection.name.startswith(COLLECTION_PREFIX):
+                try:
+                    kb_ids.append(int(collection.name[len(COLLECTION_PREFIX):]))
+                except ValueError:
+                    continue
+        return kb_ids
+
+    def stats(self, kb_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get statistics of a knowledge base index
+
+        Args:
+            kb_id: Knowledge base ID
+
+        Returns:
+            Vector count, dimension and build parameters, or None if the index does not exist
+        """
+        collection = self._collection(kb_id, create=False)
+        if collection is None:
+            return None
+
+        metadata = collection.metadata or {}
+        return {
+            "kb_id": kb_id,
+            "vector_count": collection.count(),
+            "dimension": metadata.get("dimension"),
+            "index_type": "HNSW",
+            "index_params": self.describe_params(metadata)
+        }
+
+    @staticmethod
+    def describe_params(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extract HNSW parameters from collection metadata
+
+        Args:
+            metadata: Collection metadata
+
+        Returns:
+            Parameters without the "hnsw:" prefix
+        """
+        return {
+            key.split(":", 1)[1]: value
+            for key, value in metadata.items()
+            if key.startswith("hnsw:")
+        }
+
+    @staticmethod
+    def _similarity(distance: float) -> float:
+        """Convert an index distance into a similarity score (higher is better)"""
+        if HNSW_SPACE == "l2":
+            return 1.0 / (1.0 + distance)
+        # cosine and ip distances are both 1 - similarity
+        return 1.0 - distance
+
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Get the process-wide vector store instance
+
+    Returns:
+        Shared VectorStore
+    """
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                _vector_store = VectorStore()
+    return _vector_store
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+重排序测试模块
+检查 rerank() 对每种已注册的重排序器都能运行：交叉编码器、只实现接口中 score 的自定义重排序器，
+以及分批打分时词汇重排序器的分数与不分批一致
+交叉编码器使用注入的假模型，不需要 sentence-transformers，也不需要运行中的服务器
+"""
+
+import os
+import sys
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services.reranker import (
+    Reranker, CrossEncoderReranker, LexicalReranker, get_reranker, register_reranker, rerank
+)
+
+QUERY = "员工 在家 办公 政策"
+PASSAGES = ["员工 在家 办公 政策 说明"] + ["其他 内容 员工"] * 20 + ["在家 办公"]
+HITS = [{"vector_id": f"1-{i}", "content": passage, "score": 1.0 / (i + 1)} for i, passage in enumerate(PASSAGES)]
+
+# 颜色输出
+class Colors:
+    HEADER = '\033[95m'
+    OKGREEN = '\033[92m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+def print_colored(text: str, color: str) -> None:
+    """打印彩色文本"""
+    print(f"{color}{text}{Colors.ENDC}")
+
+class FakeCrossEncoderModel:
+    """按段落长度打分的假交叉编码器模型，越短分数越高"""
+    def predict(self, pairs):
+        return [1.0 / len(passage) for _, passage in pairs]
+
+class LengthReranker(Reranker):
+    """只实现接口中 score 的自定义重排序器"""
+    name = "test-length"
+
+    def score(self, query: str, passages: List[str], stats=None) -> List[float]:
+        return [float(len(passage)) for passage in passages]
+
+def test_cross_encoder() -> bool:
+    """测试交叉编码器经 rerank() 分批打分"""
+    print_colored("\n测试交叉编码器重排序...", Colors.HEADER)
+    reranker = CrossEncoderReranker()
+    reranker._model = FakeCrossEncoderModel()
+    try:
+        ranked = rerank(reranker, QUERY, HITS, limit=3, budget_ms=10000, batch_size=4)
+    except Exception as e:
+        print_colored(f"❌ 交叉编码器重排序出错: {e!r}", Colors.FAIL)
+        return False
+    top = [hit["content"] for hit in ranked]
+    print(f"前3条: {top}")
+    if top[0] == "在家 办公" and all("rerank_score" in hit for hit in ranked):
+        print_colored("✅ 交叉编码器重排序正常", Colors.OKGREEN)
+        return True
+    print_colored("❌ 交叉编码器重排序结果错误", Colors.FAIL)
+    return False
+
+def test_registered_reranker() -> bool:
+    """测试通过 register_reranker 注册、没有 prepare 的重排序器"""
+    print_colored("\n测试自定义重排序器...", Colors.HEADER)
+    register_reranker(LengthReranker)
+    try:
+        ranked = rerank(get_reranker(LengthReranker.name), QUERY, HITS, limit=1, budget_ms=10000, batch_size=4)
+    except Exception as e:
+        print_colored(f"❌ 自定义重排序器出错: {e!r}", Colors.FAIL)
+        return False
+    if ranked[0]["content"] == PASSAGES[0]:
+        print_colored("✅ 自定义重排序器正常", Colors.OKGREEN)
+        return True
+    print_colored("❌ 自定义重排序器结果错误", Colors.FAIL)
+    return False
+
+def test_lexical_batches() -> bool:
+    """测试词汇重排序器分批打分与不分批的分数一致"""
+    print_colored("\n测试词汇重排序器分批打分...", Colors.HEADER)
+    reranker = LexicalReranker()
+    batched = rerank(reranker, QUERY, HITS, limit=len(HITS), budget_ms=10000, batch_size=4)
+    single = rerank(reranker, QUERY, HITS, limit=len(HITS), budget_ms=10000, batch_size=len(HITS))
+    if [hit["rerank_score"] for hit in batched] == [hit["rerank_score"] for hit in single]:
+        print_colored("✅ 分批分数一致", Colors.OKGREEN)
+        return True
+    print_colored("❌ 分批分数不一致", Colors.FAIL)
+    return False
+
+def run_reranker_tests() -> bool:
+    """运行所有重排序测试"""
+    print_colored("=" * 60, Colors.BOLD)
+    print_colored("重排序测试", Colors.BOLD)
+    print_colored("=" * 60, Colors.BOLD)
+
+    cross_encoder_ok = test_cross_encoder()
+    registered_ok = test_registered_reranker()
+    lexical_ok = test_lexical_batches()
+
+    # 输出测试结果摘要
+    print_colored("\n" + "=" * 60, Colors.BOLD)
+    print(f"交叉编码器: {'✅ 通过' if cross_encoder_ok else '❌ 失败'}")
+    print(f"自定义重排序器: {'✅ 通过' if registered_ok else '❌ 失败'}")
+    print(f"词汇重排序器分批: {'✅ 通过' if lexical_ok else '❌ 失败'}")
+
+    all_passed = cross_encoder_ok and registered_ok and lexical_ok
+    print_colored(f"\n总体结果: {'全部通过' if all_passed else '部分失败'}", Colors.OKGREEN if all_passed else Colors.FAIL)
+    return all_passed
+
+if __name__ == "__main__":
+    success = run_reranker_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+角色列表查询测试模块
+在内存SQLite数据库中统计 crud.get_roles 执行的SQL条数，
+确保角色列表的用户数和权限数由聚合子查询得到，SQL条数不随用户数量增长，也不加载用户对象
+不需要运行中的服务器
+"""
+
+import os
+import sys
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.common import crud
+from backend.common.pagination import count_cache
+
+# crud 使用的模型类
+User, Role, Permission = crud.User, crud.Role, crud.Permission
+
+# 角色列表一页最多执行的SQL条数：总数 + 当前页（总数缓存命中时只有当前页）
+MAX_ROLE_LIST_QUERIES = 2
+
+# 颜色输出
+class Colors:
+    HEADER = '\033[95m'
+    OKGREEN = '\033[92m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+def print_colored(text: str, color: str) -> None:
+    """打印彩色文本"""
+    print(f"{color}{text}{Colors.ENDC}")
+
+class QueryCounter:
+    """统计引擎执行的SQL条数"""
+    def __init__(self, engine):
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def reset(self) -> None:
+        self.statements = []
+
+def create_test_db():
+    """创建内存数据库和会话，返回 (会话, SQL计数器)"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Role.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)(), QueryCounter(engine)
+
+def seed_users(db, start: int, count: int) -> None:
+    """创建用户并按角色ID顺序轮流分配角色"""
+    roles = db.query(Role).order_by(Role.id).all()
+    for i in range(start, start + count):
+        db.add(User(username=f"user{i}", email=f"user{i}@example.com", hashed_password="x", roles=[roles[i % len(roles)]]))
+    db.commit()
+
+def list_roles(db, counter: QueryCounter):
+    """清空会话和总数缓存后获取角色列表，返回 (角色, SQL条数)"""
+    db.expunge_all()
+    count_cache.clear()
+    counter.reset()
+    roles, total, _ = crud.get_roles(db, skip=0, limit=10)
+    return roles, len(counter.statements)
+
+def test_role_counts(db, counter: QueryCounter) -> bool:
+    """测试角色列表的用户数和权限数"""
+    print_colored("\n测试角色列表的用户数和权限数...", Colors.HEADER)
+    roles, _ = list_roles(db, counter)
+    counts = {role.name: (role.userCount, role.permissionCount) for role in roles}
+    print(f"角色统计: {counts}")
+    expected = {"admin": (34, 3), "user": (33, 1), "guest": (33, 0)}
+    if counts == expected:
+        print_colored("✅ 用户数和权限数正确", Colors.OKGREEN)
+        return True
+    print_colored(f"❌ 用户数和权限数错误，期望 {expected}", Colors.FAIL)
+    return False
+
+def test_role_list_query_count(db, counter: QueryCounter) -> bool:
+    """测试角色列表的SQL条数不随用户数量增长"""
+    print_colored("\n测试角色列表的SQL条数...", Colors.HEADER)
+    _, before = list_roles(db, counter)
+    seed_users(db, 100, 900)
+    _, after = list_roles(db, counter)
+    print(f"100个用户时执行 {before} 条SQL，1000个用户时执行 {after} 条SQL")
+    if before == after <= MAX_ROLE_LIST_QUERIES:
+        print_colored("✅ SQL条数不随用户数量增长", Colors.OKGREEN)
+        return True
+    print_colored(f"❌ SQL条数超出预期（最多 {MAX_ROLE_LIST_QUERIES} 条）: {counter.statements}", Colors.FAIL)
+    return False
+
+def test_role_list_loads_no_users(db, counter: QueryCounter) -> bool:
+    """测试角色列表不加载用户和权限对象"""
+    print_colored("\n测试角色列表不加载用户和权限...", Colors.HEADER)
+    roles, _ = list_roles(db, counter)  # 保持引用，会话的identity map是弱引用
+    loaded = {type(obj).__name__ for obj in db.identity_map.values()}
+    print(f"会话中加载的对象类型: {sorted(loaded)}")
+    if loaded <= {"Role"}:
+        print_colored("✅ 只加载了角色", Colors.OKGREEN)
+        return True
+    print_colored("❌ 角色列表加载了用户或权限", Colors.FAIL)
+    return False
+
+def run_roles_tests() -> bool:
+    """运行所有角色列表测试"""
+    print_colored("=" * 60, Colors.BOLD)
+    print_colored("角色列表查询测试", Colors.BOLD)
+    print_colored("=" * 60, Colors.BOLD)
+
+    db, counter = create_test_db()
+    try:
+        permissions = [Permission(name=f"menu:test{i}", menu_name=f"测试{i}") for i in range(3)]
+        roles = [
+            Role(name="admin", permissions=permissions),
+            Role(name="user", permissions=permissions[:1]),
+            Role(name="guest")
+        ]
+        db.add_all(roles)
+        db.commit()
+        seed_users(db, 0, 100)
+
+        counts_ok = test_role_counts(db, counter)
+        no_users_ok = test_role_list_loads_no_users(db, counter)
+        query_count_ok = test_role_list_query_count(db, counter)
+    finally:
+        db.close()
+
+    # 输出测试结果摘要
+    print_colored("\n" + "=" * 60, Colors.BOLD)
+    print(f"用户数和权限数: {'✅ 通过' if counts_ok else '❌ 失败'}")
+    print(f"不加载用户和权限: {'✅ 通过' if no_users_ok else '❌ 失败'}")
+    print(f"SQL条数: {'✅ 通过' if query_count_ok else '❌ 失败'}")
+
+    all_passed = counts_ok and no_users_ok and query_count_ok
+    print_colored(f"\n总体结果: {'全部通过' if all_passed else '部分失败'}", Colors.OKGREEN if all_passed else Colors.FAIL)
+    return all_passed
+
+if __name__ == "__main__":
+    success = run_roles_tests()
+    sys.exit(0 if success else 1)
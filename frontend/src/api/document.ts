@@ -59,6 +59,26 @@ export interface ImportFromDirectoryRequest {
   tags?: string
 }
 
+// 目录导入任务，导入在后台进行，通过任务接口查询进度
+export interface ImportJob {
+  id: number
+  knowledge_base_id: number
+  directory_path: string
+  recursive: boolean
+  status: 'pending' | 'running' | 'completed' | 'failed'
+  discovered_files: number
+  discovery_done: boolean // 目录遍历是否已结束，结束后discovered_files即总数
+  processed_files: number
+  created_files: number
+  updated_files: number
+  unchanged_files: number
+  failed_files: number
+  last_error?: string | null
+  started_at?: string | null
+  finished_at?: string | null
+  created_at?: string | null
+}
+
 // 文档管理API
 export const documentApi = {
   // 获取文档列表
@@ -152,12 +172,8 @@ export const documentApi = {
     })
   },
 
-  // 从目录导入文档
-  importFromDirectory: (data: ImportFromDirectoryRequest): Promise<{
-    message: string
-    imported_files: string[]
-    failed_files: string[]
-  }> => {
+  // 从目录导入文档，返回后台导入任务
+  importFromDirectory: async (data: ImportFromDirectoryRequest): Promise<ImportJob> => {
     const formData = new FormData()
     formData.append('kb_id', data.kb_id.toString())
     formData.append('directory_path', data.directory_path)
@@ -170,11 +186,18 @@ export const documentApi = {
       formData.append('tags', data.tags)
     }
     
-    return api.post('/documents/import-from-directory', formData, {
+    const response = await api.post<ImportJob>('/documents/import-from-directory', formData, {
       headers: {
         'Content-Type': 'multipart/form-data'
       }
     })
+    return response.data
+  },
+
+  // 查询目录导入任务进度
+  getImportJob: async (id: number): Promise<ImportJob> => {
+    const response = await api.get<ImportJob>(`/documents/import-jobs/${id}`)
+    return response.data
   },
 
   // 批量删除文档
@@ -255,6 +255,7 @@ export interface Role {
   description?: string
   permissions: Permission[]
   userCount?: number
+  permissionCount?: number // 角色列表只返回数量，权限明细通过 getRoleById 获取
 }
 
 // 创建角色请求类型